@@ -1,56 +1,259 @@
+import time
+_import_started = time.perf_counter()
+
 import os
+import click
 import logging
-import pandas as pd
+from contextvars import ContextVar
 from datetime import datetime
 from werkzeug.utils import secure_filename
-from flask import Flask, render_template, redirect, url_for, flash, request, send_from_directory, session
+from werkzeug.middleware.proxy_fix import ProxyFix
+from flask import (Flask, Blueprint, current_app, render_template, redirect, url_for, flash, request,
+                   send_from_directory, session, jsonify, Response, stream_with_context)
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
 from sqlalchemy.orm import DeclarativeBase
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
-
-# Initialize Flask app
+# Extensions are created unbound here and attached to the app in create_app()
 class Base(DeclarativeBase):
     pass
 
-db = SQLAlchemy(model_class=Base)
-app = Flask(__name__)
-app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key")
-
-# Database configuration
-database_url = os.environ.get("DATABASE_URL", "sqlite:///quizmaster.db")
-app.config["SQLALCHEMY_DATABASE_URI"] = database_url
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-
-# Set engine options based on database type
-if database_url.startswith('postgresql'):
-    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-        "pool_pre_ping": True,  # Test connections before using them
-        "pool_recycle": 300,    # Recycle connections after 5 minutes
-        "max_overflow": 15,     # Allow 15 connections beyond pool_size
-    }
+# Tenant of the current request or CLI job (a tenancy.TenantRef), see tenancy.py
+current_tenant = ContextVar('current_tenant', default=None)
 
-# File upload configuration
-UPLOAD_FOLDER = 'static/uploads'
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'csv', 'xlsx'}
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+class TenantSession(Session):
+    """
+    Sends every statement to the current tenant's own engine, if it has one
+    """
 
-# Ensure upload directory exists
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        tenant = current_tenant.get()
+        if (bind is None and tenant is not None and tenant.engine is not None
+                and not getattr(getattr(mapper, 'class_', None), '__tenant_global__', False)):
+            return tenant.engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
 
-# Initialize extensions
-db.init_app(app)
+db = SQLAlchemy(model_class=Base, session_options={'class_': TenantSession})
 login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = 'user_login'
+login_manager.login_view = 'main.user_login'
+bp = Blueprint('main', __name__)
+
+# File upload configuration
+UPLOAD_FOLDER = 'static/uploads'
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'csv', 'xlsx'}
 
 # Import models and forms
 from models import User, Admin, Subject, Chapter, Quiz, Question, Score
 from forms import (LoginForm, RegisterForm, SubjectForm, ChapterForm, QuizForm, 
                   QuestionForm, QuestionImportForm, UserProfileForm)
+from search import ensure_search_index, index_questions, search_questions
+from auth import LoginThrottled, hash_password, verify_password, check_login_allowed, login_succeeded, hash_metrics
+from identity_cache import identity_cache, load_cached_identity
+from exports import (SCORE_COLUMNS, QUESTION_COLUMNS, CONTENT_TYPES, parse_date, iter_score_rows,
+                     iter_question_rows, stream_export)
+from archive import archive_scores, user_statistics, load_archived_scores
+from deletes import (delete_quiz_cascade, delete_user_cascade, subject_has_chapters, chapter_has_quizzes,
+                     enable_sqlite_foreign_keys)
+from papers import (new_paper_seed, build_paper, attempt_paper, dump_paper, load_paper, load_paper_questions,
+                    original_option, invalidate_question_pool)
+from recommender import DEFAULT_TOP_K, record_answers, recommend_practice, practice_suggestions
+from progress import DEFAULT_POINTS, MAX_POINTS, series_cache, score_series
+from reports import ReportMetrics, build_snapshot, iter_reports, write_report_dir, stream_report_zip, pdf_available
+from tenancy import (init_tenancy, ensure_default_tenant, tenant_registry, tenant_scope, each_tenant,
+                     seed_admin, session_matches_tenant, stream_in_tenant)
+from logging_setup import configure_logging, parse_levels, LogSampler
+from backup import init_backups
+
+logger = logging.getLogger(__name__)
+
+_import_seconds = time.perf_counter() - _import_started
+
+
+def create_app(config=None):
+    """
+    Application factory. Only configures the app: no heavy imports and no
+    database round trips happen here (see init_db / `flask init-db`).
+    """
+    started = time.perf_counter()
+
+    app = Flask(__name__)
+    app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key")
+
+    # Database configuration
+    database_url = os.environ.get("DATABASE_URL", "sqlite:///quizmaster.db")
+    app.config["SQLALCHEMY_DATABASE_URI"] = database_url
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+
+    # Set engine options based on database type
+    if database_url.startswith('postgresql'):
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+            "pool_pre_ping": True,  # Test connections before using them
+            "pool_recycle": 300,    # Recycle connections after 5 minutes
+            "max_overflow": 15,     # Allow 15 connections beyond pool_size
+        }
+
+    # Institutions (see tenancy.py); hosts without a tenant of their own get DEFAULT_TENANT
+    app.config["DEFAULT_TENANT"] = os.environ.get("DEFAULT_TENANT", "default")
+    app.config["TENANT_CACHE_TTL"] = int(os.environ.get("TENANT_CACHE_TTL", 30))  # seconds
+
+    # Password hashing and login throttling (see auth.py)
+    app.config["PASSWORD_HASH_METHOD"] = os.environ.get("PASSWORD_HASH_METHOD", "scrypt")
+    app.config["AUTH_HASH_WORKERS"] = int(os.environ.get("AUTH_HASH_WORKERS", 2))
+    app.config["AUTH_HASH_QUEUE_SIZE"] = int(os.environ.get("AUTH_HASH_QUEUE_SIZE", 16))
+    app.config["AUTH_HASH_TIMEOUT"] = 10  # seconds
+    app.config["LOGIN_IP_BURST"] = 20       # attempts, refilled at LOGIN_IP_RATE per second
+    app.config["LOGIN_IP_RATE"] = 0.2
+    app.config["LOGIN_ACCOUNT_BURST"] = 5
+    app.config["LOGIN_ACCOUNT_RATE"] = 0.05
+    # Reverse proxies in front of the app; their X-Forwarded-* headers give the client address
+    app.config["TRUSTED_PROXY_HOPS"] = int(os.environ.get("TRUSTED_PROXY_HOPS", 0))
+
+    # Identity cache for current_user resolution (see identity_cache.py)
+    app.config["IDENTITY_CACHE_SIZE"] = int(os.environ.get("IDENTITY_CACHE_SIZE", 10000))
+    app.config["IDENTITY_CACHE_TTL"] = int(os.environ.get("IDENTITY_CACHE_TTL", 30))  # seconds
+    app.config["PROGRESS_CACHE_SIZE"] = int(os.environ.get("PROGRESS_CACHE_SIZE", 2048))
+    app.config["PROGRESS_CACHE_TTL"] = int(os.environ.get("PROGRESS_CACHE_TTL", 60))  # seconds
+
+    app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+
+    # Logging (see logging_setup.py); LOG_LEVELS is e.g. "sqlalchemy.engine=INFO,search=DEBUG"
+    app.config["LOG_LEVEL"] = os.environ.get("LOG_LEVEL", "INFO")
+    app.config["LOG_LEVELS"] = parse_levels(os.environ.get("LOG_LEVELS"))
+    app.config["LOG_FORMAT"] = os.environ.get("LOG_FORMAT", "json")  # or "text"
+    app.config["LOG_FILE"] = os.environ.get("LOG_FILE")
+
+    # Attempts older than this are moved to the cold store by `flask archive-scores`
+    app.config["SCORE_ARCHIVE_DAYS"] = int(os.environ.get("SCORE_ARCHIVE_DAYS", 365))
+
+    # Suggestions kept per user by `flask recommend-practice`
+    app.config["PRACTICE_TOP_K"] = int(os.environ.get("PRACTICE_TOP_K", DEFAULT_TOP_K))
+
+    # Worker processes for batch score reports; 0 means one per CPU
+    app.config["REPORT_WORKERS"] = int(os.environ.get("REPORT_WORKERS", 0))
+
+    # Database snapshots (see backup.py); taken automatically before migrate_db.py runs
+    app.config["BACKUP_DIR"] = os.environ.get("BACKUP_DIR", os.path.join(app.instance_path, 'backups'))
+    app.config["BACKUP_KEEP"] = int(os.environ.get("BACKUP_KEEP", 7))  # snapshots per database
+
+    if config:
+        app.config.update(config)
+
+    configure_logging(app)
+
+    hops = app.config["TRUSTED_PROXY_HOPS"]
+    if hops:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=hops, x_proto=hops, x_host=hops)
+
+    # Ensure upload directory exists
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+
+    # Initialize extensions
+    db.init_app(app)
+    with app.app_context():
+        enable_sqlite_foreign_keys(db.engine)
+    login_manager.init_app(app)
+    identity_cache.configure(app.config["IDENTITY_CACHE_SIZE"], app.config["IDENTITY_CACHE_TTL"])
+    series_cache.configure(app.config["PROGRESS_CACHE_SIZE"], app.config["PROGRESS_CACHE_TTL"])
+    init_tenancy(app)
+    init_backups(app)
+
+    app.register_blueprint(bp)
+    app.cli.command('init-db')(init_db_command)
+    app.cli.command('archive-scores')(archive_scores_command)
+    app.cli.command('recommend-practice')(recommend_practice_command)
+    app.cli.command('score-reports')(score_reports_command)
+
+    setup_seconds = time.perf_counter() - started
+    app.config["STARTUP_TIMINGS"] = {
+        'import_ms': round(_import_seconds * 1000, 1),
+        'create_app_ms': round(setup_seconds * 1000, 1),
+    }
+    logger.info("App created in %.1f ms (module imports took %.1f ms)",
+                setup_seconds * 1000, _import_seconds * 1000)
+    return app
+
+
+def init_db(admin_password=None):
+    """
+    Create the schema, the default tenant, its search index and admin account.
+    Returns the admin password if one was generated.
+    """
+    db.create_all()
+    tenant = ensure_default_tenant()
+    with tenant_scope(tenant_registry.ref(tenant)):
+        ensure_search_index()
+        return seed_admin(admin_password)
+
+
+@click.option('--admin-password', help='Password for the admin account (default: a random one, printed once)')
+def init_db_command(admin_password):
+    """Create database tables and the default admin account."""
+    generated = init_db(admin_password)
+    print("Database initialized.")
+    if generated:
+        print(f"Admin account: admin / {generated}")
+
+
+@click.option('--days', type=int, default=None,
+              help='Archive attempts older than this many days (default: SCORE_ARCHIVE_DAYS)')
+def archive_scores_command(days):
+    """Move old quiz attempts into the compressed archive."""
+    days = days if days is not None else current_app.config['SCORE_ARCHIVE_DAYS']
+    total = 0
+    for tenant in each_tenant():
+        total += archive_scores(days, progress=lambda n: print(f"Archived {n} attempts..."))
+    print(f"Done. {total} attempts archived.")
+
+
+@click.option('--top-k', type=int, default=None, help='Suggestions to keep per user (default: PRACTICE_TOP_K)')
+def recommend_practice_command(top_k):
+    """Recompute every user's "practice next" suggestions."""
+    top_k = top_k if top_k is not None else current_app.config['PRACTICE_TOP_K']
+    total = 0
+    for tenant in each_tenant():
+        total += recommend_practice(top_k, progress=lambda n: print(f"Processed {n} users..."))
+    print(f"Done. Suggestions computed for {total} users.")
+
+
+@click.argument('quiz_id', type=int)
+@click.option('--out', default=None, help='Output directory, or a .zip file (default: reports/quiz_<id>)')
+@click.option('--pdf', is_flag=True, help='Render PDF instead of HTML (needs WeasyPrint)')
+@click.option('--workers', type=int, default=None, help='Worker processes (default: REPORT_WORKERS)')
+@click.option('--tenant', default=None, help='Tenant slug (default: DEFAULT_TENANT)')
+def score_reports_command(quiz_id, out, pdf, workers, tenant):
+    """Render per-attempt and cohort score reports for a whole quiz."""
+    from models import Tenant
+
+    slug = tenant or current_app.config['DEFAULT_TENANT']
+    row = Tenant.query.filter_by(slug=slug).first()
+    if row is None and tenant:
+        raise click.ClickException(f'No tenant {slug}')
+    workers = workers if workers is not None else current_app.config['REPORT_WORKERS']
+    out = out or os.path.join('reports', f'quiz_{quiz_id}')
+
+    metrics = ReportMetrics()
+    with tenant_scope(tenant_registry.ref(row) if row else None):
+        quiz = db.session.get(Quiz, quiz_id)
+        if quiz is None:
+            raise click.ClickException(f'No quiz {quiz_id}')
+        snapshot, attempts = build_snapshot(quiz, metrics)
+
+    try:
+        reports = iter_reports(snapshot, attempts, pdf=pdf, workers=workers or None, metrics=metrics)
+        if out.endswith('.zip'):
+            with open(out, 'wb') as f:
+                for chunk in stream_report_zip(reports, metrics):
+                    f.write(chunk)
+        else:
+            write_report_dir(reports, out, metrics)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+
+    stats = metrics.snapshot()
+    print(f"Wrote {stats['reports']} reports ({stats['bytes'] / 1024:.0f} KiB) to {out} "
+          f"in {stats['elapsed_ms'] / 1000:.2f}s, {stats['reports_per_second']} reports/s")
+
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -58,18 +261,30 @@ def allowed_file(filename):
 def handle_file_upload(file, folder=''):
     if file and allowed_file(file.filename):
         filename = secure_filename(file.filename)
-        path = os.path.join(app.config['UPLOAD_FOLDER'], folder, filename)
+        path = os.path.join(current_app.config['UPLOAD_FOLDER'], folder, filename)
         os.makedirs(os.path.dirname(path), exist_ok=True)
         file.save(path)
         return os.path.join(folder, filename) if folder else filename
     return None
 
-@app.route('/admin/quizzes/<int:quiz_id>/questions', methods=['GET', 'POST'])
+def import_row_text(row):
+    """
+    Statement and options of an uploaded question row, as they will be stored
+    """
+    import pandas as pd
+    option_4 = row['option_4']
+    if pd.isna(option_4) or str(option_4).strip().lower() == 'none':
+        option_4 = "Not applicable"
+    options = [str(row['option_1']).strip(), str(row['option_2']).strip(),
+               str(row['option_3']).strip(), str(option_4).strip()]
+    return str(row['question_statement']).strip(), options
+
+@bp.route('/admin/quizzes/<int:quiz_id>/questions', methods=['GET', 'POST'])
 @login_required
 def manage_questions(quiz_id):
     if not isinstance(current_user, Admin):
         flash('Access denied. Admin privileges required.', 'danger')
-        return redirect(url_for('user_dashboard'))
+        return redirect(url_for('main.user_dashboard'))
 
     quiz = Quiz.query.get_or_404(quiz_id)
     questions = Question.query.filter_by(quiz_id=quiz_id).all()
@@ -83,10 +298,14 @@ def manage_questions(quiz_id):
     import_form.quiz_id.data = quiz_id
 
     if request.method == 'POST':
+        # Heavy dependencies (numpy, pandas/openpyxl) are only needed when
+        # questions are added, so they are imported here rather than at startup
+        from dedup import ImportDeduplicator, index_question_signatures
+
         form_type = request.form.get('form_type')
-        logging.debug(f"Form type: {form_type}")
-        logging.debug(f"Form data: {request.form}")
-        logging.debug(f"Files: {request.files}")
+        # Lazy %-style arguments: nothing is formatted unless DEBUG is enabled
+        logger.debug("Form type: %s", form_type)
+        logger.debug("Form fields: %s, files: %s", list(request.form.keys()), list(request.files.keys()))
 
         if form_type == 'question':
             if question_form.validate_on_submit():
@@ -109,36 +328,50 @@ def manage_questions(quiz_id):
                         correct_option=int(question_form.correct_option.data)
                     )
                     db.session.add(question)
+                    db.session.flush()
+                    index_questions([question])
+                    index_question_signatures([question])
                     db.session.commit()
+                    invalidate_question_pool(quiz_id)
                     flash('Question added successfully!', 'success')
                 except Exception as e:
                     db.session.rollback()
                     flash(f'Error adding question: {str(e)}', 'danger')
-                    logging.error(f"Error adding question: {str(e)}")
+                    logger.error("Error adding question: %s", e)
             else:
                 for field, errors in question_form.errors.items():
                     for error in errors:
                         flash(f'{field}: {error}', 'danger')
-                        logging.error(f"Form validation error - {field}: {error}")
+                        logger.error("Form validation error - %s: %s", field, error)
 
         elif form_type == 'import':
             if import_form.validate_on_submit():
                 file_path = handle_file_upload(import_form.file.data)
                 if file_path:
+                    import pandas as pd
                     try:
                         if file_path.endswith('.csv'):
-                            df = pd.read_csv(os.path.join(app.config['UPLOAD_FOLDER'], file_path), dtype=str)
+                            df = pd.read_csv(os.path.join(current_app.config['UPLOAD_FOLDER'], file_path), dtype=str)
                         else:  # Excel file
-                            df = pd.read_excel(os.path.join(app.config['UPLOAD_FOLDER'], file_path), dtype=str)
+                            df = pd.read_excel(os.path.join(current_app.config['UPLOAD_FOLDER'], file_path), dtype=str)
 
                         required_columns = ['question_statement', 'option_1', 'option_2', 'option_3', 'option_4', 'correct_option']
                         if not all(col in df.columns for col in required_columns):
                             missing_cols = [col for col in required_columns if col not in df.columns]
                             raise ValueError(f"Missing required columns: {', '.join(missing_cols)}")
 
+                        skip_duplicates = import_form.duplicate_action.data == 'skip'
+                        deduplicator = ImportDeduplicator(current_app.config.get('DEDUP_THRESHOLD', 0.8))
+                        # Candidates for the whole file are read up front, not per row
+                        deduplicator.prefetch(import_row_text(row) for _, row in df.iterrows())
+                        row_log = LogSampler(every=100)
+                        imported = []
+                        signatures = []
+                        duplicates = []
                         for index, row in df.iterrows():
                             try:
-                                logging.info(f"Processing row {index + 1}: {row}")
+                                if row_log.should_log():
+                                    logger.debug("Processing row %d", index + 1)
 
                                 # Ensure all required fields are present and not empty (except option_4 which can be "None")
                                 for field in required_columns:
@@ -159,48 +392,68 @@ def manage_questions(quiz_id):
                                     raise ValueError(f"Invalid correct_option value in row {index + 1}: {str(e)}")
 
                                 # Create and add question with proper type handling
-                                option_4_value = str(row['option_4']).strip()
-                                if option_4_value.lower() == 'none':
-                                    option_4_value = "Not applicable"
+                                statement, options = import_row_text(row)
+                                signature, duplicate_of = deduplicator.check(statement, options)
+                                if duplicate_of:
+                                    duplicates.append((index + 1, duplicate_of))
+                                    if skip_duplicates:
+                                        logger.debug("Skipping near-duplicate row %d: %s", index + 1, duplicate_of)
+                                        continue
+                                deduplicator.add(index + 1, signature)
 
                                 question = Question(
                                     quiz_id=quiz_id,
-                                    question_statement=str(row['question_statement']).strip(),
+                                    question_statement=statement,
                                     question_image=None if pd.isna(row.get('image_url')) else str(row.get('image_url')),
-                                    option_1=str(row['option_1']).strip(),
-                                    option_2=str(row['option_2']).strip(),
-                                    option_3=str(row['option_3']).strip(),
-                                    option_4=option_4_value,
+                                    option_1=options[0],
+                                    option_2=options[1],
+                                    option_3=options[2],
+                                    option_4=options[3],
                                     correct_option=correct_option
                                 )
                                 db.session.add(question)
-                                logging.info(f"Successfully added question from row {index + 1}")
+                                imported.append(question)
+                                signatures.append(signature)
 
                             except Exception as row_error:
                                 db.session.rollback()
-                                logging.error(f"Error processing row {index + 1}: {row}")
-                                logging.error(f"Error details: {str(row_error)}")
+                                logger.error("Error processing row %d: %s", index + 1, row_error)
                                 raise ValueError(f"Error in row {index + 1}: {str(row_error)}")
 
+                        db.session.flush()
+                        index_questions(imported)
+                        index_question_signatures(imported, signatures)
                         db.session.commit()
-                        flash(f'Successfully imported {len(df)} questions!', 'success')
-                        logging.info(f"Successfully imported {len(df)} questions")
+                        invalidate_question_pool(quiz_id)
+                        flash(f'Successfully imported {len(imported)} questions!', 'success')
+                        logger.info("Successfully imported %d questions", len(imported),
+                                    extra={'quiz_id': quiz_id, 'rows': len(df), 'duplicates': len(duplicates)})
+
+                        if duplicates:
+                            details = []
+                            for row_number, match in duplicates[:10]:
+                                target = f"question #{match['question_id']}" if 'question_id' in match else f"row {match['row']}"
+                                details.append(f"row {row_number} (~{round(match['similarity'] * 100)}% similar to {target})")
+                            if len(duplicates) > 10:
+                                details.append(f"and {len(duplicates) - 10} more")
+                            verb = 'Skipped' if skip_duplicates else 'Imported but flagged'
+                            flash(f"{verb} {len(duplicates)} near-duplicate rows: {', '.join(details)}", 'warning')
 
                     except Exception as e:
                         db.session.rollback()
                         flash(f'Error importing questions: {str(e)}', 'danger')
-                        logging.error(f"Error importing questions: {str(e)}")
+                        logger.error("Error importing questions: %s", e)
                     finally:
-                        if file_path and os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], file_path)):
-                            os.remove(os.path.join(app.config['UPLOAD_FOLDER'], file_path))
+                        if file_path and os.path.exists(os.path.join(current_app.config['UPLOAD_FOLDER'], file_path)):
+                            os.remove(os.path.join(current_app.config['UPLOAD_FOLDER'], file_path))
 
             else:
                 for field, errors in import_form.errors.items():
                     for error in errors:
                         flash(f'{field}: {error}', 'danger')
-                        logging.error(f"Import form validation error - {field}: {error}")
+                        logger.error("Import form validation error - %s: %s", field, error)
 
-        return redirect(url_for('manage_questions', quiz_id=quiz_id))
+        return redirect(url_for('main.manage_questions', quiz_id=quiz_id))
 
     return render_template('admin/questions.html', 
                          quiz=quiz, 
@@ -208,22 +461,55 @@ def manage_questions(quiz_id):
                          question_form=question_form,
                          import_form=import_form)
 
+@bp.route('/admin/questions/search')
+@login_required
+def search_question_bank():
+    if not isinstance(current_user, Admin):
+        return jsonify({'error': 'Admin privileges required'}), 403
+
+    query = request.args.get('q', '').strip()
+    limit = min(request.args.get('limit', 20, type=int), 100)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    if not query:
+        return jsonify({'query': query, 'results': []})
+
+    results = search_questions(
+        query,
+        subject_id=request.args.get('subject_id', type=int),
+        chapter_id=request.args.get('chapter_id', type=int),
+        quiz_id=request.args.get('quiz_id', type=int),
+        limit=limit,
+        offset=offset
+    )
+    return jsonify({'query': query, 'results': results})
+
+@bp.route('/admin/metrics')
+@login_required
+def admin_metrics():
+    if not isinstance(current_user, Admin):
+        return jsonify({'error': 'Admin privileges required'}), 403
+
+    return jsonify({'startup': current_app.config['STARTUP_TIMINGS'],
+                    'password_hashing': hash_metrics.snapshot(),
+                    'identity_cache': identity_cache.stats(),
+                    'progress_cache': series_cache.stats()})
+
 # View score details
-@app.route('/score/<int:score_id>')
+@bp.route('/score/<int:score_id>')
 @login_required
 def view_score(score_id):
     if isinstance(current_user, Admin):
-        return redirect(url_for('admin_dashboard'))
+        return redirect(url_for('main.admin_dashboard'))
 
     score = Score.query.get_or_404(score_id)
 
     # Ensure user can only see their own scores
     if score.user_id != current_user.id:
         flash('You do not have permission to view this score', 'danger')
-        return redirect(url_for('user_dashboard'))
+        return redirect(url_for('main.user_dashboard'))
 
     quiz = score.quiz
-    questions = Question.query.filter_by(quiz_id=quiz.id).all()
+    questions = load_paper_questions(attempt_paper(score, quiz))
 
     # Get user answers from session if available
     user_answers = session.get(f'user_answers_{score.id}', {})
@@ -247,11 +533,7 @@ def view_score(score_id):
     if (correct_answers + wrong_answers) > 0:
         accuracy = round((correct_answers / (correct_answers + wrong_answers)) * 100)
 
-    # Get historical score data for progress chart
-    user_scores = Score.query.filter_by(user_id=current_user.id).order_by(Score.time_stamp_of_attempt).limit(10).all()
-    progress_labels = [s.time_stamp_of_attempt.strftime('%d/%m/%Y') for s in user_scores]
-    progress_data = [s.total_scored for s in user_scores]
-
+    # The progress chart loads its data from main.progress_series
     return render_template('user/results.html', 
                           quiz=quiz,
                           score=score,
@@ -260,26 +542,26 @@ def view_score(score_id):
                           not_attempted=not_attempted,
                           total_questions=len(questions),
                           accuracy=accuracy,
-                          progress_labels=progress_labels,
-                          progress_data=progress_data,
                           user_answers=user_answers,
                           questions=questions)
 
-@app.route('/quiz/<int:quiz_id>/review/<int:score_id>')
+@bp.route('/quiz/<int:quiz_id>/review/<int:score_id>')
 @login_required
 def review_quiz(quiz_id, score_id):
     if isinstance(current_user, Admin):
-        return redirect(url_for('admin_dashboard'))
+        return redirect(url_for('main.admin_dashboard'))
 
     score = Score.query.get_or_404(score_id)
 
     # Ensure user can only see their own scores
     if score.user_id != current_user.id:
         flash('You do not have permission to view this score', 'danger')
-        return redirect(url_for('user_dashboard'))
+        return redirect(url_for('main.user_dashboard'))
 
     quiz = Quiz.query.get_or_404(quiz_id)
-    questions = Question.query.filter_by(quiz_id=quiz_id).all()
+    # Rebuild the student's own paper (same questions, order and option order)
+    paper = attempt_paper(score, quiz)
+    questions = load_paper_questions(paper)
 
     # Get user answers from session if available
     session_answers = session.get(f'user_answers_{score.id}', {})
@@ -304,95 +586,102 @@ def review_quiz(quiz_id, score_id):
                           quiz=quiz,
                           score=score,
                           questions=questions,
+                          option_orders=paper.option_orders,
                           user_answers=user_answers,
                           correct_answers=correct_answers,
                           wrong_answers=wrong_answers,
                           not_attempted=not_attempted)
 
     # Add route for serving uploaded files
-@app.route('/uploads/<path:filename>')
+@bp.route('/uploads/<path:filename>')
 def uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    return send_from_directory(current_app.config['UPLOAD_FOLDER'], filename)
 
 @login_manager.user_loader
 def load_user(user_id):
+    if not session_matches_tenant():
+        return None
     try:
-        # First try to load as admin
-        user = Admin.query.get(int(user_id))
-        if user:
-            return user
-        # If not admin, try as regular user
-        return User.query.get(int(user_id))
-    except:
+        return load_cached_identity(user_id)
+    except Exception:
         return None
 
 # Authentication routes
-@app.route('/')
+@bp.route('/')
 def index():
     if current_user.is_authenticated:
         # Always redirect to user dashboard regardless of who is logged in
         # Admin must explicitly go to /admin
-        return redirect(url_for('user_dashboard'))
-    return redirect(url_for('user_login'))
+        return redirect(url_for('main.user_dashboard'))
+    return redirect(url_for('main.user_login'))
 
-@app.route('/admin/login', methods=['GET', 'POST'])
+@bp.route('/admin/login', methods=['GET', 'POST'])
 def admin_login():
     # If already logged in as admin, redirect to admin dashboard
     if current_user.is_authenticated and isinstance(current_user, Admin):
-        return redirect(url_for('admin_dashboard'))
+        return redirect(url_for('main.admin_dashboard'))
 
     # For user, we'll show the admin login page instead of redirecting
     form = LoginForm()
     if form.validate_on_submit():
         if form.email.data != 'admin':
             flash('Invalid admin username', 'danger')
-            return redirect(url_for('admin_login'))
-
-        admin = Admin.query.filter_by(username='admin').first()
-        if admin and check_password_hash(admin.password, form.password.data):
-            # Login as admin without logging out the current user
-            login_user(admin)
-            return redirect(url_for('admin_dashboard'))
-        flash('Invalid admin credentials', 'danger')
+            return redirect(url_for('main.admin_login'))
+
+        try:
+            check_login_allowed(request.remote_addr, 'admin')
+            admin = Admin.query.filter_by(username='admin').first()
+            if admin and verify_password(admin, form.password.data):
+                login_succeeded('admin')
+                # Login as admin without logging out the current user
+                login_user(admin)
+                return redirect(url_for('main.admin_dashboard'))
+            flash('Invalid admin credentials', 'danger')
+        except LoginThrottled as e:
+            flash(str(e), 'danger')
     return render_template('auth/admin_login.html', form=form)
 
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
 def user_login():
     # If already logged in as user, redirect to user dashboard
     if current_user.is_authenticated and isinstance(current_user, User):
-        return redirect(url_for('user_dashboard'))
+        return redirect(url_for('main.user_dashboard'))
     # If already logged in as admin, show user login page
 
 
     form = LoginForm()
     if form.validate_on_submit():
         try:
+            check_login_allowed(request.remote_addr, form.email.data)
             user = User.query.filter_by(email=form.email.data).first()
-            if user and check_password_hash(user.password, form.password.data):
+            if user and verify_password(user, form.password.data):
+                login_succeeded(form.email.data)
                 # Login as user without logging out the current admin
                 login_user(user)
-                return redirect(url_for('user_dashboard'))
+                return redirect(url_for('main.user_dashboard'))
             flash('Invalid email or password', 'danger')
+        except LoginThrottled as e:
+            flash(str(e), 'danger')
         except Exception as e:
-            logging.error(f"Database error during login: {str(e)}")
+            logger.error("Database error during login: %s", e)
             flash('Login failed due to a server error. Please try again later.', 'danger')
             db.session.rollback()  # Roll back any failed transaction
     return render_template('auth/login.html', form=form)
 
-@app.route('/register', methods=['GET', 'POST'])
+@bp.route('/register', methods=['GET', 'POST'])
 def register():
     if current_user.is_authenticated:
-        return redirect(url_for('user_dashboard'))
+        return redirect(url_for('main.user_dashboard'))
 
     form = RegisterForm()
     if form.validate_on_submit():
         if User.query.filter_by(email=form.email.data).first():
             flash('Email already registered', 'danger')
-            return redirect(url_for('register'))
+            return redirect(url_for('main.register'))
 
         user = User(
             email=form.email.data,
-            password=generate_password_hash(form.password.data),
+            password=hash_password(form.password.data),
             full_name=form.full_name.data,
             qualification=form.qualification.data,
             dob=form.dob.data
@@ -400,17 +689,17 @@ def register():
         db.session.add(user)
         db.session.commit()
         flash('Registration successful!', 'success')
-        return redirect(url_for('user_login'))
+        return redirect(url_for('main.user_login'))
     return render_template('auth/register.html', form=form)
 
-@app.route('/logout')
+@bp.route('/logout')
 @login_required
 def logout():
     logout_user()
-    return redirect(url_for('user_login'))
+    return redirect(url_for('main.user_login'))
 
 # Admin routes
-@app.route('/admin')
+@bp.route('/admin')
 def admin_dashboard():
     # If logged in as admin, show dashboard
     if current_user.is_authenticated and isinstance(current_user, Admin):
@@ -419,14 +708,14 @@ def admin_dashboard():
         total_quizzes = Quiz.query.count()
         return render_template('admin/dashboard.html', subjects=subjects, users=users, total_quizzes=total_quizzes)
     # If not logged in or logged in as user, redirect to admin login
-    return redirect(url_for('admin_login'))
+    return redirect(url_for('main.admin_login'))
 
-@app.route('/admin/subjects', methods=['GET', 'POST'])
+@bp.route('/admin/subjects', methods=['GET', 'POST'])
 @login_required
 def manage_subjects():
     if not isinstance(current_user, Admin):
         flash('Access denied. Admin privileges required.', 'danger')
-        return redirect(url_for('user_dashboard'))
+        return redirect(url_for('main.user_dashboard'))
 
     form = SubjectForm()
     if form.validate_on_submit():
@@ -434,17 +723,17 @@ def manage_subjects():
         db.session.add(subject)
         db.session.commit()
         flash('Subject added successfully!', 'success')
-        return redirect(url_for('manage_subjects'))
+        return redirect(url_for('main.manage_subjects'))
 
     subjects = Subject.query.all()
     return render_template('admin/subjects.html', form=form, subjects=subjects)
 
-@app.route('/admin/subjects/<int:subject_id>/edit', methods=['GET', 'POST'])
+@bp.route('/admin/subjects/<int:subject_id>/edit', methods=['GET', 'POST'])
 @login_required
 def edit_subject(subject_id):
     if not isinstance(current_user, Admin):
         flash('Access denied. Admin privileges required.', 'danger')
-        return redirect(url_for('user_dashboard'))
+        return redirect(url_for('main.user_dashboard'))
 
     subject = Subject.query.get_or_404(subject_id)
     form = SubjectForm(obj=subject)
@@ -455,24 +744,24 @@ def edit_subject(subject_id):
 
         db.session.commit()
         flash('Subject updated successfully!', 'success')
-        return redirect(url_for('manage_subjects'))
+        return redirect(url_for('main.manage_subjects'))
 
     return render_template('admin/edit_subject.html', form=form, subject=subject)
 
-@app.route('/admin/subjects/<int:subject_id>/delete', methods=['POST'])
+@bp.route('/admin/subjects/<int:subject_id>/delete', methods=['POST'])
 @login_required
 def delete_subject(subject_id):
     if not isinstance(current_user, Admin):
         flash('Access denied. Admin privileges required.', 'danger')
-        return redirect(url_for('user_dashboard'))
+        return redirect(url_for('main.user_dashboard'))
 
     subject = Subject.query.get_or_404(subject_id)
 
     try:
         # Check if there are chapters associated with this subject
-        if subject.chapters:
+        if subject_has_chapters(subject.id):
             flash('Cannot delete subject. Please delete associated chapters first.', 'danger')
-            return redirect(url_for('manage_subjects'))
+            return redirect(url_for('main.manage_subjects'))
 
         db.session.delete(subject)
         db.session.commit()
@@ -481,14 +770,14 @@ def delete_subject(subject_id):
         db.session.rollback()
         flash(f'Error deleting subject: {str(e)}', 'danger')
 
-    return redirect(url_for('manage_subjects'))
+    return redirect(url_for('main.manage_subjects'))
 
-@app.route('/admin/chapters', methods=['GET', 'POST'])
+@bp.route('/admin/chapters', methods=['GET', 'POST'])
 @login_required
 def manage_chapters():
     if not isinstance(current_user, Admin):
         flash('Access denied. Admin privileges required.', 'danger')
-        return redirect(url_for('user_dashboard'))
+        return redirect(url_for('main.user_dashboard'))
 
     form = ChapterForm()
     # Populate subject choices
@@ -503,17 +792,17 @@ def manage_chapters():
         db.session.add(chapter)
         db.session.commit()
         flash('Chapter added successfully!', 'success')
-        return redirect(url_for('manage_chapters'))
+        return redirect(url_for('main.manage_chapters'))
 
     chapters = Chapter.query.all()
     return render_template('admin/chapters.html', form=form, chapters=chapters)
 
-@app.route('/admin/chapters/<int:chapter_id>/edit', methods=['GET', 'POST'])
+@bp.route('/admin/chapters/<int:chapter_id>/edit', methods=['GET', 'POST'])
 @login_required
 def edit_chapter(chapter_id):
     if not isinstance(current_user, Admin):
         flash('Access denied. Admin privileges required.', 'danger')
-        return redirect(url_for('user_dashboard'))
+        return redirect(url_for('main.user_dashboard'))
 
     chapter = Chapter.query.get_or_404(chapter_id)
     form = ChapterForm(obj=chapter)
@@ -526,24 +815,24 @@ def edit_chapter(chapter_id):
 
         db.session.commit()
         flash('Chapter updated successfully!', 'success')
-        return redirect(url_for('manage_chapters'))
+        return redirect(url_for('main.manage_chapters'))
 
     return render_template('admin/edit_chapter.html', form=form, chapter=chapter)
 
-@app.route('/admin/chapters/<int:chapter_id>/delete', methods=['POST'])
+@bp.route('/admin/chapters/<int:chapter_id>/delete', methods=['POST'])
 @login_required
 def delete_chapter(chapter_id):
     if not isinstance(current_user, Admin):
         flash('Access denied. Admin privileges required.', 'danger')
-        return redirect(url_for('user_dashboard'))
+        return redirect(url_for('main.user_dashboard'))
 
     chapter = Chapter.query.get_or_404(chapter_id)
 
     try:
         # Check if there are quizzes associated with this chapter
-        if chapter.quizzes:
+        if chapter_has_quizzes(chapter.id):
             flash('Cannot delete chapter. Please delete associated quizzes first.', 'danger')
-            return redirect(url_for('manage_chapters'))
+            return redirect(url_for('main.manage_chapters'))
 
         db.session.delete(chapter)
         db.session.commit()
@@ -552,14 +841,14 @@ def delete_chapter(chapter_id):
         db.session.rollback()
         flash(f'Error deleting chapter: {str(e)}', 'danger')
 
-    return redirect(url_for('manage_chapters'))
+    return redirect(url_for('main.manage_chapters'))
 
-@app.route('/admin/quizzes', methods=['GET', 'POST'])
+@bp.route('/admin/quizzes', methods=['GET', 'POST'])
 @login_required
 def manage_quizzes():
     if not isinstance(current_user, Admin):
         flash('Access denied. Admin privileges required.', 'danger')
-        return redirect(url_for('user_dashboard'))
+        return redirect(url_for('main.user_dashboard'))
 
     form = QuizForm()
     # Populate chapter choices
@@ -570,22 +859,24 @@ def manage_quizzes():
             chapter_id=form.chapter_id.data,
             date_of_quiz=form.date_of_quiz.data,
             time_duration=form.time_duration.data,
-            remarks=form.remarks.data
+            remarks=form.remarks.data,
+            questions_per_attempt=form.questions_per_attempt.data,
+            shuffle_questions=form.shuffle_questions.data
         )
         db.session.add(quiz)
         db.session.commit()
         flash('Quiz added successfully!', 'success')
-        return redirect(url_for('manage_quizzes'))
+        return redirect(url_for('main.manage_quizzes'))
 
     quizzes = Quiz.query.all()
     return render_template('admin/quizzes.html', form=form, quizzes=quizzes)
 
-@app.route('/admin/quizzes/<int:quiz_id>/edit', methods=['GET', 'POST'])
+@bp.route('/admin/quizzes/<int:quiz_id>/edit', methods=['GET', 'POST'])
 @login_required
 def edit_quiz(quiz_id):
     if not isinstance(current_user, Admin):
         flash('Access denied. Admin privileges required.', 'danger')
-        return redirect(url_for('user_dashboard'))
+        return redirect(url_for('main.user_dashboard'))
 
     quiz = Quiz.query.get_or_404(quiz_id)
     form = QuizForm(obj=quiz)
@@ -596,110 +887,176 @@ def edit_quiz(quiz_id):
         quiz.date_of_quiz = form.date_of_quiz.data
         quiz.time_duration = form.time_duration.data
         quiz.remarks = form.remarks.data
+        quiz.questions_per_attempt = form.questions_per_attempt.data
+        quiz.shuffle_questions = form.shuffle_questions.data
 
         db.session.commit()
         flash('Quiz updated successfully!', 'success')
-        return redirect(url_for('manage_quizzes'))
+        return redirect(url_for('main.manage_quizzes'))
 
     return render_template('admin/edit_quiz.html', form=form, quiz=quiz)
 
-@app.route('/admin/quizzes/<int:quiz_id>/delete', methods=['POST'])
+@bp.route('/admin/quizzes/<int:quiz_id>/delete', methods=['POST'])
 @login_required
 def delete_quiz(quiz_id):
     if not isinstance(current_user, Admin):
         flash('Access denied. Admin privileges required.', 'danger')
-        return redirect(url_for('user_dashboard'))
+        return redirect(url_for('main.user_dashboard'))
 
     quiz = Quiz.query.get_or_404(quiz_id)
 
     try:
-        # First delete associated questions to avoid foreign key constraints
-        Question.query.filter_by(quiz_id=quiz.id).delete()
-        # Then delete associated scores
-        Score.query.filter_by(quiz_id=quiz.id).delete()
-        # Finally delete the quiz
-        db.session.delete(quiz)
-        db.session.commit()
-        flash('Quiz deleted successfully!', 'success')
+        # Questions and scores go in short chunked transactions, then the quiz
+        deleted = delete_quiz_cascade(quiz)
+        flash(f"Quiz deleted successfully! Removed {deleted['questions']} questions "
+              f"and {deleted['scores'] + deleted['archived']} attempts.", 'success')
     except Exception as e:
         db.session.rollback()
         flash(f'Error deleting quiz: {str(e)}', 'danger')
+    finally:
+        invalidate_question_pool(quiz_id)
 
-    return redirect(url_for('manage_quizzes'))
+    return redirect(url_for('main.manage_quizzes'))
 
-@app.route('/admin/users')
+@bp.route('/admin/users')
 @login_required
 def manage_users():
     if not isinstance(current_user, Admin):
         flash('Access denied. Admin privileges required.', 'danger')
-        return redirect(url_for('user_dashboard'))
+        return redirect(url_for('main.user_dashboard'))
 
     users = User.query.all()
     return render_template('admin/users.html', users=users)
 
-@app.route('/admin/users/<int:user_id>')
+@bp.route('/admin/users/<int:user_id>')
 @login_required
 def user_detail(user_id):
     if not isinstance(current_user, Admin):
         flash('Access denied. Admin privileges required.', 'danger')
-        return redirect(url_for('user_dashboard'))
+        return redirect(url_for('main.user_dashboard'))
 
     user = User.query.get_or_404(user_id)
     scores = Score.query.filter_by(user_id=user_id).order_by(Score.time_stamp_of_attempt.desc()).all()
 
-    # Calculate statistics
-    total_quizzes = len(scores)
-    avg_score = sum(score.total_scored for score in scores) / total_quizzes if total_quizzes > 0 else 0
-    highest_score = max((score.total_scored for score in scores), default=0)
-    lowest_score = min((score.total_scored for score in scores), default=0)
+    # Calculate statistics (hot attempts plus the archived summary)
+    stats = user_statistics(user_id, scores)
 
-    # Get performance trend data
-    progress_labels = [s.time_stamp_of_attempt.strftime('%d/%m/%Y') for s in scores[:10]]
-    progress_data = [s.total_scored for s in scores[:10]]
-
-    # Reverse to show chronological order
-    progress_labels.reverse()
-    progress_data.reverse()
+    # Archived attempts are only decompressed when asked for
+    include_archived = request.args.get('include_archived', type=int) == 1
+    if include_archived:
+        scores = scores + load_archived_scores(user_id)
 
     return render_template('admin/user_detail.html', 
                           user=user,
                           scores=scores,
-                          total_quizzes=total_quizzes,
-                          avg_score=avg_score,
-                          highest_score=highest_score,
-                          lowest_score=lowest_score,
-                          progress_labels=progress_labels,
-                          progress_data=progress_data)
-
-@app.route('/admin/users/<int:user_id>/delete', methods=['POST'])
+                          total_quizzes=stats['total_quizzes'],
+                          avg_score=stats['avg_score'],
+                          highest_score=stats['highest_score'],
+                          lowest_score=stats['lowest_score'],
+                          first_attempt_at=stats['first_attempt_at'],
+                          archived_attempts=stats['archived_attempts'],
+                          include_archived=include_archived)
+
+@bp.route('/admin/users/<int:user_id>/delete', methods=['POST'])
 @login_required
 def delete_user(user_id):
     if not isinstance(current_user, Admin):
         flash('Access denied. Admin privileges required.', 'danger')
-        return redirect(url_for('user_dashboard'))
+        return redirect(url_for('main.user_dashboard'))
 
     user = User.query.get_or_404(user_id)
 
     try:
-        # Delete associated scores first
-        Score.query.filter_by(user_id=user_id).delete()
-        # Then delete the user
-        db.session.delete(user)
-        db.session.commit()
+        # Scores (hot and archived) go in short chunked transactions, then the user
+        delete_user_cascade(user)
         flash('User deleted successfully!', 'success')
     except Exception as e:
         db.session.rollback()
         flash(f'Error deleting user: {str(e)}', 'danger')
 
-    return redirect(url_for('manage_users'))
+    return redirect(url_for('main.manage_users'))
 
+def export_response(export_format, columns, rows, filename):
+    return Response(
+        stream_with_context(stream_in_tenant(stream_export(export_format, columns, rows, filename))),
+        mimetype=CONTENT_TYPES[export_format],
+        headers={'Content-Disposition': f'attachment; filename={filename}.{export_format}'}
+    )
+
+@bp.route('/admin/export/scores')
+@login_required
+def export_scores():
+    if not isinstance(current_user, Admin):
+        flash('Access denied. Admin privileges required.', 'danger')
+        return redirect(url_for('main.user_dashboard'))
+
+    export_format = request.args.get('format', 'csv')
+    if export_format not in CONTENT_TYPES:
+        flash('Export format must be csv or xlsx', 'danger')
+        return redirect(url_for('main.admin_dashboard'))
+    try:
+        start = parse_date(request.args.get('start'))
+        end = parse_date(request.args.get('end'))
+    except ValueError:
+        flash('Dates must be in YYYY-MM-DD format', 'danger')
+        return redirect(url_for('main.admin_dashboard'))
+
+    rows = iter_score_rows(
+        quiz_id=request.args.get('quiz_id', type=int),
+        chapter_id=request.args.get('chapter_id', type=int),
+        subject_id=request.args.get('subject_id', type=int),
+        start=start,
+        end=end
+    )
+    return export_response(export_format, SCORE_COLUMNS, rows, 'scores')
+
+@bp.route('/admin/quizzes/<int:quiz_id>/questions/export')
+@login_required
+def export_questions(quiz_id):
+    if not isinstance(current_user, Admin):
+        flash('Access denied. Admin privileges required.', 'danger')
+        return redirect(url_for('main.user_dashboard'))
+
+    Quiz.query.get_or_404(quiz_id)
+    export_format = request.args.get('format', 'csv')
+    if export_format not in CONTENT_TYPES:
+        flash('Export format must be csv or xlsx', 'danger')
+        return redirect(url_for('main.manage_questions', quiz_id=quiz_id))
+
+    return export_response(export_format, QUESTION_COLUMNS, iter_question_rows(quiz_id),
+                           f'quiz_{quiz_id}_questions')
+
+
+@bp.route('/admin/quizzes/<int:quiz_id>/reports')
+@login_required
+def quiz_reports(quiz_id):
+    if not isinstance(current_user, Admin):
+        flash('Access denied. Admin privileges required.', 'danger')
+        return redirect(url_for('main.user_dashboard'))
+
+    quiz = Quiz.query.get_or_404(quiz_id)
+    pdf = request.args.get('format') == 'pdf'
+    if pdf and not pdf_available():
+        flash('PDF reports need WeasyPrint installed on the server', 'danger')
+        return redirect(url_for('main.manage_questions', quiz_id=quiz_id))
+
+    # All database reads happen here; the zip is rendered and streamed afterwards
+    metrics = ReportMetrics()
+    snapshot, attempts = build_snapshot(quiz, metrics)
+    reports = iter_reports(snapshot, attempts, pdf=pdf,
+                           workers=current_app.config['REPORT_WORKERS'] or None, metrics=metrics)
+    return Response(
+        stream_report_zip(reports, metrics),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename=quiz_{quiz_id}_reports.zip'}
+    )
 
 # User routes
-@app.route('/dashboard')
+@bp.route('/dashboard')
 @login_required
 def user_dashboard():
     if isinstance(current_user, Admin):
-        return redirect(url_for('admin_dashboard'))
+        return redirect(url_for('main.admin_dashboard'))
 
     # Get all subjects with chapters and quizzes
     subjects = Subject.query.all()
@@ -707,53 +1064,95 @@ def user_dashboard():
     # Get recent scores for the user
     recent_scores = Score.query.filter_by(user_id=current_user.id).order_by(Score.time_stamp_of_attempt.desc()).limit(5).all()
 
-    # Get progress data for chart
-    progress_labels = []
-    progress_data = []
-
-    if recent_scores:
-        # Reverse to show oldest to newest for progression chart
-        scores_for_chart = recent_scores.copy()
-        scores_for_chart.reverse()
-
-        progress_labels = [s.time_stamp_of_attempt.strftime('%d/%m/%Y') for s in scores_for_chart]
-        progress_data = [s.total_scored for s in scores_for_chart]
+    # Precomputed by `flask recommend-practice`
+    suggestions = practice_suggestions(current_user.id)
 
     return render_template('user/dashboard.html', 
                           subjects=subjects, 
                           recent_scores=recent_scores,
-                          progress_labels=progress_labels,
-                          progress_data=progress_data)
+                          suggestions=suggestions)
 
-@app.route('/quiz/<int:quiz_id>')
+@bp.route('/progress/series')
+@login_required
+def progress_series():
+    # Users chart their own history; admins pass user_id
+    if isinstance(current_user, Admin):
+        user_id = request.args.get('user_id', type=int)
+        if not user_id:
+            return jsonify({'error': 'user_id is required'}), 400
+    else:
+        user_id = current_user.id
+
+    try:
+        start = parse_date(request.args.get('start'))
+        end = parse_date(request.args.get('end'))
+    except ValueError:
+        return jsonify({'error': 'Dates must be in YYYY-MM-DD format'}), 400
+    points = min(max(request.args.get('points', DEFAULT_POINTS, type=int), 3), MAX_POINTS)
+
+    series = score_series(user_id,
+                          quiz_id=request.args.get('quiz_id', type=int),
+                          subject_id=request.args.get('subject_id', type=int),
+                          start=start,
+                          end=end,
+                          points=points,
+                          include_archived=request.args.get('include_archived', type=int) == 1)
+    # Revalidated on every load, and unchanged series are answered with 304 Not
+    # Modified. The series may come from this worker's cache, which can miss
+    # writes made through other workers for up to PROGRESS_CACHE_TTL seconds.
+    response = jsonify(series)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.add_etag()
+    return response.make_conditional(request)
+
+@bp.route('/quiz/<int:quiz_id>')
 @login_required
 def take_quiz(quiz_id):
     if isinstance(current_user, Admin):
-        return redirect(url_for('admin_dashboard'))
+        return redirect(url_for('main.admin_dashboard'))
     quiz = Quiz.query.get_or_404(quiz_id)
-    questions = Question.query.filter_by(quiz_id=quiz_id).all()
-    return render_template('user/quiz.html', quiz=quiz, questions=questions)
 
-@app.route('/quiz/<int:quiz_id>/submit', methods=['POST'])
+    # The paper is drawn once per attempt and kept in the session, so reloads
+    # and the submission see it even if the question bank changes meanwhile
+    paper_key = f'paper_{quiz_id}'
+    if paper_key in session:
+        paper = load_paper(session[paper_key])
+    else:
+        paper = build_paper(quiz, new_paper_seed())
+        session[paper_key] = dump_paper(paper)
+    questions = load_paper_questions(paper)
+    return render_template('user/quiz.html', quiz=quiz, questions=questions,
+                           option_orders=paper.option_orders)
+
+@bp.route('/quiz/<int:quiz_id>/submit', methods=['POST'])
 @login_required
 def submit_quiz(quiz_id):
     if isinstance(current_user, Admin):
-        return redirect(url_for('admin_dashboard'))
+        return redirect(url_for('main.admin_dashboard'))
 
     quiz = Quiz.query.get_or_404(quiz_id)
-    questions = Question.query.filter_by(quiz_id=quiz_id).all()
+    layout = session.pop(f'paper_{quiz_id}', None)
+    if layout is None:
+        # Expired session, another tab or a resubmission: the paper the answers refer to is unknown
+        flash('This quiz attempt is no longer active, so the answers could not be graded. '
+              'Please start the quiz again.', 'danger')
+        return redirect(url_for('main.user_dashboard'))
+    paper = load_paper(layout)
+    questions = load_paper_questions(paper)
 
     correct_answers = 0
     total_questions = len(questions)
     user_answers = {}
 
-    # Process submitted answers
+    # Process submitted answers; the form posts positions on the student's
+    # paper, which are mapped back to the question's own option numbers
     for question in questions:
         question_key = f'question_{question.id}'
         user_answer = request.form.get(question_key)
 
-        if user_answer:
-            user_answer = int(user_answer)
+        # Positions that are not on the paper count as unanswered
+        user_answer = original_option(paper, question.id, user_answer) if user_answer else None
+        if user_answer is not None:
             user_answers[question.id] = user_answer
 
             # Check if answer is correct
@@ -769,9 +1168,13 @@ def submit_quiz(quiz_id):
     score = Score(
         quiz_id=quiz_id,
         user_id=current_user.id,
-        total_scored=total_scored
+        total_scored=total_scored,
+        paper_seed=paper.seed,
+        paper_layout=layout
     )
     db.session.add(score)
+    db.session.flush()
+    record_answers(score, questions, user_answers)
     db.session.commit()
 
     # Store the user's answers in the session for review
@@ -784,11 +1187,7 @@ def submit_quiz(quiz_id):
     if len(user_answers) > 0:
         accuracy = round((correct_answers / len(user_answers)) * 100)
 
-    # Get historical score data for progress chart
-    user_scores = Score.query.filter_by(user_id=current_user.id).order_by(Score.time_stamp_of_attempt).limit(10).all()
-    progress_labels = [s.time_stamp_of_attempt.strftime('%d/%m/%Y') for s in user_scores]
-    progress_data = [s.total_scored for s in user_scores]
-
+    # The progress chart loads its data from main.progress_series
     return render_template('user/results.html', 
                           quiz=quiz,
                           score=score,
@@ -797,20 +1196,5 @@ def submit_quiz(quiz_id):
                           not_attempted=not_attempted,
                           total_questions=total_questions,
                           accuracy=accuracy,
-                          progress_labels=progress_labels,
-                          progress_data=progress_data,
                           user_answers=user_answers,
                           questions=questions)
-
-# Initialize database
-with app.app_context():
-    db.create_all()
-    # Create admin if not exists
-    if not Admin.query.filter_by(username='admin').first():
-        admin = Admin(
-            username='admin',
-            password=generate_password_hash('admin@123')
-        )
-        db.session.add(admin)
-        db.session.commit()
-        logging.info("Admin account created")
\ No newline at end of file
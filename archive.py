@@ -0,0 +1,302 @@
+import json
+import zlib
+import logging
+from collections import namedtuple, defaultdict
+from datetime import datetime, timedelta
+from app import db
+from sqlalchemy import Integer, cast, func, select
+from models import (Quiz, Score, AttemptAnswer, ScoreArchiveBatch, ScoreArchiveQuiz, UserScoreSummary,
+                    UserChapterSummary)
+
+logger = logging.getLogger(__name__)
+
+# Hot/cold split of attempt history.
+#
+# Attempts older than the archive horizon are moved out of the score table
+# into zlib-compressed per-user batches (ScoreArchiveBatch), and folded into a
+# per-user running summary (UserScoreSummary) so totals, averages and
+# highest/lowest scores stay correct without touching the archived rows.
+# Per-chapter scores and answer correctness are folded into
+# UserChapterSummary before the attempts (and, by cascade, their recorded
+# answers) leave the score table, so practice suggestions keep that evidence.
+# Each batch records its per-quiz share of those aggregates (ScoreArchiveQuiz).
+# Deleting a quiz rewrites only the batches holding it and subtracts its
+# shares from the summaries, so the statistics and the archived attempt list
+# always cover the same attempts. A user's summary is rebuilt from their
+# batches only when a purged attempt may have been their highest, lowest or
+# first.
+
+ARCHIVE_CHUNK_SIZE = 5000
+PURGE_BATCH_PAGE = 200  # archive batches rewritten (or indexed) per transaction
+
+ArchivedAttempt = namedtuple('ArchivedAttempt',
+                             ['id', 'quiz_id', 'time_stamp_of_attempt', 'total_scored', 'paper_seed', 'quiz'])
+
+_TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def _pack(scores):
+    payload = [[s.id, s.quiz_id, s.time_stamp_of_attempt.strftime(_TIMESTAMP_FORMAT), s.total_scored, s.paper_seed]
+               for s in scores]
+    return zlib.compress(json.dumps(payload, separators=(',', ':')).encode('utf-8'), 9)
+
+
+def _unpack(blob):
+    for score_id, quiz_id, timestamp, total_scored, paper_seed in json.loads(zlib.decompress(blob)):
+        yield score_id, quiz_id, datetime.strptime(timestamp, _TIMESTAMP_FORMAT), total_scored, paper_seed
+
+
+def _fold_into_summary(user_id, scores):
+    summary = db.session.get(UserScoreSummary, user_id)
+    if summary is None:
+        summary = UserScoreSummary(user_id=user_id, attempts=0, total_scored=0)
+        db.session.add(summary)
+    totals = [s.total_scored for s in scores]
+    first = min(s.time_stamp_of_attempt for s in scores)
+    summary.attempts += len(totals)
+    summary.total_scored += sum(totals)
+    summary.highest_score = max(totals + ([summary.highest_score] if summary.highest_score is not None else []))
+    summary.lowest_score = min(totals + ([summary.lowest_score] if summary.lowest_score is not None else []))
+    summary.first_attempt_at = min(first, summary.first_attempt_at) if summary.first_attempt_at else first
+
+
+def _answer_counts(score_ids):
+    """
+    (user_id, quiz_id) -> (answered, correct) over the recorded answers of the given attempts
+    """
+    return {(user_id, quiz_id): (answered, correct or 0)
+            for user_id, quiz_id, answered, correct in db.session.execute(
+                select(Score.user_id, Score.quiz_id, func.count(), func.sum(cast(AttemptAnswer.is_correct, Integer)))
+                .select_from(AttemptAnswer)
+                .join(Score, Score.id == AttemptAnswer.score_id)
+                .where(AttemptAnswer.score_id.in_(score_ids))
+                .group_by(Score.user_id, Score.quiz_id))}
+
+
+def _quiz_shares(user_id, attempts, answers=None, in_chapter_summary=True):
+    """
+    ScoreArchiveQuiz rows for one user's batch of attempts (Score rows or ArchivedAttempts)
+    """
+    by_quiz = defaultdict(list)
+    for attempt in attempts:
+        by_quiz[attempt.quiz_id].append(attempt)
+    shares = []
+    for quiz_id, group in by_quiz.items():
+        totals = [a.total_scored for a in group]
+        answered, correct = (answers or {}).get((user_id, quiz_id), (0, 0))
+        shares.append(ScoreArchiveQuiz(quiz_id=quiz_id, attempts=len(totals), total_scored=sum(totals),
+                                       highest_score=max(totals), lowest_score=min(totals),
+                                       first_attempt_at=min(a.time_stamp_of_attempt for a in group),
+                                       answered=answered, correct=correct, in_chapter_summary=in_chapter_summary))
+    return shares
+
+
+def _add_to_chapter_summary(user_id, chapter_id, share, sign=1):
+    summary = db.session.get(UserChapterSummary, (user_id, chapter_id))
+    if summary is None:
+        if sign < 0:
+            return
+        summary = UserChapterSummary(user_id=user_id, chapter_id=chapter_id, attempts=0, total_scored=0,
+                                     answered=0, correct=0)
+        db.session.add(summary)
+    summary.attempts += sign * share.attempts
+    summary.total_scored += sign * share.total_scored
+    summary.answered += sign * share.answered
+    summary.correct += sign * share.correct
+    if summary.attempts <= 0 and summary.answered <= 0:
+        db.session.delete(summary)
+
+
+def archive_scores(older_than_days, progress=None):
+    """
+    Move attempts older than `older_than_days` into the cold store, one short
+    transaction per chunk. Returns the number of archived attempts.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    archived = 0
+    while True:
+        chunk = (Score.query
+                 .filter(Score.time_stamp_of_attempt < cutoff)
+                 .order_by(Score.id)
+                 .limit(ARCHIVE_CHUNK_SIZE)
+                 .all())
+        if not chunk:
+            break
+
+        score_ids = [s.id for s in chunk]
+        # Read before the delete below cascades to the recorded answers
+        answers = _answer_counts(score_ids)
+        chapters = dict(db.session.execute(
+            select(Quiz.id, Quiz.chapter_id).where(Quiz.id.in_({s.quiz_id for s in chunk}))).all())
+
+        by_user = defaultdict(list)
+        for score in chunk:
+            by_user[score.user_id].append(score)
+        for user_id, scores in by_user.items():
+            shares = _quiz_shares(user_id, scores, answers)
+            db.session.add(ScoreArchiveBatch(
+                user_id=user_id,
+                attempts=len(scores),
+                first_attempt_at=min(s.time_stamp_of_attempt for s in scores),
+                last_attempt_at=max(s.time_stamp_of_attempt for s in scores),
+                payload=_pack(scores),
+                quizzes=shares
+            ))
+            _fold_into_summary(user_id, scores)
+            for share in shares:
+                _add_to_chapter_summary(user_id, chapters[share.quiz_id], share)
+
+        Score.query.filter(Score.id.in_(score_ids)).delete(synchronize_session=False)
+        db.session.commit()
+        archived += len(chunk)
+        if progress:
+            progress(archived)
+
+    logger.info("Archived %d attempts older than %s", archived, cutoff.date())
+    return archived
+
+
+def user_statistics(user_id, hot_scores):
+    """
+    Attempt statistics over hot scores plus the archived summary
+    """
+    summary = db.session.get(UserScoreSummary, user_id)
+    totals = [s.total_scored for s in hot_scores]
+    attempts = len(totals) + (summary.attempts if summary else 0)
+    total_scored = sum(totals) + (summary.total_scored if summary else 0)
+    highest = totals + ([summary.highest_score] if summary else [])
+    lowest = totals + ([summary.lowest_score] if summary else [])
+    first = [s.time_stamp_of_attempt for s in hot_scores] + ([summary.first_attempt_at] if summary else [])
+    return {
+        'total_quizzes': attempts,
+        'avg_score': total_scored / attempts if attempts > 0 else 0,
+        'highest_score': max(highest, default=0),
+        'lowest_score': min(lowest, default=0),
+        'first_attempt_at': min(first, default=None),
+        'archived_attempts': summary.attempts if summary else 0,
+    }
+
+
+def load_archived_scores(user_id):
+    """
+    Decompress a user's archived attempts, newest first. Attempts of quizzes
+    that have since been deleted are left out.
+    """
+    rows = []
+    for batch in ScoreArchiveBatch.query.filter_by(user_id=user_id).order_by(ScoreArchiveBatch.id):
+        rows.extend(_unpack(batch.payload))
+
+    quizzes = {q.id: q for q in Quiz.query.filter(Quiz.id.in_({row[1] for row in rows}))} if rows else {}
+    attempts = [ArchivedAttempt(*row, quiz=quizzes[row[1]]) for row in rows if row[1] in quizzes]
+    attempts.sort(key=lambda a: a.time_stamp_of_attempt, reverse=True)
+    return attempts
+
+
+def _rebuild_summary(user_id):
+    summary = db.session.get(UserScoreSummary, user_id)
+    if summary is not None:
+        db.session.delete(summary)
+        db.session.flush()
+    rows = [ArchivedAttempt(*row, quiz=None)
+            for batch in ScoreArchiveBatch.query.filter_by(user_id=user_id)
+            for row in _unpack(batch.payload)]
+    if rows:
+        _fold_into_summary(user_id, rows)
+
+
+def _subtract_from_summary(user_id, share):
+    """
+    Take a purged share out of the user's summary. Returns True when the
+    share may have held the highest, lowest or first attempt, which only a
+    rebuild can recompute.
+    """
+    summary = db.session.get(UserScoreSummary, user_id)
+    if summary is None:
+        return False
+    summary.attempts -= share.attempts
+    summary.total_scored -= share.total_scored
+    if summary.attempts <= 0:
+        db.session.delete(summary)
+        return False
+    return (share.highest_score >= summary.highest_score or share.lowest_score <= summary.lowest_score
+            or share.first_attempt_at <= summary.first_attempt_at)
+
+
+def purge_quiz_archive(quiz_id):
+    """
+    Drop a quiz's attempts from the archive batches that hold any and take
+    them out of the summaries. Returns the number of purged attempts.
+    """
+    quiz = db.session.get(Quiz, quiz_id)
+    chapter_id = quiz.chapter_id if quiz is not None else None
+    purged = 0
+    rebuild = set()
+    while True:
+        shares = (ScoreArchiveQuiz.query
+                  .filter_by(quiz_id=quiz_id)
+                  .order_by(ScoreArchiveQuiz.batch_id)
+                  .limit(PURGE_BATCH_PAGE)
+                  .all())
+        if not shares:
+            break
+        batches = {batch.id: batch for batch in ScoreArchiveBatch.query.filter(
+            ScoreArchiveBatch.id.in_([share.batch_id for share in shares]))}
+
+        for share in shares:
+            batch = batches[share.batch_id]
+            kept = [row for row in (ArchivedAttempt(*row, quiz=None) for row in _unpack(batch.payload))
+                    if row.quiz_id != quiz_id]
+            if kept:
+                batch.payload = _pack(kept)
+                batch.attempts = len(kept)
+                batch.first_attempt_at = min(row.time_stamp_of_attempt for row in kept)
+                batch.last_attempt_at = max(row.time_stamp_of_attempt for row in kept)
+                batch.quizzes.remove(share)
+            else:
+                db.session.delete(batch)
+            if _subtract_from_summary(batch.user_id, share):
+                rebuild.add(batch.user_id)
+            if share.in_chapter_summary and chapter_id is not None:
+                _add_to_chapter_summary(batch.user_id, chapter_id, share, sign=-1)
+            purged += share.attempts
+        db.session.commit()
+
+    for user_id in rebuild:
+        _rebuild_summary(user_id)
+    db.session.commit()
+    if purged:
+        logger.info("Quiz %s: purged %d archived attempts", quiz_id, purged)
+    return purged
+
+
+def index_archive_batches(progress=None):
+    """
+    Record the per-quiz shares of batches archived before ScoreArchiveQuiz
+    existed. Their answers were never folded into the chapter summaries, so
+    purging them leaves those alone. Returns the number of batches indexed.
+    """
+    indexed = 0
+    while True:
+        batches = (ScoreArchiveBatch.query
+                   .filter(~ScoreArchiveBatch.quizzes.any())
+                   .order_by(ScoreArchiveBatch.id)
+                   .limit(PURGE_BATCH_PAGE)
+                   .all())
+        if not batches:
+            break
+        for batch in batches:
+            rows = [ArchivedAttempt(*row, quiz=None) for row in _unpack(batch.payload)]
+            batch.quizzes = _quiz_shares(batch.user_id, rows, in_chapter_summary=False)
+        db.session.commit()
+        indexed += len(batches)
+        if progress:
+            progress(indexed)
+    return indexed
+
+
+def delete_user_archive(user_id):
+    ScoreArchiveQuiz.query.filter(ScoreArchiveQuiz.batch_id.in_(
+        select(ScoreArchiveBatch.id).where(ScoreArchiveBatch.user_id == user_id))).delete(synchronize_session=False)
+    ScoreArchiveBatch.query.filter_by(user_id=user_id).delete()
+    UserScoreSummary.query.filter_by(user_id=user_id).delete()
+    UserChapterSummary.query.filter_by(user_id=user_id).delete()
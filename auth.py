@@ -0,0 +1,209 @@
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash
+from app import db, current_tenant
+
+# Password hashing and login throttling.
+#
+# - Hash cost is set by PASSWORD_HASH_METHOD (any werkzeug method string, e.g.
+#   "scrypt:32768:8:1" or "pbkdf2:sha256:600000"); hashes made with another
+#   method are transparently upgraded on the next successful login.
+# - Verification runs in a small bounded thread pool so a burst of login
+#   attempts can occupy at most AUTH_HASH_WORKERS cores, and requests beyond
+#   AUTH_HASH_QUEUE_SIZE waiting hashes are refused instead of queued. A hash
+#   keeps its queue slot until it finishes, even if the request gave up on it.
+# - Token buckets per client IP and per account stop brute-force traffic
+#   before any hashing happens. Buckets are per tenant, since every tenant
+#   has an "admin" account and emails may repeat across tenants. A successful
+#   login refills the account's bucket. Behind a reverse proxy set TRUSTED_PROXY_HOPS, or every client
+#   shares the proxy's address.
+
+
+class LoginThrottled(Exception):
+    pass
+
+
+class TokenBucketLimiter:
+    """
+    In-memory token buckets keyed by arbitrary strings, bounded to max_keys
+    entries (least recently used keys are dropped first)
+    """
+
+    def __init__(self, capacity, refill_per_second, max_keys=100000):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consume(self, key, tokens=1):
+        now = time.monotonic()
+        with self._lock:
+            available, updated = self._buckets.pop(key, (self.capacity, now))
+            available = min(self.capacity, available + (now - updated) * self.refill_per_second)
+            allowed = available >= tokens
+            if allowed:
+                available -= tokens
+            self._buckets[key] = (available, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return allowed
+
+    def reset(self, key):
+        with self._lock:
+            self._buckets.pop(key, None)
+
+
+class HashMetrics:
+    """
+    Per-method verification counts and latency
+    """
+
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, method, seconds):
+        with self._lock:
+            stats = self._stats.setdefault(method, {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+            stats['count'] += 1
+            stats['total_ms'] += seconds * 1000
+            stats['max_ms'] = max(stats['max_ms'], seconds * 1000)
+
+    def snapshot(self):
+        with self._lock:
+            return {method: {'count': s['count'],
+                             'avg_ms': round(s['total_ms'] / s['count'], 2),
+                             'max_ms': round(s['max_ms'], 2)}
+                    for method, s in self._stats.items()}
+
+
+hash_metrics = HashMetrics()
+_ip_limiter = None
+_account_limiter = None
+_executor = None
+_queue_slots = None
+_method_prefixes = {}
+_init_lock = threading.Lock()
+
+
+def _init():
+    global _ip_limiter, _account_limiter, _executor, _queue_slots
+    with _init_lock:
+        if _executor is not None:
+            return
+        config = current_app.config
+        _ip_limiter = TokenBucketLimiter(config['LOGIN_IP_BURST'], config['LOGIN_IP_RATE'])
+        _account_limiter = TokenBucketLimiter(config['LOGIN_ACCOUNT_BURST'], config['LOGIN_ACCOUNT_RATE'])
+        _queue_slots = threading.BoundedSemaphore(config['AUTH_HASH_WORKERS'] + config['AUTH_HASH_QUEUE_SIZE'])
+        _executor = ThreadPoolExecutor(max_workers=config['AUTH_HASH_WORKERS'],
+                                       thread_name_prefix='password-hash')
+
+
+def _method_of(pwhash):
+    return pwhash.split('$', 1)[0]
+
+
+def _configured_prefix():
+    # werkzeug expands short names ("scrypt") into full parameter strings, so
+    # learn the canonical prefix from one real hash per configured method.
+    method = current_app.config['PASSWORD_HASH_METHOD']
+    if method not in _method_prefixes:
+        _method_prefixes[method] = _method_of(generate_password_hash('', method=method))
+    return _method_prefixes[method]
+
+
+def hash_password(password):
+    return generate_password_hash(password, method=current_app.config['PASSWORD_HASH_METHOD'])
+
+
+def needs_rehash(pwhash):
+    return _method_of(pwhash) != _configured_prefix()
+
+
+def _bucket_key(kind, value):
+    tenant = current_tenant.get()
+    return f'{tenant.id if tenant is not None else None}:{kind}:{value}'
+
+
+def check_login_allowed(remote_addr, account):
+    """
+    Consume one attempt for the client and the account.
+    Raises LoginThrottled when either bucket is empty.
+    """
+    _init()
+    if not _ip_limiter.consume(_bucket_key('ip', remote_addr)):
+        raise LoginThrottled('Too many login attempts from your address. Please wait and try again.')
+    if not _account_limiter.consume(_bucket_key('account', account.lower())):
+        raise LoginThrottled('Too many login attempts for this account. Please wait and try again.')
+
+
+def login_succeeded(account):
+    """
+    Refill the account's bucket so failed attempts by others stop counting
+    """
+    _init()
+    _account_limiter.reset(_bucket_key('account', account.lower()))
+
+
+def _timed_check(pwhash, password):
+    started = time.perf_counter()
+    try:
+        return check_password_hash(pwhash, password)
+    finally:
+        hash_metrics.record(_method_of(pwhash), time.perf_counter() - started)
+
+
+def _run_hash(fn, *args):
+    """
+    Run a hashing call in the bounded pool and wait for it.
+    Raises LoginThrottled when the queue is full or the call times out.
+    """
+    if not _queue_slots.acquire(blocking=False):
+        raise LoginThrottled('The server is busy. Please try again in a moment.')
+    try:
+        future = _executor.submit(fn, *args)
+    except BaseException:
+        _queue_slots.release()
+        raise
+    # The slot is held until the hash finishes, not until this request stops waiting
+    future.add_done_callback(lambda _: _queue_slots.release())
+    try:
+        return future.result(timeout=current_app.config['AUTH_HASH_TIMEOUT'])
+    except FutureTimeoutError:
+        raise LoginThrottled('The server is busy. Please try again in a moment.')
+
+
+def verify_password(account, password):
+    """
+    Check `password` against account.password off the request thread and
+    upgrade the stored hash, in the same pool, if it was made with an
+    outdated method.
+    """
+    _init()
+    valid = _run_hash(_timed_check, account.password, password)
+
+    if valid and needs_rehash(account.password):
+        try:
+            account.password = _run_hash(generate_password_hash, password,
+                                         current_app.config['PASSWORD_HASH_METHOD'])
+        except LoginThrottled:
+            # The login itself succeeded; the hash is upgraded on a later one
+            return valid
+        db.session.commit()
+    return valid
+
+
+def load_identity(model_map, user_id):
+    """
+    Resolve a typed session id ("admin:1", "user:7") with a single query.
+    Untyped ids from older sessions are ambiguous and resolve to nobody.
+    """
+    kind, _, raw_id = str(user_id).partition(':')
+    model = model_map.get(kind)
+    if model is None or not raw_id.isdigit():
+        return None
+    return db.session.get(model, int(raw_id))
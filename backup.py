@@ -0,0 +1,430 @@
+import os
+import json
+import fcntl
+import zlib
+import shutil
+import sqlite3
+import hashlib
+import logging
+import tempfile
+import subprocess
+from contextlib import contextmanager
+from datetime import datetime
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import inspect
+from sqlalchemy.engine import make_url
+from app import db
+from models import Tenant
+
+logger = logging.getLogger(__name__)
+
+# Database snapshots.
+#
+# SQLite databases are copied with the online backup API a few hundred pages
+# at a time, so workers keep writing between steps and the copy is still a
+# consistent image. A write from another connection restarts the copy; after a
+# few restarts it is finished in one step, which holds a read lock for the
+# length of one copy (under WAL journaling writers are not blocked even then).
+# The image is cut into fixed runs of pages; each run is
+# stored once, zlib-compressed and named by its SHA-256, and a snapshot is a
+# JSON manifest listing its runs. Consecutive snapshots therefore only add the
+# pages that changed, and rotating old snapshots out only deletes runs no
+# remaining manifest refers to. PostgreSQL databases are dumped with pg_dump,
+# which reads from a single MVCC snapshot without blocking writers.
+#
+# Runs and manifests are written to a temporary file and renamed into place,
+# manifest last, so an interrupted snapshot never leaves a partial one behind.
+# A lock file per database keeps a rotation from deleting runs that a
+# concurrent snapshot is about to reference. Restores rebuild the image, check
+# every hash and PRAGMA integrity_check before touching the live database.
+
+BACKUP_STEP_PAGES = 256     # pages copied per step of the online backup
+BACKUP_STEP_SLEEP = 0.005   # seconds writers get between steps
+BACKUP_MAX_RESTARTS = 3     # stepwise copies restarted by writes before copying in one step
+BLOCK_PAGES = 64            # pages per stored run (256 KiB at the 4 KiB default page size)
+PRE_RESTORE_LABEL = 'pre-restore'  # taken before every restore; never rotated out
+MAIN_DATABASE = 'main'
+
+
+def backup_targets():
+    """
+    (name, url) of every database to snapshot: the shared one plus tenants
+    with a database of their own. Tenants in a PostgreSQL schema are part of
+    the shared database's dump.
+    """
+    targets = [(MAIN_DATABASE, db.engine.url)]
+    if inspect(db.engine).has_table(Tenant.__tablename__):
+        for tenant in Tenant.query.filter(Tenant.database_uri.isnot(None)).order_by(Tenant.id):
+            targets.append((tenant.slug, make_url(tenant.database_uri)))
+    return targets
+
+
+def _target(name):
+    for target_name, url in backup_targets():
+        if target_name == name:
+            return url
+    raise click.ClickException(f'No database {name}')
+
+
+def _store(name):
+    return os.path.join(current_app.config['BACKUP_DIR'], name)
+
+
+def _sqlite_path(url):
+    if not url.database or url.database == ':memory:':
+        raise RuntimeError(f'{url} is not a database file')
+    return url.database
+
+
+@contextmanager
+def _locked(store):
+    os.makedirs(store, exist_ok=True)
+    with open(os.path.join(store, '.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = f'{path}.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+
+
+def _sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _block_path(store, key):
+    return os.path.join(store, 'blocks', key[:2], key)
+
+
+def _manifest_path(store, snapshot_id):
+    return os.path.join(store, 'manifests', f'{snapshot_id}.json')
+
+
+def _new_snapshot_id(store, label):
+    snapshot_id = datetime.utcnow().strftime('%Y%m%dT%H%M%SZ') + (f'-{label}' if label else '')
+    candidate, n = snapshot_id, 1
+    while os.path.exists(_manifest_path(store, candidate)):
+        candidate, n = f'{snapshot_id}.{n}', n + 1
+    return candidate
+
+
+class _Restarted(Exception):
+    pass
+
+
+def _online_copy(source_path, target_path, pages=BACKUP_STEP_PAGES):
+    """
+    Copy a live SQLite database with the backup API; pages=-1 copies it in one step
+    """
+    restarts = 0
+    copied = 0
+
+    def progress(status, remaining, total):
+        nonlocal restarts, copied
+        if total - remaining < copied:
+            restarts += 1
+            if restarts > BACKUP_MAX_RESTARTS:
+                raise _Restarted()
+        copied = total - remaining
+
+    source = sqlite3.connect(source_path, timeout=30)
+    target = sqlite3.connect(target_path)
+    try:
+        try:
+            source.backup(target, pages=pages, progress=progress, sleep=BACKUP_STEP_SLEEP)
+        except _Restarted:
+            logger.info("%s kept changing during the backup; copying it in one step", source_path)
+            source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+
+def _integrity_check(path):
+    conn = sqlite3.connect(path)
+    try:
+        result = [row[0] for row in conn.execute('PRAGMA integrity_check')]
+    finally:
+        conn.close()
+    if result != ['ok']:
+        raise RuntimeError(f"Integrity check failed: {'; '.join(result[:5])}")
+
+
+def _snapshot_sqlite(name, url, snapshot_id):
+    store = _store(name)
+    fd, image = tempfile.mkstemp(dir=store, suffix='.db')
+    os.close(fd)
+    try:
+        _online_copy(_sqlite_path(url), image)
+        conn = sqlite3.connect(image)
+        page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+        conn.close()
+
+        blocks, new_blocks, stored_bytes = [], 0, 0
+        digest = hashlib.sha256()
+        with open(image, 'rb') as f:
+            for run in iter(lambda: f.read(page_size * BLOCK_PAGES), b''):
+                digest.update(run)
+                key = hashlib.sha256(run).hexdigest()
+                blocks.append(key)
+                path = _block_path(store, key)
+                if not os.path.exists(path):
+                    compressed = zlib.compress(run, 6)
+                    _write_atomic(path, compressed)
+                    new_blocks += 1
+                    stored_bytes += len(compressed)
+        size = os.path.getsize(image)
+    finally:
+        os.remove(image)
+
+    return {'kind': 'sqlite', 'page_size': page_size, 'size': size, 'sha256': digest.hexdigest(),
+            'blocks': blocks, 'new_blocks': new_blocks, 'stored_bytes': stored_bytes}
+
+
+def _pg_command(program, url):
+    # The password goes through the environment rather than the command line
+    env = dict(os.environ)
+    if url.password:
+        env['PGPASSWORD'] = url.password
+    uri = url.set(drivername='postgresql', password=None).render_as_string(hide_password=False)
+    return [program, f'--dbname={uri}'], env
+
+
+def _snapshot_pg(name, url, snapshot_id):
+    store = _store(name)
+    path = os.path.join(store, 'dumps', f'{snapshot_id}.dump')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    command, env = _pg_command('pg_dump', url)
+    subprocess.run(command + ['--format=custom', '--compress=6', f'--file={path}.tmp'], env=env, check=True)
+    os.replace(f'{path}.tmp', path)
+    size = os.path.getsize(path)
+    return {'kind': 'pg_dump', 'dump': os.path.basename(path), 'size': size, 'sha256': _sha256_file(path),
+            'stored_bytes': size}
+
+
+def take_snapshot(name, url, label=None, keep=None):
+    """
+    Snapshot one database and rotate its old snapshots. Returns the manifest.
+    """
+    if url.get_backend_name() not in ('sqlite', 'postgresql'):
+        raise RuntimeError(f'Snapshots are not supported for {url.get_backend_name()}')
+    store = _store(name)
+    keep = keep if keep is not None else current_app.config['BACKUP_KEEP']
+    with _locked(store):
+        snapshot_id = _new_snapshot_id(store, label)
+        started = datetime.utcnow()
+        if url.get_backend_name() == 'sqlite':
+            manifest = _snapshot_sqlite(name, url, snapshot_id)
+        else:
+            manifest = _snapshot_pg(name, url, snapshot_id)
+        manifest.update(id=snapshot_id, database=name, label=label, created_at=started.isoformat(),
+                        duration_ms=round((datetime.utcnow() - started).total_seconds() * 1000, 1))
+        _write_atomic(_manifest_path(store, snapshot_id), json.dumps(manifest).encode('utf-8'))
+        if keep:
+            _rotate(store, list_snapshots(name), keep)
+    logger.info("Database snapshot taken", extra={k: v for k, v in manifest.items() if k != 'blocks'})
+    return manifest
+
+
+def take_snapshots(label=None, keep=None):
+    """
+    Snapshot every database (see backup_targets); files not created yet are skipped
+    """
+    manifests = []
+    for name, url in backup_targets():
+        if url.get_backend_name() == 'sqlite' and not os.path.exists(_sqlite_path(url)):
+            continue
+        manifests.append(take_snapshot(name, url, label, keep))
+    return manifests
+
+
+def list_snapshots(name):
+    """
+    Manifests of a database's snapshots, oldest first
+    """
+    directory = os.path.join(_store(name), 'manifests')
+    if not os.path.isdir(directory):
+        return []
+    manifests = []
+    for filename in sorted(os.listdir(directory)):
+        if filename.endswith('.json'):
+            with open(os.path.join(directory, filename)) as f:
+                manifests.append(json.load(f))
+    return sorted(manifests, key=lambda manifest: manifest['created_at'])
+
+
+def load_snapshot(name, snapshot_id=None):
+    """
+    Manifest of a snapshot; the latest one when `snapshot_id` is None
+    """
+    if snapshot_id is None:
+        snapshots = list_snapshots(name)
+        if not snapshots:
+            raise click.ClickException(f'No snapshots of {name}')
+        return snapshots[-1]
+    path = _manifest_path(_store(name), snapshot_id)
+    if not os.path.exists(path):
+        raise click.ClickException(f'No snapshot {snapshot_id} of {name}')
+    with open(path) as f:
+        return json.load(f)
+
+
+def _rotate(store, snapshots, keep):
+    # Keep the newest `keep` snapshots, plus every pre-restore one, and delete
+    # data only expired ones used
+    pinned = [manifest for manifest in snapshots if manifest.get('label') == PRE_RESTORE_LABEL]
+    rotating = [manifest for manifest in snapshots if manifest.get('label') != PRE_RESTORE_LABEL]
+    expired, kept = rotating[:-keep], rotating[-keep:] + pinned
+    for manifest in expired:
+        os.remove(_manifest_path(store, manifest['id']))
+        if manifest['kind'] == 'pg_dump':
+            os.remove(os.path.join(store, 'dumps', manifest['dump']))
+
+    # Runs referenced by no remaining snapshot, including ones left by an interrupted snapshot
+    referenced = {key for manifest in kept for key in manifest.get('blocks', ())}
+    blocks = os.path.join(store, 'blocks')
+    if os.path.isdir(blocks):
+        for prefix in os.listdir(blocks):
+            for key in os.listdir(os.path.join(blocks, prefix)):
+                if key not in referenced:
+                    os.remove(os.path.join(blocks, prefix, key))
+
+
+def _assemble(name, manifest, path):
+    """
+    Rebuild a SQLite snapshot into `path`, checking every hash and the database's integrity
+    """
+    store = _store(name)
+    digest = hashlib.sha256()
+    with open(path, 'wb') as f:
+        for key in manifest['blocks']:
+            with open(_block_path(store, key), 'rb') as block:
+                try:
+                    run = zlib.decompress(block.read())
+                except zlib.error:
+                    run = None
+            if run is None or hashlib.sha256(run).hexdigest() != key:
+                raise RuntimeError(f'Snapshot {manifest["id"]}: block {key} is corrupt')
+            digest.update(run)
+            f.write(run)
+    if digest.hexdigest() != manifest['sha256']:
+        raise RuntimeError(f'Snapshot {manifest["id"]}: image checksum mismatch')
+    _integrity_check(path)
+
+
+def _verified_dump(name, manifest):
+    path = os.path.join(_store(name), 'dumps', manifest['dump'])
+    if _sha256_file(path) != manifest['sha256']:
+        raise RuntimeError(f'Snapshot {manifest["id"]}: dump checksum mismatch')
+    # Reads the whole table of contents, which fails on a truncated archive
+    subprocess.run(['pg_restore', '--list', path], check=True, stdout=subprocess.DEVNULL)
+    return path
+
+
+def verify_snapshot(name, manifest):
+    """
+    Check a snapshot can be restored without touching the live database
+    """
+    if manifest['kind'] == 'pg_dump':
+        _verified_dump(name, manifest)
+        return
+    fd, image = tempfile.mkstemp(dir=_store(name), suffix='.db')
+    os.close(fd)
+    try:
+        _assemble(name, manifest, image)
+    finally:
+        os.remove(image)
+
+
+def restore_snapshot(name, manifest):
+    """
+    Replace a live database with a verified snapshot. The current contents
+    are snapshotted first (label "pre-restore"), and rotation never deletes
+    those snapshots.
+    """
+    url = _target(name)
+    if manifest['kind'] == 'pg_dump':
+        path = _verified_dump(name, manifest)
+        take_snapshot(name, url, label=PRE_RESTORE_LABEL, keep=0)
+        command, env = _pg_command('pg_restore', url)
+        subprocess.run(command + ['--clean', '--if-exists', '--no-owner', '--single-transaction', path],
+                       env=env, check=True)
+        return
+
+    target = _sqlite_path(url)
+    fd, image = tempfile.mkstemp(dir=_store(name), suffix='.db')
+    os.close(fd)
+    try:
+        _assemble(name, manifest, image)
+        if os.path.exists(target):
+            take_snapshot(name, url, label=PRE_RESTORE_LABEL, keep=0)
+            # Through the backup API in one step: a single write transaction,
+            # so open connections see either the old database or the restored one
+            _online_copy(image, target, pages=-1)
+        else:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(image, target)
+    finally:
+        os.remove(image)
+    _integrity_check(target)
+
+
+def init_backups(app):
+    app.cli.add_command(backup_cli)
+
+
+backup_cli = AppGroup('backup', help='Take, list and restore database snapshots.')
+
+
+@backup_cli.command('create')
+@click.option('--label', help='Appended to the snapshot id')
+@click.option('--keep', type=int, default=None, help='Snapshots to keep per database (default: BACKUP_KEEP)')
+def create_backup_command(label, keep):
+    """Snapshot every database without stopping the app."""
+    for manifest in take_snapshots(label, keep):
+        print(f"{manifest['database']}: snapshot {manifest['id']} "
+              f"({manifest['size'] / 1024:.0f} KiB, {manifest['stored_bytes'] / 1024:.0f} KiB new) "
+              f"in {manifest['duration_ms'] / 1000:.2f}s")
+
+
+@backup_cli.command('list')
+@click.option('--database', default=MAIN_DATABASE, show_default=True)
+def list_backups_command(database):
+    for manifest in list_snapshots(database):
+        print(f"{manifest['id']}\t{manifest['kind']}\t{manifest['size'] / 1024:.0f} KiB\t{manifest['created_at']}")
+
+
+@backup_cli.command('restore')
+@click.argument('snapshot_id', required=False)
+@click.option('--database', default=MAIN_DATABASE, show_default=True)
+@click.option('--verify-only', is_flag=True, help='Check the snapshot and stop')
+@click.option('--yes', is_flag=True, help='Do not ask for confirmation')
+def restore_backup_command(snapshot_id, database, verify_only, yes):
+    """Verify a snapshot (default: the latest) and restore it."""
+    manifest = load_snapshot(database, snapshot_id)
+    try:
+        if verify_only:
+            verify_snapshot(database, manifest)
+            print(f"Snapshot {manifest['id']} of {database} is intact.")
+            return
+        if not yes:
+            click.confirm(f"Replace {database} with snapshot {manifest['id']}?", abort=True)
+        restore_snapshot(database, manifest)
+    except (RuntimeError, OSError, subprocess.CalledProcessError) as e:
+        raise click.ClickException(str(e))
+    print(f"Restored {database} from snapshot {manifest['id']}.")
@@ -0,0 +1,108 @@
+import sys
+import argparse
+from itertools import groupby
+from collections import defaultdict
+from app import create_app, db
+from models import Question, QuestionSignature, QuestionLSHBucket
+from tenancy import each_tenant
+from dedup import DEFAULT_THRESHOLD, index_question_signatures, load_signature, similarity
+
+app = create_app()
+
+BATCH_SIZE = 1000
+
+
+def backfill_signatures():
+    """
+    Compute signatures for questions that were added before the dedup index existed
+    """
+    indexed = db.session.query(QuestionSignature.question_id)
+    total = 0
+    while True:
+        batch = Question.query.filter(~Question.id.in_(indexed)).order_by(Question.id).limit(BATCH_SIZE).all()
+        if not batch:
+            break
+        index_question_signatures(batch)
+        db.session.commit()
+        total += len(batch)
+        print(f"Indexed {total} questions...")
+    return total
+
+
+def cluster_questions(threshold=DEFAULT_THRESHOLD):
+    """
+    Group the whole bank into clusters of near-duplicate questions.
+    Returns a list of clusters (lists of question ids), largest first.
+    """
+    signatures = {row.question_id: load_signature(row.minhash)
+                  for row in QuestionSignature.query.yield_per(BATCH_SIZE)}
+
+    parent = {}
+
+    def find(x):
+        parent.setdefault(x, x)
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    # Walk the buckets in order and compare every pair of members, so a
+    # question that only matches a later member still joins its cluster.
+    # Pairs already in one cluster (through this or an earlier band) are not
+    # compared again.
+    rows = (db.session.query(QuestionLSHBucket.band, QuestionLSHBucket.bucket, QuestionLSHBucket.question_id)
+            .order_by(QuestionLSHBucket.band, QuestionLSHBucket.bucket, QuestionLSHBucket.question_id)
+            .yield_per(BATCH_SIZE))
+    for _, members in groupby(rows, key=lambda row: (row.band, row.bucket)):
+        members = [row.question_id for row in members]
+        for i, question_id in enumerate(members):
+            for other_id in members[:i]:
+                root, other_root = find(question_id), find(other_id)
+                if root != other_root and similarity(signatures[question_id], signatures[other_id]) >= threshold:
+                    parent[root] = other_root
+
+    clusters = defaultdict(list)
+    for question_id in list(parent):
+        clusters[find(question_id)].append(question_id)
+    return sorted((sorted(c) for c in clusters.values() if len(c) > 1), key=len, reverse=True)
+
+
+def report(args):
+    print(f"Backfilled {backfill_signatures()} question signatures")
+    if args.index_only:
+        return
+
+    clusters = cluster_questions(args.threshold)
+    if not clusters:
+        print("No near-duplicate questions found.")
+        return
+
+    questions = {q.id: q for q in Question.query.filter(
+        Question.id.in_([qid for c in clusters for qid in c])).all()}
+    for number, cluster in enumerate(clusters, 1):
+        print(f"\nCluster {number} ({len(cluster)} questions):")
+        for question_id in cluster:
+            question = questions[question_id]
+            print(f"  #{question.id} (quiz {question.quiz_id}): {question.question_statement[:80]}")
+    print(f"\n{len(clusters)} clusters, {sum(len(c) for c in clusters)} questions involved")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find clusters of near-duplicate questions in the bank")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help="minimum estimated Jaccard similarity (default: %(default)s)")
+    parser.add_argument('--index-only', action='store_true',
+                        help="only backfill missing signatures, do not cluster")
+    args = parser.parse_args()
+
+    with app.app_context():
+        # Questions are only compared within one institution
+        for tenant in each_tenant():
+            if tenant is not None:
+                print(f"== {tenant.slug} ==")
+            report(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,208 @@
+import re
+import hashlib
+import zlib
+import numpy as np
+from sqlalchemy import or_, and_
+from app import db
+from models import QuestionSignature, QuestionLSHBucket
+
+# Near-duplicate detection for the question bank using MinHash + LSH.
+#
+# Every question (statement plus options) is reduced to a set of character
+# shingles and summarised by NUM_PERM min-hashes. The signature is cut into
+# NUM_BANDS bands; questions sharing any band bucket become candidates and are
+# then verified by estimated Jaccard similarity. With 16 bands of 4 rows a pair
+# at 0.8 similarity is caught ~99.9% of the time while pairs below ~0.5 are
+# rarely even compared.
+
+NUM_PERM = 64
+NUM_BANDS = 16
+ROWS_PER_BAND = NUM_PERM // NUM_BANDS
+SHINGLE_SIZE = 4
+DEFAULT_THRESHOLD = 0.8
+# Bucket values per candidate query, well inside SQLite's bound-parameter limit
+PREFETCH_BUCKETS = 20000
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_rng = np.random.RandomState(1)
+_PERM_A = _rng.randint(1, 1 << 32, size=NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.randint(0, 1 << 32, size=NUM_PERM, dtype=np.uint64)
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def _normalize(statement, options):
+    words = _WORD_RE.findall(' '.join([statement or ''] + [o or '' for o in options]).lower())
+    return ' '.join(words)
+
+
+def compute_signature(statement, options):
+    """
+    MinHash signature (uint32 array of length NUM_PERM) of a question
+    """
+    text = _normalize(statement, options)
+    if len(text) <= SHINGLE_SIZE:
+        shingles = {text}
+    else:
+        shingles = {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+    hashes = np.fromiter((zlib.crc32(s.encode('utf-8')) for s in shingles),
+                         dtype=np.uint64, count=len(shingles))
+    # Universal hashing (a*x + b) mod p, one row per permutation; overflow wraps
+    # in uint64 which is fine for hashing purposes.
+    with np.errstate(over='ignore'):
+        permuted = (np.outer(_PERM_A, hashes) + _PERM_B[:, None]) % _MERSENNE_PRIME & _MAX_HASH
+    return permuted.min(axis=1).astype(np.uint32)
+
+
+def question_signature(question):
+    return compute_signature(question.question_statement,
+                             [question.option_1, question.option_2, question.option_3, question.option_4])
+
+
+def band_hashes(signature):
+    """
+    One 64-bit signed bucket key per band, stable across processes
+    """
+    bands = signature.reshape(NUM_BANDS, ROWS_PER_BAND)
+    return [int.from_bytes(hashlib.blake2b(band.tobytes(), digest_size=8).digest(), 'big', signed=True)
+            for band in bands]
+
+
+def similarity(sig_a, sig_b):
+    """
+    Estimated Jaccard similarity of two signatures
+    """
+    return float(np.count_nonzero(sig_a == sig_b)) / NUM_PERM
+
+
+def load_signature(blob):
+    return np.frombuffer(blob, dtype=np.uint32)
+
+
+def index_question_signatures(questions, signatures=None):
+    """
+    Store signatures and LSH buckets for newly added questions.
+    Must be called after the questions have ids (i.e. after a flush).
+    """
+    if signatures is None:
+        signatures = [question_signature(q) for q in questions]
+    for question, signature in zip(questions, signatures):
+        db.session.add(QuestionSignature(question_id=question.id, minhash=signature.tobytes()))
+        db.session.add_all([QuestionLSHBucket(question_id=question.id, band=band, bucket=bucket)
+                            for band, bucket in enumerate(band_hashes(signature))])
+
+
+def unindex_question_signatures(question_ids):
+    """
+    Drop signatures and buckets of the given question ids
+    """
+    QuestionLSHBucket.query.filter(QuestionLSHBucket.question_id.in_(question_ids)).delete(synchronize_session=False)
+    QuestionSignature.query.filter(QuestionSignature.question_id.in_(question_ids)).delete(synchronize_session=False)
+
+
+def find_near_duplicates(signature, threshold=DEFAULT_THRESHOLD, limit=5):
+    """
+    Existing questions whose estimated similarity to `signature` is at least
+    `threshold`, as (question_id, similarity) pairs, most similar first.
+    Only questions sharing an LSH bucket are compared.
+    """
+    conditions = [and_(QuestionLSHBucket.band == band, QuestionLSHBucket.bucket == bucket)
+                  for band, bucket in enumerate(band_hashes(signature))]
+    candidate_ids = db.session.query(QuestionLSHBucket.question_id).filter(or_(*conditions)).distinct()
+    candidates = QuestionSignature.query.filter(QuestionSignature.question_id.in_(candidate_ids)).all()
+
+    matches = []
+    for candidate in candidates:
+        score = similarity(signature, load_signature(candidate.minhash))
+        if score >= threshold:
+            matches.append((candidate.question_id, score))
+    matches.sort(key=lambda m: m[1], reverse=True)
+    return matches[:limit]
+
+
+class ImportDeduplicator:
+    """
+    Checks rows of one import batch against the stored index and against the
+    rows already accepted from the same batch. Call prefetch() with the whole
+    batch first so the stored candidates are read in one query rather than two
+    per row.
+    """
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD):
+        self.threshold = threshold
+        self._batch_buckets = {}
+        self._batch_signatures = []
+        self._signatures = {}
+        self._stored_buckets = {}
+        self._stored_signatures = {}
+
+    @staticmethod
+    def _key(statement, options):
+        return statement, tuple(options)
+
+    def prefetch(self, rows):
+        """
+        Sign every (statement, options) row of the batch and load the stored
+        questions sharing a bucket with any of them.
+        """
+        wanted = set()
+        for statement, options in rows:
+            key = self._key(statement, options)
+            if key not in self._signatures:
+                signature = compute_signature(statement, options)
+                self._signatures[key] = (signature, band_hashes(signature))
+            wanted.update(enumerate(self._signatures[key][1]))
+
+        buckets = sorted({bucket for _, bucket in wanted})
+        for start in range(0, len(buckets), PREFETCH_BUCKETS):
+            hits = (db.session.query(QuestionLSHBucket.band, QuestionLSHBucket.bucket,
+                                     QuestionSignature.question_id, QuestionSignature.minhash)
+                    .join(QuestionSignature, QuestionSignature.question_id == QuestionLSHBucket.question_id)
+                    .filter(QuestionLSHBucket.bucket.in_(buckets[start:start + PREFETCH_BUCKETS])))
+            for band, bucket, question_id, minhash in hits:
+                # The IN list matches buckets of any band; keep only the band they were computed for
+                if (band, bucket) in wanted:
+                    self._stored_buckets.setdefault((band, bucket), set()).add(question_id)
+                    self._stored_signatures.setdefault(question_id, load_signature(minhash))
+
+    def _best_stored(self, signature, bands, prefetched):
+        if not prefetched:
+            existing = find_near_duplicates(signature, self.threshold, limit=1)
+            return existing[0] if existing else None
+        best = None
+        for question_id in {q for key in enumerate(bands) for q in self._stored_buckets.get(key, ())}:
+            score = similarity(signature, self._stored_signatures[question_id])
+            if score >= self.threshold and (best is None or score > best[1]):
+                best = (question_id, score)
+        return best
+
+    def check(self, statement, options):
+        """
+        Returns (signature, match) where match is None or a dict describing the
+        most similar existing question / earlier batch row.
+        """
+        key = self._key(statement, options)
+        prefetched = key in self._signatures
+        if prefetched:
+            signature, bands = self._signatures[key]
+        else:
+            signature = compute_signature(statement, options)
+            bands = band_hashes(signature)
+
+        best = None
+        for position in {p for key in enumerate(bands) for p in self._batch_buckets.get(key, ())}:
+            score = similarity(signature, self._batch_signatures[position][1])
+            if score >= self.threshold and (best is None or score > best['similarity']):
+                best = {'row': self._batch_signatures[position][0], 'similarity': score}
+
+        existing = self._best_stored(signature, bands, prefetched)
+        if existing and (best is None or existing[1] > best['similarity']):
+            best = {'question_id': existing[0], 'similarity': existing[1]}
+        return signature, best
+
+    def add(self, row, signature):
+        index = len(self._batch_signatures)
+        self._batch_signatures.append((row, signature))
+        for key in enumerate(band_hashes(signature)):
+            self._batch_buckets.setdefault(key, []).append(index)
@@ -0,0 +1,114 @@
+import logging
+from sqlalchemy import event
+from app import db
+from models import Chapter, Quiz, Question, Score, AttemptAnswer
+from search import unindex_questions
+from archive import delete_user_archive, purge_quiz_archive
+
+logger = logging.getLogger(__name__)
+
+# Bulk deletes.
+#
+# Child rows are removed in bounded chunks, each in its own short transaction,
+# so deleting a large quiz or an active user never holds the write lock long
+# enough to stall exam submissions. Each chunk of scores takes its attempt
+# answers with it explicitly, rather than leaving an unbounded fan-out to the
+# foreign key. The schema declares ON DELETE CASCADE for the same
+# relationships as a safety net; on databases created before that, the
+# explicit chunked deletes keep everything consistent.
+
+DELETE_CHUNK_SIZE = 1000
+
+
+def _enable_foreign_keys(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA foreign_keys=ON')
+    cursor.close()
+
+
+def enable_sqlite_foreign_keys(engine):
+    """
+    SQLite ignores ON DELETE clauses unless foreign keys are switched on per
+    connection. Only the app's own engines get this, so scripts that rebuild
+    tables on other connections are not hit by the cascades.
+    """
+    if engine.dialect.name == 'sqlite' and not event.contains(engine, 'connect', _enable_foreign_keys):
+        event.listen(engine, 'connect', _enable_foreign_keys)
+
+
+def has_children(model, **filters):
+    """
+    EXISTS check instead of loading a whole relationship
+    """
+    return db.session.query(model.query.filter_by(**filters).exists()).scalar()
+
+
+def delete_in_chunks(model, condition, before_delete=None, progress=None, chunk_size=DELETE_CHUNK_SIZE):
+    """
+    Delete rows of `model` matching `condition`, committing every chunk.
+    `before_delete(ids)` runs in the same transaction as each chunk.
+    Returns the number of deleted rows.
+    """
+    deleted = 0
+    while True:
+        ids = [row[0] for row in db.session.query(model.id).filter(condition).limit(chunk_size)]
+        if not ids:
+            return deleted
+        if before_delete:
+            before_delete(ids)
+        model.query.filter(model.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        deleted += len(ids)
+        if progress:
+            progress(deleted)
+
+
+def _drop_question_indexes(question_ids):
+    from dedup import unindex_question_signatures
+    unindex_questions(question_ids)
+    unindex_question_signatures(question_ids)
+
+
+def _drop_attempt_answers(score_ids):
+    AttemptAnswer.query.filter(AttemptAnswer.score_id.in_(score_ids)).delete(synchronize_session=False)
+
+
+def delete_quiz_cascade(quiz):
+    """
+    Delete a quiz with its questions (and their search/dedup entries), hot
+    scores and archived attempts
+    """
+    quiz_id = quiz.id
+    # Scores first: their answers are what reference the questions
+    scores = delete_in_chunks(
+        Score, Score.quiz_id == quiz_id, before_delete=_drop_attempt_answers,
+        progress=lambda n: logger.info("Quiz %s: deleted %d scores", quiz_id, n))
+    questions = delete_in_chunks(
+        Question, Question.quiz_id == quiz_id, before_delete=_drop_question_indexes,
+        progress=lambda n: logger.info("Quiz %s: deleted %d questions", quiz_id, n))
+    archived = purge_quiz_archive(quiz_id)
+    db.session.delete(quiz)
+    db.session.commit()
+    return {'questions': questions, 'scores': scores, 'archived': archived}
+
+
+def delete_user_cascade(user):
+    """
+    Delete a user with their hot and archived attempts
+    """
+    user_id = user.id
+    scores = delete_in_chunks(
+        Score, Score.user_id == user_id, before_delete=_drop_attempt_answers,
+        progress=lambda n: logger.info("User %s: deleted %d scores", user_id, n))
+    delete_user_archive(user_id)
+    db.session.delete(user)
+    db.session.commit()
+    return {'scores': scores}
+
+
+def subject_has_chapters(subject_id):
+    return has_children(Chapter, subject_id=subject_id)
+
+
+def chapter_has_quizzes(chapter_id):
+    return has_children(Quiz, chapter_id=chapter_id)
@@ -0,0 +1,126 @@
+import io
+import csv
+import tempfile
+from datetime import datetime, timedelta
+from sqlalchemy import select
+from app import db
+from models import User, Subject, Chapter, Quiz, Question, Score
+
+# Streaming CSV/XLSX exports.
+#
+# Rows are read with a server-side cursor (stream_results + yield_per) and
+# written out in chunks, so memory use does not grow with the export size.
+# CSV responses start immediately; XLSX files have to be complete before they
+# can be sent (the format is a zip), so they are built with openpyxl's
+# write-only workbook in a temporary file and then streamed from disk.
+
+CHUNK_ROWS = 1000
+FILE_CHUNK_BYTES = 64 * 1024
+
+SCORE_COLUMNS = ['score_id', 'user_email', 'user_name', 'subject', 'chapter', 'quiz_id',
+                 'quiz_date', 'attempted_at', 'total_scored']
+# Same layout manage_questions imports
+QUESTION_COLUMNS = ['question_statement', 'option_1', 'option_2', 'option_3', 'option_4',
+                    'correct_option', 'image_url']
+
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+
+def parse_date(value):
+    """
+    Parse an optional YYYY-MM-DD query argument; raises ValueError if malformed
+    """
+    return datetime.strptime(value, '%Y-%m-%d') if value else None
+
+
+def _stream(statement):
+    result = db.session.execute(statement.execution_options(stream_results=True, yield_per=CHUNK_ROWS))
+    for partition in result.partitions():
+        yield from partition
+
+
+def iter_score_rows(quiz_id=None, chapter_id=None, subject_id=None, start=None, end=None):
+    statement = (
+        select(Score.id, User.email, User.full_name, Subject.name, Chapter.name, Quiz.id,
+               Quiz.date_of_quiz, Score.time_stamp_of_attempt, Score.total_scored)
+        .join(User, User.id == Score.user_id)
+        .join(Quiz, Quiz.id == Score.quiz_id)
+        .join(Chapter, Chapter.id == Quiz.chapter_id)
+        .join(Subject, Subject.id == Chapter.subject_id)
+        .order_by(Score.id)
+    )
+    if quiz_id:
+        statement = statement.where(Score.quiz_id == quiz_id)
+    if chapter_id:
+        statement = statement.where(Quiz.chapter_id == chapter_id)
+    if subject_id:
+        statement = statement.where(Chapter.subject_id == subject_id)
+    if start:
+        statement = statement.where(Score.time_stamp_of_attempt >= start)
+    if end:
+        # end date is inclusive
+        statement = statement.where(Score.time_stamp_of_attempt < end + timedelta(days=1))
+
+    for row in _stream(statement):
+        yield [row[0], row[1], row[2], row[3], row[4], row[5],
+               row[6].strftime('%Y-%m-%d') if row[6] else '',
+               row[7].strftime('%Y-%m-%d %H:%M:%S') if row[7] else '',
+               row[8]]
+
+
+def iter_question_rows(quiz_id):
+    statement = (
+        select(Question.question_statement, Question.option_1, Question.option_2, Question.option_3,
+               Question.option_4, Question.correct_option, Question.question_image)
+        .where(Question.quiz_id == quiz_id)
+        .order_by(Question.id)
+    )
+    for row in _stream(statement):
+        yield [row[0], row[1], row[2], row[3], row[4], row[5], row[6] or '']
+
+
+def stream_csv(columns, rows):
+    """
+    Yield CSV text in chunks of CHUNK_ROWS rows
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def stream_xlsx(columns, rows, title):
+    """
+    Yield the bytes of an XLSX workbook built in write-only mode
+    """
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(title=title)
+    sheet.append(columns)
+    for row in rows:
+        sheet.append(row)
+
+    with tempfile.TemporaryFile() as output:
+        workbook.save(output)
+        output.seek(0)
+        while True:
+            chunk = output.read(FILE_CHUNK_BYTES)
+            if not chunk:
+                break
+            yield chunk
+
+
+def stream_export(export_format, columns, rows, title):
+    if export_format == 'xlsx':
+        return stream_xlsx(columns, rows, title)
+    return stream_csv(columns, rows)
@@ -1,6 +1,6 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, DateField, TextAreaField, IntegerField, SelectField, FileField
-from wtforms.validators import DataRequired, Email, Length, EqualTo
+from wtforms import StringField, PasswordField, DateField, TextAreaField, IntegerField, SelectField, FileField, BooleanField
+from wtforms.validators import DataRequired, Email, Length, EqualTo, Optional, NumberRange
 from flask_wtf.file import FileAllowed
 
 
@@ -43,6 +43,10 @@ class QuizForm(FlaskForm):
     time_duration = IntegerField('Duration (minutes)',
                                  validators=[DataRequired()])
     remarks = TextAreaField('Remarks')
+    questions_per_attempt = IntegerField('Questions per Attempt',
+                                         validators=[Optional(),
+                                                     NumberRange(min=1)])
+    shuffle_questions = BooleanField('Shuffle question and option order')
 
 
 class QuestionForm(FlaskForm):
@@ -70,6 +74,10 @@ class QuestionImportForm(FlaskForm):
                          FileAllowed(['csv', 'xlsx'],
                                      'CSV or Excel files only!')
                      ])
+    duplicate_action = SelectField('Near-duplicate Questions',
+                                   choices=[('skip', 'Skip them'),
+                                            ('flag', 'Import and flag them')],
+                                   default='skip')
 
 
 class UserProfileForm(FlaskForm):
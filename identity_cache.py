@@ -0,0 +1,112 @@
+import time
+import threading
+from collections import OrderedDict
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import make_transient_to_detached
+from app import db, current_tenant
+from models import Admin, User
+from auth import load_identity
+
+# Short-lived cache for Flask-Login's user_loader.
+#
+# Only column values are cached (never the password hash); on a hit the
+# instance is rebuilt and merged into the request's session with load=False,
+# which attaches it without a SELECT. Updates and deletes of Admin/User rows
+# evict the entry in this process; the TTL bounds staleness in other workers.
+# Keys include the tenant, whose databases may reuse the same ids.
+
+IDENTITY_MODELS = {'admin': Admin, 'user': User}
+_EXCLUDED_COLUMNS = {'password'}
+
+
+class IdentityCache:
+    """
+    Bounded LRU mapping typed ids ("user:7") to column values, with a TTL
+    """
+
+    def __init__(self, maxsize=10000, ttl=30):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def configure(self, maxsize, ttl):
+        with self._lock:
+            self.maxsize = maxsize
+            self.ttl = ttl
+            self._entries.clear()
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, values):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, values)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'size': len(self._entries),
+                    'maxsize': self.maxsize,
+                    'ttl_seconds': self.ttl,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_ratio': round(self.hits / lookups, 4) if lookups else None}
+
+
+identity_cache = IdentityCache()
+
+
+def _column_values(instance):
+    return {attr.key: getattr(instance, attr.key)
+            for attr in inspect(type(instance)).column_attrs
+            if attr.key not in _EXCLUDED_COLUMNS}
+
+
+def _key(tenant_id, user_id):
+    return f'{tenant_id}/{user_id}'
+
+
+def load_cached_identity(user_id):
+    """
+    Drop-in replacement for load_identity() backed by the identity cache
+    """
+    tenant = current_tenant.get()
+    key = _key(tenant.id if tenant is not None else None, user_id)
+    values = identity_cache.get(key)
+    if values is not None:
+        instance = IDENTITY_MODELS[str(user_id).partition(':')[0]](**values)
+        make_transient_to_detached(instance)
+        return db.session.merge(instance, load=False)
+
+    instance = load_identity(IDENTITY_MODELS, user_id)
+    if instance is not None:
+        identity_cache.put(key, _column_values(instance))
+    return instance
+
+
+@event.listens_for(Admin, 'after_update')
+@event.listens_for(Admin, 'after_delete')
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _evict_identity(mapper, connection, target):
+    identity_cache.invalidate(_key(target.tenant_id, target.get_id()))
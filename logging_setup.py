@@ -0,0 +1,150 @@
+import copy
+import json
+import time
+import uuid
+import queue
+import atexit
+import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener
+from flask import g, has_request_context, request
+
+# Non-blocking structured logging.
+#
+# Request threads only put records on an in-memory queue; a QueueListener
+# thread merges the %-style arguments, formats them as JSON lines and does the
+# actual I/O. Log lazily (`logger.info("quiz %s", quiz_id)`, not f-strings) so
+# that work stays off the request thread too. Every record
+# carries the id of the request that produced it (taken from an incoming
+# X-Request-ID header or generated), and the id is echoed back in the response.
+
+_listener = None
+_queue_handler = None
+
+_RESERVED_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'request_id'}
+
+
+class RequestIdFilter(logging.Filter):
+    """
+    Stamp records with the current request id. Runs in the emitting thread,
+    before the record is queued, while the request context is still there
+    """
+
+    def filter(self, record):
+        record.request_id = g.get('request_id') if has_request_context() else None
+        return True
+
+
+_IMMUTABLE_ARGS = (str, int, float, bool, bytes, type(None))
+
+
+class LazyQueueHandler(QueueHandler):
+    """
+    QueueHandler that queues records unformatted. The standard one merges the
+    message and renders the traceback in the emitting thread so the record can
+    be pickled; this queue never leaves the process, so the record keeps its
+    args and exc_info and the listener thread does that work. Only messages
+    with mutable arguments, which could change before the listener gets to
+    them, are still merged here.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        args = record.args if isinstance(record.args, tuple) else (record.args,)
+        if not all(isinstance(arg, _IMMUTABLE_ARGS) for arg in args):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'request_id': getattr(record, 'request_id', None),
+        }
+        # Anything passed through `extra=` becomes a structured field
+        for key, value in vars(record).items():
+            if key not in _RESERVED_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class LogSampler:
+    """
+    Lets through the first record and then one in every `every` calls, for
+    debug logging inside hot loops:
+
+        if sampler.should_log():
+            logger.debug("row %s", index)
+    """
+
+    def __init__(self, every=100):
+        self.every = every
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def should_log(self):
+        with self._lock:
+            self._count += 1
+            return self._count % self.every == 1 or self.every == 1
+
+
+def parse_levels(spec):
+    """
+    "sqlalchemy.engine=WARNING,search=DEBUG" -> {"sqlalchemy.engine": "WARNING", "search": "DEBUG"}
+    """
+    levels = {}
+    for item in filter(None, (part.strip() for part in (spec or '').split(','))):
+        name, _, level = item.partition('=')
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def configure_logging(app):
+    """
+    Route all logging through a background queue listener.
+    Safe to call more than once; later calls only update levels.
+    """
+    global _listener, _queue_handler
+
+    root = logging.getLogger()
+    root.setLevel(app.config['LOG_LEVEL'].upper())
+    for name, level in app.config['LOG_LEVELS'].items():
+        logging.getLogger(name).setLevel(level)
+
+    if _listener is None:
+        if app.config['LOG_FORMAT'] == 'json':
+            formatter = JsonFormatter()
+        else:
+            formatter = logging.Formatter('%(asctime)s %(levelname)s [%(name)s] [%(request_id)s] %(message)s')
+        handlers = [logging.StreamHandler()]
+        if app.config.get('LOG_FILE'):
+            handlers.append(logging.FileHandler(app.config['LOG_FILE']))
+        for handler in handlers:
+            handler.setFormatter(formatter)
+
+        _queue_handler = LazyQueueHandler(queue.Queue(-1))
+        _queue_handler.addFilter(RequestIdFilter())
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        root.addHandler(_queue_handler)
+
+        _listener = QueueListener(_queue_handler.queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+    @app.before_request
+    def _assign_request_id():
+        g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+
+    @app.after_request
+    def _echo_request_id(response):
+        if 'request_id' in g:
+            response.headers['X-Request-ID'] = g.request_id
+        return response
@@ -1,4 +1,9 @@
-from app import app
+# Spawned worker processes (score reports) import this file as __mp_main__;
+# they need neither the app nor its imports
+if __name__ != '__mp_main__':
+    from app import create_app
+
+    app = create_app()
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000, debug=True)
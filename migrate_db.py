@@ -1,58 +1,220 @@
 
 import sys
 import os
-from app import app, db
-from models import Question
+from sqlalchemy import MetaData, Text, inspect, text, literal
+from sqlalchemy.schema import CreateTable
+from app import create_app, db
+from models import Question, Tenant
+from tenancy import tenant_registry, tenant_tables, each_tenant
+from backup import take_snapshots
+from archive import index_archive_batches
+
+app = create_app()
+
+def snapshot_databases():
+    """
+    Snapshot every database before migrating, so `flask backup restore` can roll back
+    """
+    print("Taking pre-migration snapshots...")
+
+    try:
+        with app.app_context():
+            for manifest in take_snapshots(label='pre-migration'):
+                print(f"Snapshot {manifest['id']} of {manifest['database']} taken")
+
+    except Exception as e:
+        print(f"Error taking snapshots: {str(e)}")
+        return False
+
+    return True
+
+TEXT_COLUMNS = ('question_statement', 'option_1', 'option_2', 'option_3', 'option_4')
+
+def question_needs_migration(engine):
+    """
+    Whether the question table still has the old VARCHAR text columns
+    """
+    inspector = inspect(engine)
+    if not inspector.has_table('question'):
+        return False
+    types = {column['name']: column['type'] for column in inspector.get_columns('question')}
+    return any(name in types and not isinstance(types[name], Text) for name in TEXT_COLUMNS)
+
+def rebuild_question_table(engine):
+    """
+    SQLite cannot change column types in place: copy the rows into a table
+    built from the model and swap it in. Foreign keys are off meanwhile so
+    dropping the old table does not cascade into answers and scores.
+    """
+    metadata = MetaData()
+    for table in db.metadata.sorted_tables:
+        table.to_metadata(metadata)
+    new_table = Question.__table__.to_metadata(metadata, name='question_new')
+    # Index names clash with the old table's; add_missing_indexes() recreates them
+    new_table.indexes.clear()
+    existing = {column['name'] for column in inspect(engine).get_columns('question')}
+    columns = ', '.join(column.name for column in new_table.columns if column.name in existing)
+
+    connection = engine.raw_connection()
+    try:
+        dbapi_connection = connection.driver_connection
+        # Issue BEGIN/COMMIT ourselves so the DDL is part of the transaction
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=OFF")
+        try:
+            cursor.execute("BEGIN")
+            cursor.execute(str(CreateTable(new_table).compile(dialect=engine.dialect)))
+            cursor.execute(f"INSERT INTO question_new ({columns}) SELECT {columns} FROM question")
+            cursor.execute("DROP TABLE question")
+            cursor.execute("ALTER TABLE question_new RENAME TO question")
+            problems = cursor.execute("PRAGMA foreign_key_check").fetchall()
+            if problems:
+                raise RuntimeError(f"{len(problems)} rows would violate foreign keys")
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+        finally:
+            cursor.execute("PRAGMA foreign_keys=ON")
+            dbapi_connection.isolation_level = ''
+    finally:
+        connection.close()
 
 def migrate_database():
     """
     Script to migrate the database schema for the Question model
     """
     print("Starting database migration...")
-    
+
     try:
         with app.app_context():
-            print("Altering table 'question' to change column types...")
-            # SQLite doesn't support ALTER TABLE to change column types directly, so we need to create a new table
-            db.engine.execute("PRAGMA foreign_keys=OFF;")
-            
-            # Create a new temporary table with the new schema
-            db.engine.execute("""
-            CREATE TABLE question_new (
-                id INTEGER PRIMARY KEY,
-                quiz_id INTEGER NOT NULL,
-                question_statement TEXT NOT NULL,
-                question_image VARCHAR(255),
-                option_1 TEXT NOT NULL,
-                option_2 TEXT NOT NULL,
-                option_3 TEXT NOT NULL,
-                option_4 TEXT NOT NULL,
-                correct_option INTEGER NOT NULL,
-                FOREIGN KEY(quiz_id) REFERENCES quiz(id)
-            );
-            """)
-            
-            # Copy data from the old table to the new one
-            db.engine.execute("""
-            INSERT INTO question_new 
-            SELECT id, quiz_id, question_statement, question_image, option_1, option_2, option_3, option_4, correct_option 
-            FROM question;
-            """)
-            
-            # Replace the old table with the new one
-            db.engine.execute("DROP TABLE question;")
-            db.engine.execute("ALTER TABLE question_new RENAME TO question;")
-            
-            # Re-enable foreign keys
-            db.engine.execute("PRAGMA foreign_keys=ON;")
-            
+            for engine in database_engines():
+                if not question_needs_migration(engine):
+                    continue
+                print("Altering table 'question' to change column types...")
+                if engine.dialect.name == 'sqlite':
+                    rebuild_question_table(engine)
+                else:
+                    with engine.begin() as conn:
+                        for name in TEXT_COLUMNS:
+                            conn.execute(text(f"ALTER TABLE question ALTER COLUMN {name} TYPE TEXT"))
+
             print("Migration completed successfully!")
-            
+
     except Exception as e:
         print(f"Error during migration: {str(e)}")
         return False
-    
+
+    return True
+
+def database_engines():
+    """
+    The shared database plus every tenant database or schema
+    """
+    engines = [db.engine]
+    if inspect(db.engine).has_table(Tenant.__tablename__):
+        for tenant in Tenant.query.order_by(Tenant.id):
+            engine = tenant_registry.engine(tenant)
+            if engine is not None:
+                # Tables added since the tenant was created
+                db.metadata.create_all(bind=engine, tables=tenant_tables())
+                engines.append(engine)
+    return engines
+
+def add_missing_columns():
+    """
+    Add columns that exist on the models but not yet in the database tables.
+    New columns must be nullable or have a scalar default.
+    """
+    print("Checking for missing columns...")
+
+    try:
+        with app.app_context():
+            for engine in database_engines():
+                inspector = inspect(engine)
+                preparer = engine.dialect.identifier_preparer
+                with engine.begin() as conn:
+                    for table in db.metadata.sorted_tables:
+                        if not inspector.has_table(table.name):
+                            continue  # created by db.create_all()
+                        existing = {column['name'] for column in inspector.get_columns(table.name)}
+                        for column in table.columns:
+                            if column.name in existing:
+                                continue
+                            ddl = f"{preparer.quote(column.name)} {column.type.compile(dialect=engine.dialect)}"
+                            if column.default is not None and column.default.is_scalar:
+                                value = literal(column.default.arg, column.type).compile(
+                                    dialect=engine.dialect, compile_kwargs={"literal_binds": True})
+                                ddl += f" DEFAULT {value}"
+                                if not column.nullable:
+                                    ddl += " NOT NULL"
+                            print(f"Adding column {table.name}.{column.name}")
+                            conn.execute(text(f"ALTER TABLE {preparer.quote(table.name)} ADD COLUMN {ddl}"))
+
+            print("Column check completed successfully!")
+
+    except Exception as e:
+        print(f"Error adding columns: {str(e)}")
+        return False
+
+    return True
+
+def add_missing_indexes():
+    """
+    Create indexes declared on the models that existing tables are missing
+    """
+    print("Checking for missing indexes...")
+
+    try:
+        with app.app_context():
+            for engine in database_engines():
+                inspector = inspect(engine)
+                for table in db.metadata.sorted_tables:
+                    if not inspector.has_table(table.name):
+                        continue
+                    existing = {index['name'] for index in inspector.get_indexes(table.name)}
+                    for index in table.indexes:
+                        if index.name not in existing:
+                            print(f"Creating index {index.name}")
+                            index.create(engine)
+
+            print("Index check completed successfully!")
+
+    except Exception as e:
+        print(f"Error creating indexes: {str(e)}")
+        return False
+
+    return True
+
+def index_archived_quizzes():
+    """
+    Record which quizzes the archive batches made before ScoreArchiveQuiz hold
+    """
+    print("Indexing archived attempts by quiz...")
+
+    try:
+        with app.app_context():
+            db.create_all()
+            database_engines()  # creates the table in tenant databases
+            for tenant in each_tenant():
+                indexed = index_archive_batches()
+                if indexed:
+                    print(f"Indexed {indexed} archive batches" + (f" of {tenant.slug}" if tenant else ''))
+
+            print("Archive indexing completed successfully!")
+
+    except Exception as e:
+        print(f"Error indexing archive batches: {str(e)}")
+        return False
+
     return True
 
 if __name__ == "__main__":
+    if not snapshot_databases():
+        print("Not migrating without a snapshot.")
+        sys.exit(1)
     migrate_database()
+    add_missing_columns()
+    add_missing_indexes()
+    index_archived_quizzes()
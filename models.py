@@ -2,45 +2,74 @@ from app import db
 from flask_login import UserMixin
 from datetime import datetime
 
-class Admin(UserMixin, db.Model):
+class Tenant(db.Model):
+    # An institution; lives in the default database only, see tenancy.py
+    __tenant_global__ = True
     id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(64), unique=True, nullable=False)
+    slug = db.Column(db.String(64), unique=True, nullable=False)
+    name = db.Column(db.String(120), nullable=False)
+    hostname = db.Column(db.String(255), unique=True)
+    database_uri = db.Column(db.String(512))  # own database; None means the shared one
+    schema = db.Column(db.String(63))         # own PostgreSQL schema in the shared server
+    active = db.Column(db.Boolean, nullable=False, default=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class TenantScoped:
+    # Rows belong to one tenant; queries are filtered centrally, see tenancy.py
+    tenant_id = db.Column(db.Integer, index=True)
+
+class Admin(TenantScoped, UserMixin, db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String(64), nullable=False)
     password = db.Column(db.String(256), nullable=False)
 
-class User(UserMixin, db.Model):
+    __table_args__ = (db.UniqueConstraint('tenant_id', 'username'),)
+
+    def get_id(self):
+        # Typed so admin and user ids never collide in the session
+        return f'admin:{self.id}'
+
+class User(TenantScoped, UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    email = db.Column(db.String(120), unique=True, nullable=False)
+    email = db.Column(db.String(120), nullable=False)
     password = db.Column(db.String(256), nullable=False)
     full_name = db.Column(db.String(100), nullable=False)
     qualification = db.Column(db.String(100), nullable=False)
     dob = db.Column(db.Date, nullable=False)
-    scores = db.relationship('Score', backref='user', lazy=True)
+    scores = db.relationship('Score', backref='user', lazy=True, passive_deletes=True)
 
-class Subject(db.Model):
+    __table_args__ = (db.UniqueConstraint('tenant_id', 'email'),)
+
+    def get_id(self):
+        return f'user:{self.id}'
+
+class Subject(TenantScoped, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text)
-    chapters = db.relationship('Chapter', backref='subject', lazy=True)
+    chapters = db.relationship('Chapter', backref='subject', lazy=True, passive_deletes=True)
 
-class Chapter(db.Model):
+class Chapter(TenantScoped, db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    subject_id = db.Column(db.Integer, db.ForeignKey('subject.id'), nullable=False)
+    subject_id = db.Column(db.Integer, db.ForeignKey('subject.id', ondelete='RESTRICT'), nullable=False, index=True)
     name = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text)
-    quizzes = db.relationship('Quiz', backref='chapter', lazy=True)
+    quizzes = db.relationship('Quiz', backref='chapter', lazy=True, passive_deletes=True)
 
-class Quiz(db.Model):
+class Quiz(TenantScoped, db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    chapter_id = db.Column(db.Integer, db.ForeignKey('chapter.id'), nullable=False)
+    chapter_id = db.Column(db.Integer, db.ForeignKey('chapter.id', ondelete='RESTRICT'), nullable=False, index=True)
     date_of_quiz = db.Column(db.DateTime, nullable=False)
     time_duration = db.Column(db.Integer, nullable=False)  # in minutes
     remarks = db.Column(db.Text)
-    questions = db.relationship('Question', backref='quiz', lazy=True)
-    scores = db.relationship('Score', backref='quiz', lazy=True)
+    questions_per_attempt = db.Column(db.Integer)  # None means every question
+    shuffle_questions = db.Column(db.Boolean, nullable=False, default=False)
+    questions = db.relationship('Question', backref='quiz', lazy=True, passive_deletes=True)
+    scores = db.relationship('Score', backref='quiz', lazy=True, passive_deletes=True)
 
-class Question(db.Model):
+class Question(TenantScoped, db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.id'), nullable=False)
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.id', ondelete='CASCADE'), nullable=False, index=True)
     question_statement = db.Column(db.Text, nullable=False)
     question_image = db.Column(db.String(255))  # Path to the image file
     option_1 = db.Column(db.Text, nullable=False)
@@ -49,9 +78,87 @@ class Question(db.Model):
     option_4 = db.Column(db.Text, nullable=False)
     correct_option = db.Column(db.Integer, nullable=False)
 
-class Score(db.Model):
+class Score(TenantScoped, db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.id'), nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.id', ondelete='CASCADE'), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
     time_stamp_of_attempt = db.Column(db.DateTime, default=datetime.utcnow)
-    total_scored = db.Column(db.Integer, nullable=False)
\ No newline at end of file
+    total_scored = db.Column(db.Integer, nullable=False)
+    paper_seed = db.Column(db.Integer)  # see papers.py; None for full, unshuffled papers
+    paper_layout = db.Column(db.Text)   # the drawn paper as JSON (see papers.py); None on older attempts
+
+    __table_args__ = (db.Index('ix_score_user_id_time_stamp', 'user_id', 'time_stamp_of_attempt'),)
+
+class AttemptAnswer(TenantScoped, db.Model):
+    # Per-question outcome of an attempt, input to the practice recommender
+    score_id = db.Column(db.Integer, db.ForeignKey('score.id', ondelete='CASCADE'), primary_key=True)
+    question_id = db.Column(db.Integer, db.ForeignKey('question.id', ondelete='CASCADE'), primary_key=True,
+                            index=True)
+    chosen_option = db.Column(db.Integer)  # None when left unanswered
+    is_correct = db.Column(db.Boolean, nullable=False)
+
+class QuestionSignature(TenantScoped, db.Model):
+    # MinHash signature of a question, see dedup.py
+    question_id = db.Column(db.Integer, db.ForeignKey('question.id', ondelete='CASCADE'), primary_key=True)
+    minhash = db.Column(db.LargeBinary, nullable=False)
+
+class QuestionLSHBucket(TenantScoped, db.Model):
+    question_id = db.Column(db.Integer, db.ForeignKey('question.id', ondelete='CASCADE'), primary_key=True)
+    band = db.Column(db.Integer, primary_key=True)
+    bucket = db.Column(db.BigInteger, nullable=False)
+
+    __table_args__ = (db.Index('ix_question_lsh_bucket_band_bucket', 'band', 'bucket'),)
+
+
+class ScoreArchiveBatch(TenantScoped, db.Model):
+    # Compressed attempts moved out of the score table, see archive.py
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False, index=True)
+    attempts = db.Column(db.Integer, nullable=False)
+    first_attempt_at = db.Column(db.DateTime, nullable=False)
+    last_attempt_at = db.Column(db.DateTime, nullable=False)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+    payload = db.Column(db.LargeBinary, nullable=False)
+    quizzes = db.relationship('ScoreArchiveQuiz', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
+
+class ScoreArchiveQuiz(TenantScoped, db.Model):
+    # A quiz's share of an archive batch, so deleting the quiz only rewrites the batches that hold it
+    batch_id = db.Column(db.Integer, db.ForeignKey('score_archive_batch.id', ondelete='CASCADE'), primary_key=True)
+    quiz_id = db.Column(db.Integer, primary_key=True, index=True)
+    attempts = db.Column(db.Integer, nullable=False)
+    total_scored = db.Column(db.Integer, nullable=False)
+    highest_score = db.Column(db.Integer, nullable=False)
+    lowest_score = db.Column(db.Integer, nullable=False)
+    first_attempt_at = db.Column(db.DateTime, nullable=False)
+    answered = db.Column(db.Integer, nullable=False, default=0)
+    correct = db.Column(db.Integer, nullable=False, default=0)
+    in_chapter_summary = db.Column(db.Boolean, nullable=False, default=True)  # False when indexed after the fact
+
+class UserScoreSummary(TenantScoped, db.Model):
+    # Running aggregates over a user's archived attempts
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    total_scored = db.Column(db.Integer, nullable=False, default=0)
+    highest_score = db.Column(db.Integer)
+    lowest_score = db.Column(db.Integer)
+    first_attempt_at = db.Column(db.DateTime)
+
+class UserChapterSummary(TenantScoped, db.Model):
+    # Per-chapter evidence from a user's archived attempts, input to the practice recommender
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    chapter_id = db.Column(db.Integer, db.ForeignKey('chapter.id', ondelete='CASCADE'), primary_key=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    total_scored = db.Column(db.Integer, nullable=False, default=0)
+    answered = db.Column(db.Integer, nullable=False, default=0)
+    correct = db.Column(db.Integer, nullable=False, default=0)
+
+class PracticeSuggestion(TenantScoped, db.Model):
+    # Precomputed "practice next" picks, see recommender.py
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    rank = db.Column(db.Integer, primary_key=True)
+    chapter_id = db.Column(db.Integer, db.ForeignKey('chapter.id', ondelete='CASCADE'), nullable=False)
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.id', ondelete='CASCADE'), nullable=False)
+    mastery = db.Column(db.Float, nullable=False)
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow)
+    chapter = db.relationship('Chapter')
+    quiz = db.relationship('Quiz')
@@ -0,0 +1,140 @@
+import json
+import time
+import random
+import secrets
+import threading
+from collections import namedtuple
+from app import db, current_tenant
+from models import Question
+
+# Per-student question papers.
+#
+# A paper is drawn from the quiz settings, the quiz's question-id pool and a
+# random seed when the attempt starts. Its layout (question ids and option
+# orders, see dump_paper) is kept in the session until submission, so the
+# answers are graded against what the student saw even if the bank changes
+# meanwhile or the submission lands on another worker. A few hundred
+# questions fit comfortably in the session cookie. On submission the layout
+# is stored on the Score, so reviews show the same paper later on. Attempts
+# submitted before that only have their seed and are rebuilt from it.
+
+POOL_CACHE_TTL = 60  # seconds; bounds staleness across worker processes
+DEFAULT_OPTION_ORDER = (1, 2, 3, 4)
+
+Paper = namedtuple('Paper', ['seed', 'question_ids', 'option_orders'])
+
+_pool_cache = {}
+_pool_lock = threading.Lock()
+
+
+def new_paper_seed():
+    return secrets.randbelow(2 ** 31)
+
+
+def _pool_key(quiz_id):
+    # Tenants with their own database may reuse quiz ids
+    tenant = current_tenant.get()
+    return (tenant.id if tenant is not None else None, quiz_id)
+
+
+def question_pool(quiz_id):
+    """
+    Sorted tuple of the quiz's question ids, cached per process
+    """
+    now = time.monotonic()
+    key = _pool_key(quiz_id)
+    cached = _pool_cache.get(key)
+    if cached and cached[0] > now:
+        return cached[1]
+
+    ids = tuple(row[0] for row in db.session.query(Question.id)
+                .filter(Question.quiz_id == quiz_id).order_by(Question.id))
+    with _pool_lock:
+        _pool_cache[key] = (now + POOL_CACHE_TTL, ids)
+    return ids
+
+
+def invalidate_question_pool(quiz_id):
+    with _pool_lock:
+        _pool_cache.pop(_pool_key(quiz_id), None)
+
+
+def build_paper(quiz, seed):
+    """
+    Deterministically draw a paper for one attempt.
+    A seed of None gives the legacy paper: every question, insertion order.
+    """
+    pool = question_pool(quiz.id)
+    if seed is None:
+        return Paper(None, list(pool), {qid: DEFAULT_OPTION_ORDER for qid in pool})
+
+    rng = random.Random(seed)
+    size = len(pool)
+    count = min(quiz.questions_per_attempt or size, size)
+
+    # Partial Fisher-Yates over a virtual copy of the pool: only the swapped
+    # slots are materialised, so drawing N of M questions costs O(N).
+    swapped = {}
+    drawn = []
+    for i in range(count):
+        j = rng.randrange(i, size)
+        drawn.append(swapped.get(j, pool[j]))
+        swapped[j] = swapped.get(i, pool[i])
+
+    if not quiz.shuffle_questions:
+        drawn.sort()
+        return Paper(seed, drawn, {qid: DEFAULT_OPTION_ORDER for qid in drawn})
+
+    option_orders = {}
+    for qid in drawn:
+        order = list(DEFAULT_OPTION_ORDER)
+        rng.shuffle(order)
+        option_orders[qid] = tuple(order)
+    return Paper(seed, drawn, option_orders)
+
+
+def dump_paper(paper):
+    """
+    JSON for Score.paper_layout: [question id, *option order] per question
+    """
+    return json.dumps({'seed': paper.seed,
+                       'questions': [[qid, *paper.option_orders[qid]] for qid in paper.question_ids]},
+                      separators=(',', ':'))
+
+
+def load_paper(layout):
+    data = json.loads(layout)
+    return Paper(data['seed'],
+                 [row[0] for row in data['questions']],
+                 {row[0]: tuple(row[1:]) for row in data['questions']})
+
+
+def attempt_paper(score, quiz=None):
+    """
+    The paper a submitted attempt was taken on
+    """
+    if score.paper_layout:
+        return load_paper(score.paper_layout)
+    return build_paper(quiz or score.quiz, score.paper_seed)
+
+
+def load_paper_questions(paper):
+    """
+    Question objects of a paper, in paper order
+    """
+    if not paper.question_ids:
+        return []
+    by_id = {q.id: q for q in Question.query.filter(Question.id.in_(paper.question_ids))}
+    return [by_id[qid] for qid in paper.question_ids if qid in by_id]
+
+
+def original_option(paper, question_id, position):
+    """
+    Map the option position a student picked on their paper back to the
+    question's own option number (the numbering used by correct_option).
+    None for anything that is not a position on the paper.
+    """
+    order = paper.option_orders[question_id]
+    if not str(position).isdigit() or not 1 <= int(position) <= len(order):
+        return None
+    return order[int(position) - 1]
@@ -0,0 +1,192 @@
+import time
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+from sqlalchemy import event, select
+from app import db, current_tenant, TenantSession
+from models import Chapter, Quiz, Score
+from archive import load_archived_scores
+
+# Progress-chart time series.
+#
+# Charts fetch a user's attempt history as JSON after the page has rendered.
+# Long histories are downsampled to a fixed point budget with
+# Largest-Triangle-Three-Buckets (LTTB), which keeps the first and last attempt
+# and the peaks and dips that define the trend, so a chart never has to draw
+# more than `points` markers however many attempts there are. Results are
+# cached per process: a user's entries are dropped when this process inserts
+# or deletes one of their attempts, and a tenant's entries on any bulk update
+# or delete of scores (quiz and user deletes, archiving). Writes made by other
+# processes show up once the entry expires (PROGRESS_CACHE_TTL).
+
+DEFAULT_POINTS = 100
+MAX_POINTS = 1000
+
+
+def lttb(points, threshold):
+    """
+    Downsample [(x, y, ...), ...] sorted by x to at most `threshold` points
+    (never fewer than 3: the first, the last and one in between)
+    """
+    size = len(points)
+    threshold = max(threshold, 3)
+    if threshold >= size:
+        return list(points)
+
+    sampled = [points[0]]
+    bucket_size = (size - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # Average of the next bucket is the third triangle vertex
+        next_start = int((i + 1) * bucket_size) + 1
+        next_end = min(int((i + 2) * bucket_size) + 1, size)
+        next_bucket = points[next_start:next_end]
+        avg_x = sum(p[0] for p in next_bucket) / len(next_bucket)
+        avg_y = sum(p[1] for p in next_bucket) / len(next_bucket)
+
+        # Keep the point of this bucket forming the largest triangle
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+        ax, ay = points[a][0], points[a][1]
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            x, y = points[j][0], points[j][1]
+            area = abs((ax - avg_x) * (y - ay) - (ax - x) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        sampled.append(points[best])
+        a = best
+
+    sampled.append(points[-1])
+    return sampled
+
+
+class SeriesCache:
+    """
+    Bounded LRU of computed series with a TTL, invalidated per user
+    """
+
+    def __init__(self, maxsize=2048, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def configure(self, maxsize, ttl):
+        with self._lock:
+            self.maxsize = maxsize
+            self.ttl = ttl
+            self._entries.clear()
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate_user(self, tenant_id, user_id):
+        # Keys start with the tenant and user id
+        with self._lock:
+            for key in [key for key in self._entries if key[:2] == (tenant_id, user_id)]:
+                del self._entries[key]
+
+    def invalidate_tenant(self, tenant_id):
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == tenant_id]:
+                del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'size': len(self._entries),
+                    'maxsize': self.maxsize,
+                    'ttl_seconds': self.ttl,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_ratio': round(self.hits / lookups, 4) if lookups else None}
+
+
+series_cache = SeriesCache()
+
+
+def _attempts(user_id, quiz_id=None, subject_id=None, start=None, end=None, include_archived=False):
+    statement = (select(Score.time_stamp_of_attempt, Score.total_scored)
+                 .where(Score.user_id == user_id)
+                 .order_by(Score.time_stamp_of_attempt))
+    if quiz_id:
+        statement = statement.where(Score.quiz_id == quiz_id)
+    if subject_id:
+        statement = (statement.join(Quiz, Quiz.id == Score.quiz_id)
+                     .join(Chapter, Chapter.id == Quiz.chapter_id)
+                     .where(Chapter.subject_id == subject_id))
+    if start:
+        statement = statement.where(Score.time_stamp_of_attempt >= start)
+    if end:
+        # end date is inclusive
+        statement = statement.where(Score.time_stamp_of_attempt < end + timedelta(days=1))
+    rows = [tuple(row) for row in db.session.execute(statement)]
+
+    if include_archived:
+        archived = [(a.time_stamp_of_attempt, a.total_scored) for a in load_archived_scores(user_id)
+                    if (not quiz_id or a.quiz_id == quiz_id)
+                    and (not subject_id or a.quiz.chapter.subject_id == subject_id)
+                    and (not start or a.time_stamp_of_attempt >= start)
+                    and (not end or a.time_stamp_of_attempt < end + timedelta(days=1))]
+        rows = sorted(rows + archived)
+    return rows
+
+
+def score_series(user_id, quiz_id=None, subject_id=None, start=None, end=None,
+                 points=DEFAULT_POINTS, include_archived=False):
+    """
+    Chart-ready {'labels', 'timestamps', 'data', 'total'} for a user's attempts, downsampled
+    to at most `points` entries
+    """
+    tenant = current_tenant.get()
+    key = (tenant.id if tenant is not None else None, user_id, quiz_id, subject_id, start, end, points,
+           include_archived)
+    cached = series_cache.get(key)
+    if cached is not None:
+        return cached
+
+    rows = _attempts(user_id, quiz_id, subject_id, start, end, include_archived)
+    sampled = lttb([(ts.timestamp(), total, ts) for ts, total in rows], points)
+    series = {
+        'labels': [ts.strftime('%d/%m/%Y') for _, _, ts in sampled],
+        'timestamps': [ts.isoformat() for _, _, ts in sampled],
+        'data': [total for _, total, _ in sampled],
+        'total': len(rows),
+    }
+    series_cache.put(key, series)
+    return series
+
+
+@event.listens_for(Score, 'after_insert')
+@event.listens_for(Score, 'after_delete')
+def _evict_series(mapper, connection, target):
+    series_cache.invalidate_user(target.tenant_id, target.user_id)
+
+
+@event.listens_for(TenantSession, 'do_orm_execute')
+def _evict_series_on_bulk_write(orm_execute_state):
+    # query.update()/delete() skip the mapper events and may touch any user's scores
+    if ((orm_execute_state.is_update or orm_execute_state.is_delete)
+            and orm_execute_state.bind_mapper is not None
+            and orm_execute_state.bind_mapper.class_ is Score):
+        tenant = current_tenant.get()
+        series_cache.invalidate_tenant(tenant.id if tenant is not None else None)
@@ -0,0 +1,190 @@
+from collections import defaultdict
+from datetime import datetime
+from sqlalchemy import Integer, cast, func, select
+from sqlalchemy.orm import joinedload
+from app import db
+from models import User, Chapter, Quiz, Question, Score, AttemptAnswer, UserChapterSummary, PracticeSuggestion
+
+# "Practice next" suggestions.
+#
+# A periodic batch job (`flask recommend-practice`) estimates every user's
+# mastery of every chapter from two signals: quiz scores and per-question
+# correctness, from live attempts plus what archive.py folded into
+# UserChapterSummary. Both are accumulated into dense users x chapters matrices, and
+# the estimate is a smoothed ratio that falls back to the chapter's average
+# where a user has little evidence:
+#
+#   mastery = (correct + ATTEMPT_WEIGHT * sum(score / 100) + PRIOR_WEIGHT * chapter_mean)
+#             / (answered + ATTEMPT_WEIGHT * attempts + PRIOR_WEIGHT)
+#
+# The weakest chapters (unseen ones count, but less) become the user's top-k
+# suggestions, stored in PracticeSuggestion so the dashboard reads them with
+# a single primary-key lookup.
+
+DEFAULT_TOP_K = 3
+ATTEMPT_WEIGHT = 5.0   # one attempt's score counts as much as this many answered questions
+PRIOR_WEIGHT = 10.0    # question-equivalents of the chapter average mixed into every estimate
+UNSEEN_DISCOUNT = 0.5  # need of a chapter the user has never practised, relative to a weak one
+USER_BATCH_SIZE = 500
+
+
+def record_answers(score, questions, user_answers):
+    """
+    Store the per-question outcome of a submitted attempt
+    """
+    db.session.add_all(AttemptAnswer(score_id=score.id,
+                                     question_id=question.id,
+                                     chosen_option=user_answers.get(question.id),
+                                     is_correct=user_answers.get(question.id) == question.correct_option)
+                       for question in questions)
+
+
+def _evidence(chapter_ids, user_ids=None):
+    """
+    Success and evidence (in question-equivalents) as users x chapters
+    matrices; with no `user_ids`, a single row summed over all users
+    """
+    import numpy as np
+
+    keys = [Score.user_id] if user_ids is not None else []
+    archived_keys = [UserChapterSummary.user_id] if user_ids is not None else []
+    rows = user_ids if user_ids is not None else [None]
+    user_index = {user_id: i for i, user_id in enumerate(rows)}
+    chapter_index = {chapter_id: j for j, chapter_id in enumerate(chapter_ids)}
+    shape = (len(rows), len(chapter_ids))
+    attempts, score_sum, answered, correct = (np.zeros(shape) for _ in range(4))
+
+    scores = (select(*keys, Quiz.chapter_id, func.count(Score.id), func.sum(Score.total_scored))
+              .select_from(Score)
+              .join(Quiz, Quiz.id == Score.quiz_id)
+              .group_by(*keys, Quiz.chapter_id))
+    answers = (select(*keys, Quiz.chapter_id, func.count(), func.sum(cast(AttemptAnswer.is_correct, Integer)))
+               .select_from(AttemptAnswer)
+               .join(Score, Score.id == AttemptAnswer.score_id)
+               .join(Question, Question.id == AttemptAnswer.question_id)
+               .join(Quiz, Quiz.id == Question.quiz_id)
+               .group_by(*keys, Quiz.chapter_id))
+    archived = (select(*archived_keys, UserChapterSummary.chapter_id,
+                       func.sum(UserChapterSummary.attempts), func.sum(UserChapterSummary.total_scored),
+                       func.sum(UserChapterSummary.answered), func.sum(UserChapterSummary.correct))
+                .group_by(*archived_keys, UserChapterSummary.chapter_id))
+    if user_ids is not None:
+        scores = scores.where(Score.user_id.in_(user_ids))
+        answers = answers.where(Score.user_id.in_(user_ids))
+        archived = archived.where(UserChapterSummary.user_id.in_(user_ids))
+
+    for statement, matrices in ((scores, (attempts, score_sum)), (answers, (answered, correct)),
+                                (archived, (attempts, score_sum, answered, correct))):
+        for row in db.session.execute(statement):
+            user_id = row[0] if keys else None
+            chapter_id, values = row[len(keys)], row[len(keys) + 1:]
+            j = chapter_index.get(chapter_id)
+            if j is None:
+                continue
+            for matrix, value in zip(matrices, values):
+                matrix[user_index[user_id], j] += value or 0
+
+    return correct + ATTEMPT_WEIGHT * score_sum / 100.0, answered + ATTEMPT_WEIGHT * attempts
+
+
+def chapter_means(chapter_ids):
+    """
+    Average success per chapter over all users; 0.5 where nobody has tried
+    """
+    import numpy as np
+
+    success, evidence = _evidence(chapter_ids)
+    return np.divide(success[0], evidence[0], out=np.full(len(chapter_ids), 0.5), where=evidence[0] > 0)
+
+
+def mastery_matrix(user_ids, chapter_ids, prior):
+    """
+    users x chapters arrays of mastery estimates and evidence weights
+    """
+    success, evidence = _evidence(chapter_ids, user_ids)
+    mastery = (success + PRIOR_WEIGHT * prior) / (evidence + PRIOR_WEIGHT)
+    return mastery, evidence
+
+
+def top_chapters(mastery, evidence, k):
+    """
+    Column indexes of each user's k weakest chapters, weakest first
+    """
+    import numpy as np
+
+    need = np.where(evidence > 0, 1.0 - mastery, UNSEEN_DISCOUNT * (1.0 - mastery))
+    k = min(k, need.shape[1])
+    if k == 0:
+        return np.zeros((need.shape[0], 0), dtype=int)
+    top = np.argpartition(-need, k - 1, axis=1)[:, :k]
+    order = np.take_along_axis(-need, top, axis=1).argsort(axis=1, kind='stable')
+    return np.take_along_axis(top, order, axis=1)
+
+
+def _pick_quizzes(user_ids, quizzes_by_chapter):
+    """
+    pick(user_id, chapter_id) -> quiz_id: the chapter's quiz the user has
+    tried least, then scored lowest on, then the newest
+    """
+    tried = defaultdict(dict)
+    for user_id, quiz_id, count, best in db.session.execute(
+            select(Score.user_id, Score.quiz_id, func.count(Score.id), func.max(Score.total_scored))
+            .where(Score.user_id.in_(user_ids))
+            .group_by(Score.user_id, Score.quiz_id)):
+        tried[user_id][quiz_id] = (count, best)
+
+    def pick(user_id, chapter_id):
+        return min(quizzes_by_chapter[chapter_id],
+                   key=lambda quiz: tried[user_id].get(quiz[0], (0, -1)) + (-quiz[1].timestamp(),))[0]
+    return pick
+
+
+def recommend_practice(top_k=DEFAULT_TOP_K, progress=None):
+    """
+    Recompute every user's suggestions, one transaction per batch of users.
+    Returns the number of users processed.
+    """
+    # Only chapters with at least one quiz that has questions can be suggested
+    quizzes_by_chapter = defaultdict(list)
+    for quiz_id, chapter_id, date_of_quiz in db.session.execute(
+            select(Quiz.id, Quiz.chapter_id, Quiz.date_of_quiz)
+            .where(select(Question.id).where(Question.quiz_id == Quiz.id).exists())):
+        quizzes_by_chapter[chapter_id].append((quiz_id, date_of_quiz))
+    chapter_ids = sorted(quizzes_by_chapter)
+
+    prior = chapter_means(chapter_ids) if chapter_ids else None
+    computed_at = datetime.utcnow()
+    processed = 0
+    last_id = 0
+    while True:
+        user_ids = [row[0] for row in db.session.execute(
+            select(User.id).where(User.id > last_id).order_by(User.id).limit(USER_BATCH_SIZE))]
+        if not user_ids:
+            break
+        last_id = user_ids[-1]
+
+        PracticeSuggestion.query.filter(PracticeSuggestion.user_id.in_(user_ids)).delete(synchronize_session=False)
+        if chapter_ids:
+            mastery, evidence = mastery_matrix(user_ids, chapter_ids, prior)
+            pick = _pick_quizzes(user_ids, quizzes_by_chapter)
+            for i, columns in enumerate(top_chapters(mastery, evidence, top_k)):
+                for rank, j in enumerate(columns, 1):
+                    chapter_id = chapter_ids[j]
+                    db.session.add(PracticeSuggestion(user_id=user_ids[i], rank=rank, chapter_id=chapter_id,
+                                                      quiz_id=pick(user_ids[i], chapter_id),
+                                                      mastery=round(float(mastery[i, j]), 4),
+                                                      computed_at=computed_at))
+        db.session.commit()
+        processed += len(user_ids)
+        if progress:
+            progress(processed)
+    return processed
+
+
+def practice_suggestions(user_id):
+    return (PracticeSuggestion.query
+            .filter_by(user_id=user_id)
+            .options(joinedload(PracticeSuggestion.chapter).joinedload(Chapter.subject),
+                     joinedload(PracticeSuggestion.quiz))
+            .order_by(PracticeSuggestion.rank)
+            .all())
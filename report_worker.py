@@ -0,0 +1,61 @@
+import os
+import re
+
+# Worker side of batch score reports (see reports.py). Spawned worker
+# processes import this module on its own, so it must not import the app,
+# the models or anything else that opens a database. Pool workers receive the
+# snapshot once, through the pool initializer, and keep it in a module global
+# so tasks only carry their chunk of attempts; the in-process path passes the
+# snapshot as an argument.
+
+REPORT_TEMPLATES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates', 'reports')
+
+_env = None
+_snapshot = None  # set in pool workers by init_worker
+
+
+def _environment():
+    global _env
+    if _env is None:
+        from jinja2 import Environment, FileSystemLoader, select_autoescape
+        _env = Environment(loader=FileSystemLoader(REPORT_TEMPLATES), autoescape=select_autoescape())
+    return _env
+
+
+def _encode(html, pdf):
+    if pdf:
+        from weasyprint import HTML
+        return HTML(string=html).write_pdf()
+    return html.encode('utf-8')
+
+
+def _slug(text):
+    return re.sub(r'[^a-z0-9]+', '-', text.lower()).strip('-') or 'student'
+
+
+def render_attempts(snapshot, pdf, attempts):
+    template = _environment().get_template('attempt.html')
+    extension = 'pdf' if pdf else 'html'
+    return [(f"attempts/{attempt['score_id']}-{_slug(attempt['user_name'])}.{extension}",
+             _encode(template.render(snapshot=snapshot, attempt=attempt), pdf))
+            for attempt in attempts]
+
+
+def init_worker(snapshot):
+    """
+    Pool initializer: keep the run's snapshot for every task of this worker
+    """
+    global _snapshot
+    _snapshot = snapshot
+
+
+def render_chunk(pdf, attempts):
+    """
+    Pool task: render a chunk of attempts against the snapshot from init_worker
+    """
+    return render_attempts(_snapshot, pdf, attempts)
+
+
+def render_cohort(snapshot, pdf):
+    return (f"cohort.{'pdf' if pdf else 'html'}",
+            _encode(_environment().get_template('cohort.html').render(snapshot=snapshot), pdf))
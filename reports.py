@@ -0,0 +1,278 @@
+import io
+import os
+import json
+import time
+import zipfile
+import logging
+import threading
+import statistics
+import importlib.util
+import multiprocessing
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from sqlalchemy import select
+from app import db
+from models import User, Question, Score, AttemptAnswer
+from papers import build_paper, load_paper
+from report_worker import init_worker, render_attempts, render_chunk, render_cohort
+
+logger = logging.getLogger(__name__)
+
+# Batch score reports.
+#
+# Everything a report needs - the answer key, cohort statistics and, per
+# attempt, the paper and the recorded answers - is read from the database once
+# into plain data. Small cohorts are rendered right here. Larger ones are
+# sent, in chunks, to a pool of worker processes. The snapshot goes to each
+# worker once, through the pool initializer, rather than pickled with every
+# chunk; the pool is kept for later runs over the same snapshot and restarted
+# for a new one. Workers render with a standalone Jinja environment
+# (report_worker.py, which imports nothing from the app), so they never touch
+# the database or boot the app.
+
+REPORT_CHUNK = 50  # attempts per task sent to a worker
+REPORT_INPROCESS_MAX = 200  # larger cohorts go to the worker pool
+PASS_MARK = 40
+OPTION_LABELS = 'ABCD'
+
+_pool = None
+_pool_workers = 0
+_pool_snapshot = None
+_pool_lock = threading.Lock()
+
+class ReportMetrics:
+    """
+    Counts and timings of one report run
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.snapshot_seconds = 0.0
+        self.reports = 0
+        self.bytes = 0
+
+    def add(self, data):
+        self.reports += 1
+        self.bytes += len(data)
+
+    def snapshot(self):
+        elapsed = time.perf_counter() - self.started
+        return {'reports': self.reports,
+                'bytes': self.bytes,
+                'snapshot_ms': round(self.snapshot_seconds * 1000, 1),
+                'elapsed_ms': round(elapsed * 1000, 1),
+                'reports_per_second': round(self.reports / elapsed, 1) if elapsed else None}
+
+
+def pdf_available():
+    return importlib.util.find_spec('weasyprint') is not None
+
+
+def _cohort_statistics(attempts, questions):
+    totals = sorted(a['total_scored'] for a in attempts)
+    stats = {
+        'attempts': len(totals),
+        'mean': round(statistics.fmean(totals), 1) if totals else None,
+        'median': statistics.median(totals) if totals else None,
+        'stdev': round(statistics.pstdev(totals), 1) if totals else None,
+        'highest': totals[-1] if totals else None,
+        'lowest': totals[0] if totals else None,
+        'pass_rate': round(100 * sum(t >= PASS_MARK for t in totals) / len(totals)) if totals else None,
+        'histogram': [0] * 10,  # 0-9, 10-19, ... 90-100
+    }
+    for total in totals:
+        stats['histogram'][min(total // 10, 9)] += 1
+
+    # Per-question difficulty over the attempts whose answers were recorded
+    seen = defaultdict(int)
+    option_counts = defaultdict(lambda: [0, 0, 0, 0])
+    for attempt in attempts:
+        if attempt['answers'] is None:
+            continue
+        for question_id in attempt['question_ids']:
+            seen[question_id] += 1
+            chosen = attempt['answers'].get(question_id)
+            if chosen:
+                option_counts[question_id][chosen - 1] += 1
+    stats['questions'] = {}
+    for question_id, question in questions.items():
+        counts = option_counts[question_id]
+        correct = counts[question['correct'] - 1]
+        stats['questions'][question_id] = {
+            'seen': seen[question_id],
+            'answered': sum(counts),
+            'correct': correct,
+            'percent_correct': round(100 * correct / seen[question_id]) if seen[question_id] else None,
+            'option_counts': counts,
+        }
+
+    # Rank and percentile are computed here so workers need no other attempts
+    for attempt in attempts:
+        attempt['rank'] = len(totals) - bisect_right(totals, attempt['total_scored']) + 1
+        attempt['percentile'] = round(100 * bisect_left(totals, attempt['total_scored']) / len(totals))
+    return stats
+
+
+def build_snapshot(quiz, metrics=None):
+    """
+    Answer key, cohort statistics and per-attempt data for a whole quiz
+    """
+    started = time.perf_counter()
+    questions = {q.id: {'statement': q.question_statement,
+                        'options': [q.option_1, q.option_2, q.option_3, q.option_4],
+                        'correct': q.correct_option}
+                 for q in Question.query.filter_by(quiz_id=quiz.id).order_by(Question.id)}
+
+    answers = defaultdict(dict)
+    for score_id, question_id, chosen in db.session.execute(
+            select(AttemptAnswer.score_id, AttemptAnswer.question_id, AttemptAnswer.chosen_option)
+            .join(Score, Score.id == AttemptAnswer.score_id)
+            .where(Score.quiz_id == quiz.id)):
+        answers[score_id][question_id] = chosen
+
+    attempts = []
+    for score_id, seed, layout, attempted_at, total_scored, full_name, email in db.session.execute(
+            select(Score.id, Score.paper_seed, Score.paper_layout, Score.time_stamp_of_attempt,
+                   Score.total_scored, User.full_name, User.email)
+            .join(User, User.id == Score.user_id)
+            .where(Score.quiz_id == quiz.id)
+            .order_by(Score.id)):
+        paper = load_paper(layout) if layout else build_paper(quiz, seed)
+        attempts.append({
+            'score_id': score_id,
+            'user_name': full_name,
+            'user_email': email,
+            'attempted_at': attempted_at.strftime('%d %b %Y %H:%M') if attempted_at else '',
+            'total_scored': total_scored,
+            # Questions deleted since the attempt have no answer key left to report against
+            'question_ids': [qid for qid in paper.question_ids if qid in questions],
+            # None for attempts submitted before answers were recorded
+            'answers': answers.get(score_id),
+        })
+
+    snapshot = {
+        'quiz': {'id': quiz.id,
+                 'subject': quiz.chapter.subject.name,
+                 'chapter': quiz.chapter.name,
+                 'date': quiz.date_of_quiz.strftime('%d %b %Y'),
+                 'duration': quiz.time_duration,
+                 'remarks': quiz.remarks},
+        'questions': questions,
+        'stats': _cohort_statistics(attempts, questions),
+        'option_labels': OPTION_LABELS,
+        'pass_mark': PASS_MARK,
+        'generated_at': datetime.utcnow().strftime('%d %b %Y %H:%M UTC'),
+    }
+    if metrics:
+        metrics.snapshot_seconds = time.perf_counter() - started
+    return snapshot, attempts
+
+
+def _worker_pool(workers, snapshot):
+    """
+    The process-wide render pool, its workers initialised with `snapshot`.
+    Kept for later runs over the same snapshot, restarted for another one.
+    """
+    global _pool, _pool_workers, _pool_snapshot
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers or _pool_snapshot is not snapshot:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            # spawn: the web and CLI processes run threads, which fork() does not copy safely
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                        initializer=init_worker, initargs=(snapshot,))
+            _pool_workers = workers
+            _pool_snapshot = snapshot
+        return _pool
+
+
+def _discard_pool(pool):
+    global _pool, _pool_snapshot
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+            _pool_snapshot = None
+    pool.shutdown(wait=False)
+
+
+def iter_reports(snapshot, attempts, pdf=False, workers=None, metrics=None):
+    """
+    Yield (file name, bytes) for the cohort report and every attempt.
+    Cohorts up to REPORT_INPROCESS_MAX attempts, or workers=1, are rendered
+    in this process.
+    """
+    if pdf and not pdf_available():
+        raise RuntimeError('PDF reports need WeasyPrint (pip install weasyprint)')
+    metrics = metrics or ReportMetrics()
+    chunks = [attempts[i:i + REPORT_CHUNK] for i in range(0, len(attempts), REPORT_CHUNK)]
+    workers = min(workers or os.cpu_count() or 1, len(chunks))
+
+    name, data = render_cohort(snapshot, pdf)
+    metrics.add(data)
+    yield name, data
+
+    if workers <= 1 or len(attempts) <= REPORT_INPROCESS_MAX:
+        for chunk in chunks:
+            for name, data in render_attempts(snapshot, pdf, chunk):
+                metrics.add(data)
+                yield name, data
+        return
+
+    pool = _worker_pool(workers, snapshot)
+    try:
+        for rendered in pool.map(partial(render_chunk, pdf), chunks):
+            for name, data in rendered:
+                metrics.add(data)
+                yield name, data
+    except BrokenProcessPool:
+        # A worker died (e.g. killed for memory); the next run starts a fresh pool
+        _discard_pool(pool)
+        raise
+
+
+def write_report_dir(reports, path, metrics):
+    os.makedirs(os.path.join(path, 'attempts'), exist_ok=True)
+    for name, data in reports:
+        with open(os.path.join(path, name), 'wb') as f:
+            f.write(data)
+    with open(os.path.join(path, 'metrics.json'), 'w') as f:
+        json.dump(metrics.snapshot(), f, indent=2)
+    logger.info("Score reports generated", extra=metrics.snapshot())
+
+
+class _ZipSink(io.RawIOBase):
+    # Unseekable buffer: zipfile then writes data descriptors and never seeks back
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_report_zip(reports, metrics):
+    """
+    Yield a zip archive of the reports as it is built
+    """
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, data in reports:
+            archive.writestr(name, data)
+            yield sink.drain()
+        archive.writestr('metrics.json', json.dumps(metrics.snapshot(), indent=2))
+    yield sink.drain()
+    logger.info("Score reports generated", extra=metrics.snapshot())
@@ -0,0 +1,158 @@
+import re
+import logging
+from sqlalchemy import text
+from app import db, current_tenant
+
+logger = logging.getLogger(__name__)
+
+# Full-text search over the question bank.
+#
+# SQLite: a standalone FTS5 table keyed by question id (rowid), kept in sync
+# from the add/import/delete paths in app.py.
+# PostgreSQL: a GIN expression index over to_tsvector(...) on the question
+# table itself, so there is nothing to keep in sync.
+
+FTS_TABLE = 'question_fts'
+PG_INDEX = 'ix_question_search'
+PG_DOCUMENT = ("to_tsvector('english', coalesce(q.question_statement, '') || ' ' || "
+               "coalesce(q.option_1, '') || ' ' || coalesce(q.option_2, '') || ' ' || "
+               "coalesce(q.option_3, '') || ' ' || coalesce(q.option_4, ''))")
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def _dialect():
+    # The current tenant may live in a database of its own
+    return db.session.get_bind().dialect.name
+
+
+def ensure_search_index():
+    """
+    Create the search index if missing and backfill it from the question table
+    """
+    if _dialect() == 'postgresql':
+        db.session.execute(text(
+            f"CREATE INDEX IF NOT EXISTS {PG_INDEX} ON question "
+            f"USING GIN ({PG_DOCUMENT.replace('q.', '')})"
+        ))
+        db.session.commit()
+        return
+
+    db.session.execute(text(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+        "question_statement, options, tokenize='unicode61')"
+    ))
+    indexed = db.session.execute(text(f"SELECT count(*) FROM {FTS_TABLE}")).scalar()
+    total = db.session.execute(text("SELECT count(*) FROM question")).scalar()
+    if indexed != total:
+        rebuild_search_index()
+    db.session.commit()
+
+
+def rebuild_search_index():
+    """
+    Repopulate the FTS table from scratch (SQLite only)
+    """
+    if _dialect() == 'postgresql':
+        return
+    db.session.execute(text(f"DELETE FROM {FTS_TABLE}"))
+    db.session.execute(text(
+        f"INSERT INTO {FTS_TABLE}(rowid, question_statement, options) "
+        "SELECT id, question_statement, "
+        "option_1 || ' ' || option_2 || ' ' || option_3 || ' ' || option_4 "
+        "FROM question"
+    ))
+    logger.info("Question search index rebuilt")
+
+
+def index_questions(questions):
+    """
+    Add or refresh index entries for the given Question objects.
+    Must be called after the questions have ids (i.e. after a flush).
+    """
+    if _dialect() == 'postgresql' or not questions:
+        return
+    params = [{
+        'id': q.id,
+        'statement': q.question_statement,
+        'options': ' '.join([q.option_1, q.option_2, q.option_3, q.option_4]),
+    } for q in questions]
+    db.session.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid = :id"), params)
+    db.session.execute(text(
+        f"INSERT INTO {FTS_TABLE}(rowid, question_statement, options) "
+        "VALUES (:id, :statement, :options)"
+    ), params)
+
+
+def unindex_questions(question_ids):
+    """
+    Drop index entries for the given question ids
+    """
+    if _dialect() == 'postgresql' or not question_ids:
+        return
+    db.session.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid = :id"),
+                       [{'id': question_id} for question_id in question_ids])
+
+
+def _build_match(query):
+    # Quote every token so user input can never be parsed as FTS5 syntax,
+    # and allow prefix matching on the last one (search-as-you-type).
+    tokens = _TOKEN_RE.findall(query)
+    if not tokens:
+        return None
+    quoted = [f'"{t}"' for t in tokens]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def search_questions(query, subject_id=None, chapter_id=None, quiz_id=None, limit=20, offset=0):
+    """
+    Ranked full-text search over question statements and options.
+    Returns a list of dicts, best match first.
+    """
+    filters = []
+    params = {'limit': limit, 'offset': offset}
+    # Raw SQL is not covered by the ORM tenant filter in tenancy.py
+    tenant = current_tenant.get()
+    if tenant is not None:
+        filters.append("q.tenant_id = :tenant_id")
+        params['tenant_id'] = tenant.id
+    if quiz_id:
+        filters.append("q.quiz_id = :quiz_id")
+        params['quiz_id'] = quiz_id
+    if chapter_id:
+        filters.append("z.chapter_id = :chapter_id")
+        params['chapter_id'] = chapter_id
+    if subject_id:
+        filters.append("c.subject_id = :subject_id")
+        params['subject_id'] = subject_id
+    where = ''.join(f" AND {f}" for f in filters)
+
+    if _dialect() == 'postgresql':
+        if not _TOKEN_RE.search(query):
+            return []
+        params['query'] = query
+        sql = (
+            f"SELECT q.id, q.quiz_id, z.chapter_id, c.subject_id, q.question_statement, "
+            f"ts_rank({PG_DOCUMENT}, plainto_tsquery('english', :query)) AS relevance "
+            "FROM question q JOIN quiz z ON z.id = q.quiz_id JOIN chapter c ON c.id = z.chapter_id "
+            f"WHERE {PG_DOCUMENT} @@ plainto_tsquery('english', :query){where} "
+            "ORDER BY relevance DESC LIMIT :limit OFFSET :offset"
+        )
+    else:
+        match = _build_match(query)
+        if not match:
+            return []
+        params['match'] = match
+        # bm25() is lower-is-better; statement hits weigh more than option hits
+        sql = (
+            f"SELECT q.id, q.quiz_id, z.chapter_id, c.subject_id, q.question_statement, "
+            f"-bm25({FTS_TABLE}, 2.0, 1.0) AS relevance "
+            f"FROM {FTS_TABLE} JOIN question q ON q.id = {FTS_TABLE}.rowid "
+            "JOIN quiz z ON z.id = q.quiz_id JOIN chapter c ON c.id = z.chapter_id "
+            f"WHERE {FTS_TABLE} MATCH :match{where} "
+            "ORDER BY relevance DESC LIMIT :limit OFFSET :offset"
+        )
+
+    rows = db.session.execute(text(sql), params).mappings().all()
+    return [dict(row) for row in rows]
@@ -240,3 +240,31 @@ function createPieChart(canvasId, labels, data, colors) {
     
     return chart;
 }
+
+// Fetch a progress series (see /progress/series) after the page has rendered
+// and draw it; long histories arrive already downsampled by the server.
+function loadScoreChart(canvasId, url) {
+    const canvas = document.getElementById(canvasId);
+    if (!canvas) {
+        return;
+    }
+
+    fetch(url, { credentials: 'same-origin', headers: { 'Accept': 'application/json' } })
+        .then(function(response) {
+            if (!response.ok) {
+                throw new Error('HTTP ' + response.status);
+            }
+            return response.json();
+        })
+        .then(function(series) {
+            if (series.data.length === 0) {
+                canvas.insertAdjacentHTML('afterend', '<p class="text-center text-muted my-5">No performance data available yet.</p>');
+                canvas.remove();
+                return;
+            }
+            createScoreChart(canvasId, series.labels, series.data);
+        })
+        .catch(function(error) {
+            console.error('Could not load progress chart:', error);
+        });
+}
@@ -0,0 +1,406 @@
+import os
+import time
+import secrets
+import logging
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+import click
+from flask import abort, current_app, g, request, session
+from flask.cli import AppGroup
+from flask_login import user_logged_in
+from sqlalchemy import create_engine, event, func, select, text
+from sqlalchemy.orm import with_loader_criteria
+from app import db, current_tenant, TenantSession
+from models import Tenant, TenantScoped, Admin
+from deletes import enable_sqlite_foreign_keys
+
+# Institutions (tenants).
+#
+# Every data table carries a tenant_id. While a tenant is active - set per
+# request from the Host header, or explicitly for CLI jobs with tenant_scope()
+# - every ORM query, bulk update and bulk delete is filtered to that tenant
+# and new rows are stamped with it, so route code never has to remember.
+#
+# A tenant lives in the shared database by default, or in its own SQLite file
+# or PostgreSQL schema; TenantSession sends its statements to the engine kept
+# here. Tenants are looked up in the `tenant` table with a short TTL, so ones
+# added from the CLI are picked up by running workers without a restart.
+
+logger = logging.getLogger(__name__)
+
+TenantRef = namedtuple('TenantRef', ['id', 'slug', 'active', 'engine'])  # engine None: shared database
+
+COPY_CHUNK_ROWS = 1000
+
+
+def tenant_tables():
+    """
+    Tables holding tenant data, parents before children
+    """
+    return [table for table in db.metadata.sorted_tables if 'tenant_id' in table.c]
+
+
+def current_tenant_id():
+    tenant = current_tenant.get()
+    return tenant.id if tenant is not None else None
+
+
+class TenantRegistry:
+    """
+    Host -> tenant lookups with a TTL, plus one engine per tenant that has
+    its own database or schema
+    """
+
+    def __init__(self, ttl=30):
+        self.ttl = ttl
+        self._hosts = {}
+        self._engines = {}
+        self._lock = threading.Lock()
+
+    def configure(self, ttl):
+        self.ttl = ttl
+        self.invalidate()
+
+    def invalidate(self):
+        with self._lock:
+            self._hosts.clear()
+
+    def resolve(self, host):
+        """
+        Tenant for a request host; the default tenant for unknown hosts
+        """
+        now = time.monotonic()
+        with self._lock:
+            cached = self._hosts.get(host)
+        if cached and cached[0] > now:
+            return cached[1]
+
+        tenant = (Tenant.query.filter_by(hostname=host).first()
+                  or Tenant.query.filter_by(slug=current_app.config['DEFAULT_TENANT']).first())
+        ref = self.ref(tenant) if tenant else None
+        with self._lock:
+            self._hosts[host] = (now + self.ttl, ref)
+        return ref
+
+    def ref(self, tenant):
+        return TenantRef(tenant.id, tenant.slug, tenant.active, self.engine(tenant))
+
+    def engine(self, tenant):
+        location = (tenant.database_uri, tenant.schema)
+        if location == (None, None):
+            return None
+        with self._lock:
+            cached = self._engines.get(tenant.id)
+            if cached and cached[0] == location:
+                return cached[1]
+            engine = make_engine(*location)
+            self._engines[tenant.id] = (location, engine)
+        if cached:
+            cached[1].dispose()  # the tenant was moved
+        return engine
+
+
+tenant_registry = TenantRegistry()
+
+
+def make_engine(database_uri=None, schema=None):
+    options = dict(current_app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+    if schema:
+        # Same server, but unqualified names (including raw SQL) resolve in the schema
+        options['connect_args'] = {'options': f'-csearch_path={schema}'}
+        return create_engine(current_app.config['SQLALCHEMY_DATABASE_URI'], **options)
+    engine = create_engine(database_uri, **options)
+    enable_sqlite_foreign_keys(engine)
+    return engine
+
+
+def default_location(slug):
+    """
+    (database_uri, schema) for a tenant given its own database: a file under
+    instance/tenants/ on SQLite, a schema on PostgreSQL
+    """
+    if db.engine.dialect.name == 'postgresql':
+        return None, f'tenant_{slug}'
+    os.makedirs(os.path.join(current_app.instance_path, 'tenants'), exist_ok=True)
+    return f"sqlite:///{os.path.join(current_app.instance_path, 'tenants', slug + '.db')}", None
+
+
+@contextmanager
+def tenant_scope(tenant):
+    """
+    Run a block as `tenant` (a TenantRef) outside a request, in a fresh session
+    """
+    db.session.remove()
+    token = current_tenant.set(tenant)
+    try:
+        yield tenant
+    finally:
+        db.session.remove()
+        current_tenant.reset(token)
+
+
+def stream_in_tenant(chunks):
+    """
+    Iterate a streamed response body as the current tenant. Bodies are
+    iterated after _leave_tenant has reset it, when nothing would be filtered.
+    """
+    tenant = current_tenant.get()
+
+    def run():
+        with tenant_scope(tenant):
+            yield from chunks
+    return run()
+
+
+def each_tenant():
+    """
+    Run the body of the loop once per active tenant, for batch jobs. Yields
+    None once on databases without tenants.
+    """
+    tenants = Tenant.query.filter_by(active=True).order_by(Tenant.id).all()
+    if not tenants:
+        yield None
+        return
+    for tenant in tenants:
+        with tenant_scope(tenant_registry.ref(tenant)) as ref:
+            yield ref
+
+
+@event.listens_for(TenantSession, 'do_orm_execute')
+def _scope_statement(execute_state):
+    tenant_id = current_tenant_id()
+    if tenant_id is None or execute_state.execution_options.get('all_tenants'):
+        return
+    if not execute_state.is_orm_statement or execute_state.is_column_load or execute_state.is_relationship_load:
+        return
+    if execute_state.is_select or execute_state.is_update or execute_state.is_delete:
+        execute_state.statement = execute_state.statement.options(
+            with_loader_criteria(TenantScoped, lambda cls: cls.tenant_id == tenant_id, include_aliases=True))
+
+
+@event.listens_for(TenantSession, 'before_flush')
+def _stamp_tenant(db_session, flush_context, instances):
+    tenant_id = current_tenant_id()
+    if tenant_id is None:
+        return
+    for instance in db_session.new:
+        if isinstance(instance, TenantScoped) and instance.tenant_id is None:
+            instance.tenant_id = tenant_id
+
+
+def _bind_session_to_tenant(sender, user, **extra):
+    session['tenant_id'] = current_tenant_id()
+
+
+def session_matches_tenant():
+    """
+    A login cookie is only good for the tenant it was issued by
+    """
+    tenant_id = current_tenant_id()
+    return tenant_id is None or session.get('tenant_id') == tenant_id
+
+
+def init_tenancy(app):
+    tenant_registry.configure(app.config['TENANT_CACHE_TTL'])
+    user_logged_in.connect(_bind_session_to_tenant)
+    app.cli.add_command(tenant_cli)
+
+    @app.before_request
+    def _enter_tenant():
+        tenant = tenant_registry.resolve(request.host.partition(':')[0].lower())
+        if tenant is not None and not tenant.active:
+            abort(503, description='This institution is being maintained. Please try again shortly.')
+        g.tenant = tenant
+        current_tenant.set(tenant)
+
+    @app.teardown_request
+    def _leave_tenant(exc):
+        current_tenant.set(None)
+
+
+def ensure_default_tenant():
+    """
+    Create the default tenant if missing and give it every row that has no
+    tenant yet (data from before tenants existed)
+    """
+    slug = current_app.config['DEFAULT_TENANT']
+    tenant = Tenant.query.filter_by(slug=slug).first()
+    if tenant is None:
+        tenant = Tenant(slug=slug, name=slug.title())
+        db.session.add(tenant)
+        db.session.commit()
+
+    if tenant.database_uri is None and tenant.schema is None:
+        for table in tenant_tables():
+            db.session.execute(table.update().where(table.c.tenant_id.is_(None)).values(tenant_id=tenant.id))
+        db.session.commit()
+    return tenant
+
+
+def provision(engine, schema=None):
+    """
+    Create the tenant tables in a tenant's own database or schema
+    """
+    if schema:
+        with db.engine.begin() as conn:
+            conn.execute(text(f'CREATE SCHEMA IF NOT EXISTS "{schema}"'))
+    db.metadata.create_all(bind=engine, tables=tenant_tables())
+
+
+def seed_admin(password=None):
+    """
+    Create the tenant's admin account if it has none, with `password` or a
+    random one. Returns the generated password, for the caller to show once.
+    """
+    from auth import hash_password
+
+    if Admin.query.filter_by(username='admin').first():
+        return None
+    generated = None if password else secrets.token_urlsafe(12)
+    db.session.add(Admin(username='admin', password=hash_password(password or generated)))
+    db.session.commit()
+    logger.info("Admin account created")
+    return generated
+
+
+def _copy_tenant_rows(tenant_id, source, target, progress=None):
+    with source.connect() as src, target.begin() as dst:
+        for table in tenant_tables():
+            where = table.c.tenant_id == tenant_id
+            if dst.execute(select(func.count()).select_from(table).where(where)).scalar():
+                raise ValueError(f'Target already holds {table.name} rows of this tenant')
+
+            result = src.execution_options(stream_results=True, yield_per=COPY_CHUNK_ROWS).execute(
+                select(table).where(where))
+            copied = 0
+            for partition in result.mappings().partitions():
+                dst.execute(table.insert(), [dict(row) for row in partition])
+                copied += len(partition)
+
+            if dst.dialect.name == 'postgresql' and list(table.primary_key.columns.keys()) == ['id']:
+                # Explicit ids were inserted; move the sequence past them
+                dst.execute(text(f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+                                 f"coalesce(max(id), 0) + 1, false) FROM {table.name}"))
+            if progress:
+                progress(table.name, copied)
+
+
+def _delete_tenant_rows(tenant_id, engine):
+    from search import FTS_TABLE
+
+    with engine.begin() as conn:
+        if conn.dialect.name == 'sqlite':
+            conn.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid IN "
+                              "(SELECT id FROM question WHERE tenant_id = :tenant_id)"), {'tenant_id': tenant_id})
+        for table in reversed(tenant_tables()):
+            conn.execute(table.delete().where(table.c.tenant_id == tenant_id))
+
+
+def move_tenant(tenant, database_uri=None, schema=None, keep_source=False, wait=0, progress=None):
+    """
+    Offline rebalance: take the tenant out of service, copy its rows to a
+    new database or schema, switch the registry over and bring it back.
+    """
+    from search import ensure_search_index
+
+    source = tenant_registry.engine(tenant) or db.engine
+    target = make_engine(database_uri, schema)
+
+    tenant.active = False
+    db.session.commit()
+    # Workers notice within one registry TTL and start answering 503
+    time.sleep(wait)
+
+    try:
+        provision(target, schema)
+        _copy_tenant_rows(tenant.id, source, target, progress)
+        with tenant_scope(TenantRef(tenant.id, tenant.slug, False, target)):
+            ensure_search_index()
+    except Exception:
+        target.dispose()
+        tenant = db.session.merge(tenant)
+        tenant.active = True
+        db.session.commit()
+        raise
+
+    tenant = db.session.merge(tenant)
+    tenant.database_uri, tenant.schema, tenant.active = database_uri, schema, True
+    db.session.commit()
+    tenant_registry.invalidate()
+    target.dispose()
+
+    if not keep_source:
+        _delete_tenant_rows(tenant.id, source)
+    return tenant
+
+
+tenant_cli = AppGroup('tenant', help='Manage institutions (tenants).')
+
+
+@tenant_cli.command('list')
+def list_tenants_command():
+    for tenant in Tenant.query.order_by(Tenant.id):
+        location = tenant.database_uri or (f'schema {tenant.schema}' if tenant.schema else 'shared database')
+        status = '' if tenant.active else ' [maintenance]'
+        print(f"{tenant.slug}\t{tenant.hostname or '-'}\t{location}{status}")
+
+
+@tenant_cli.command('add')
+@click.argument('slug')
+@click.option('--name', help='Display name (default: the slug)')
+@click.option('--host', help='Host name requests for this tenant arrive on')
+@click.option('--own-database', is_flag=True, help='Give the tenant its own SQLite file or PostgreSQL schema')
+@click.option('--database-uri', help='Put the tenant in this database')
+@click.option('--admin-password', help='Password for the admin account (default: a random one, printed once)')
+def add_tenant_command(slug, name, host, own_database, database_uri, admin_password):
+    """Create a tenant with its admin account; running workers pick it up without a restart."""
+    if Tenant.query.filter_by(slug=slug).first():
+        raise click.ClickException(f'Tenant {slug} already exists')
+    schema = None
+    if own_database and not database_uri:
+        database_uri, schema = default_location(slug)
+
+    tenant = Tenant(slug=slug, name=name or slug.title(), hostname=host and host.lower(),
+                    database_uri=database_uri, schema=schema)
+    db.session.add(tenant)
+    db.session.commit()
+
+    ref = tenant_registry.ref(tenant)
+    if ref.engine is not None:
+        provision(ref.engine, schema)
+    with tenant_scope(ref):
+        from search import ensure_search_index
+        ensure_search_index()
+        generated = seed_admin(admin_password)
+    print(f"Tenant {slug} created.")
+    if generated:
+        print(f"Admin account: admin / {generated}")
+
+
+@tenant_cli.command('move')
+@click.argument('slug')
+@click.option('--own-database', is_flag=True, help='Move to the default file or schema for this tenant')
+@click.option('--database-uri', help='Move to this database')
+@click.option('--schema', help='Move to this PostgreSQL schema of the shared server')
+@click.option('--keep-source', is_flag=True, help='Leave the copied rows in the old location')
+def move_tenant_command(slug, own_database, database_uri, schema, keep_source):
+    """Move a tenant's data to its own database or schema, offline."""
+    tenant = Tenant.query.filter_by(slug=slug).first()
+    if tenant is None:
+        raise click.ClickException(f'No tenant {slug}')
+    if own_database:
+        database_uri, schema = default_location(slug)
+    if not database_uri and not schema:
+        raise click.ClickException('Give --own-database, --database-uri or --schema')
+    if (database_uri, schema) == (tenant.database_uri, tenant.schema):
+        raise click.ClickException(f'Tenant {slug} is already there')
+
+    from backup import take_snapshots
+    for manifest in take_snapshots(label=f'pre-move-{slug}'):
+        print(f"Snapshot {manifest['id']} of {manifest['database']} taken")
+
+    print(f"Taking {slug} offline for {tenant_registry.ttl}s before copying...")
+    move_tenant(tenant, database_uri, schema, keep_source=keep_source, wait=tenant_registry.ttl,
+                progress=lambda table, n: print(f"Copied {n} rows of {table}"))
+    print(f"Tenant {slug} moved.")
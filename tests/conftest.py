@@ -0,0 +1,102 @@
+import datetime
+from contextlib import contextmanager
+import pytest
+from app import create_app, init_db, db
+from auth import hash_password
+from models import Tenant, User, Subject, Chapter, Quiz, Question
+from tenancy import tenant_registry, tenant_scope
+import papers
+
+ADMIN_PASSWORD = 'admin-secret'
+
+
+@pytest.fixture
+def make_app(tmp_path):
+    """
+    make_app(**config): an app on a fresh SQLite database, initialised and
+    with its context pushed
+    """
+    @contextmanager
+    def make(**config):
+        app = create_app({
+            'TESTING': True,
+            'WTF_CSRF_ENABLED': False,
+            'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'quizmaster.db'}",
+            'BACKUP_DIR': str(tmp_path / 'backups'),
+            'UPLOAD_FOLDER': str(tmp_path / 'uploads'),
+            'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1000',
+            **config,
+        })
+        # Process-wide caches are keyed by ids every fresh database reuses
+        papers._pool_cache.clear()
+        with app.app_context():
+            init_db(ADMIN_PASSWORD)
+            try:
+                yield app
+            finally:
+                db.session.remove()
+                db.engine.dispose()
+    return make
+
+
+@pytest.fixture
+def app(make_app):
+    with make_app() as app:
+        yield app
+
+
+def default_tenant():
+    return tenant_registry.ref(Tenant.query.filter_by(slug='default').one())
+
+
+@pytest.fixture
+def tenant(app):
+    """
+    Run the test as the default tenant, as a request would
+    """
+    with tenant_scope(default_tenant()) as ref:
+        yield ref
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def add_tenant(app, slug, *options):
+    """
+    Create a tenant through `flask tenant add`; returns its TenantRef
+    """
+    result = app.test_cli_runner().invoke(args=['tenant', 'add', slug, '--admin-password', ADMIN_PASSWORD,
+                                                *options])
+    assert result.exit_code == 0, result.output
+    return tenant_registry.ref(Tenant.query.filter_by(slug=slug).one())
+
+
+def add_user(email='student@example.com', password='secret123', full_name='Student'):
+    user = User(email=email, password=hash_password(password), full_name=full_name,
+                qualification='BSc', dob=datetime.date(2000, 1, 1))
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def add_quiz(questions=10, duration=10):
+    """
+    A quiz with `questions` questions whose correct option cycles 1..4
+    """
+    subject = Subject(name='Maths', description='Numbers')
+    db.session.add(subject)
+    db.session.flush()
+    chapter = Chapter(subject_id=subject.id, name='Algebra', description='Letters')
+    db.session.add(chapter)
+    db.session.flush()
+    quiz = Quiz(chapter_id=chapter.id, date_of_quiz=datetime.datetime(2024, 1, 1), time_duration=duration)
+    db.session.add(quiz)
+    db.session.flush()
+    for i in range(questions):
+        db.session.add(Question(quiz_id=quiz.id, question_statement=f'Question {i}?',
+                                option_1=f'{i}-a', option_2=f'{i}-b', option_3=f'{i}-c', option_4=f'{i}-d',
+                                correct_option=i % 4 + 1))
+    db.session.commit()
+    return quiz
@@ -0,0 +1,132 @@
+import datetime
+from app import db
+from models import Score, AttemptAnswer, ScoreArchiveBatch, ScoreArchiveQuiz, UserScoreSummary, UserChapterSummary
+import archive
+from archive import archive_scores, user_statistics, load_archived_scores, purge_quiz_archive, index_archive_batches
+from deletes import delete_quiz_cascade
+from conftest import add_user, add_quiz
+
+
+def _score(user, quiz, total, days_ago):
+    db.session.add(Score(quiz_id=quiz.id, user_id=user.id, total_scored=total,
+                         time_stamp_of_attempt=datetime.datetime.utcnow() - datetime.timedelta(days=days_ago)))
+    db.session.commit()
+
+
+def test_archiving_keeps_statistics_and_attempts(tenant):
+    user, quiz = add_user(), add_quiz(questions=1)
+    for total, days_ago in ((40, 500), (80, 400), (60, 1)):
+        _score(user, quiz, total, days_ago)
+    hot = Score.query.filter_by(user_id=user.id).all()
+    before = user_statistics(user.id, hot)
+
+    assert archive_scores(365) == 2
+    hot = Score.query.filter_by(user_id=user.id).all()
+    after = user_statistics(user.id, hot)
+    assert after['archived_attempts'] == 2
+    del before['archived_attempts'], after['archived_attempts']
+    assert after == before
+    assert [a.total_scored for a in load_archived_scores(user.id)] == [80, 40]
+
+
+def test_deleting_a_quiz_purges_its_archived_attempts(tenant):
+    user = add_user()
+    kept_quiz, deleted_quiz = add_quiz(questions=1), add_quiz(questions=1)
+    _score(user, kept_quiz, 50, 500)
+    _score(user, deleted_quiz, 100, 450)
+    _score(user, deleted_quiz, 10, 400)
+    archive_scores(365)
+
+    assert delete_quiz_cascade(deleted_quiz)['archived'] == 2
+    stats = user_statistics(user.id, [])
+    archived = load_archived_scores(user.id)
+    assert [a.total_scored for a in archived] == [50]
+    assert (stats['total_quizzes'], stats['avg_score'], stats['highest_score'], stats['lowest_score']) == (1, 50, 50, 50)
+    batch = ScoreArchiveBatch.query.one()
+    assert batch.attempts == 1
+
+
+def test_purging_a_users_only_quiz_drops_batch_and_summary(tenant):
+    user, quiz = add_user(), add_quiz(questions=1)
+    _score(user, quiz, 70, 400)
+    archive_scores(365)
+    assert purge_quiz_archive(quiz.id) == 1
+    assert ScoreArchiveBatch.query.count() == 0
+    assert db.session.get(UserScoreSummary, user.id) is None
+    assert user_statistics(user.id, [])['total_quizzes'] == 0
+
+
+def test_purge_only_opens_batches_holding_the_quiz(tenant, monkeypatch):
+    kept_quiz, deleted_quiz = add_quiz(questions=1), add_quiz(questions=1)
+    for n in range(4):
+        user = add_user(f'kept{n}@example.com')
+        _score(user, kept_quiz, 50, 500)
+    other = add_user('both@example.com')
+    _score(other, kept_quiz, 40, 500)
+    _score(other, kept_quiz, 80, 500)
+    _score(other, deleted_quiz, 60, 450)  # neither highest, lowest nor first, so no rebuild
+    archive_scores(365)
+    assert ScoreArchiveBatch.query.count() == 5
+
+    opened = []
+    unpack = archive._unpack
+    monkeypatch.setattr(archive, '_unpack', lambda blob: opened.append(blob) or unpack(blob))
+    assert purge_quiz_archive(deleted_quiz.id) == 1
+    assert len(opened) == 1
+    assert ScoreArchiveQuiz.query.filter_by(quiz_id=deleted_quiz.id).count() == 0
+    assert sorted(a.total_scored for a in load_archived_scores(other.id)) == [40, 80]
+
+
+def test_purge_rebuilds_a_summary_only_when_it_held_an_extreme(tenant, monkeypatch):
+    user = add_user()
+    kept_quiz, middling_quiz = add_quiz(questions=1), add_quiz(questions=1)
+    for total, days_ago in ((10, 600), (90, 500)):
+        _score(user, kept_quiz, total, days_ago)
+    _score(user, middling_quiz, 50, 400)
+    archive_scores(365)
+
+    rebuilt = []
+    monkeypatch.setattr(archive, '_rebuild_summary', rebuilt.append)
+    purge_quiz_archive(middling_quiz.id)
+    assert rebuilt == []
+    stats = user_statistics(user.id, [])
+    assert ((stats['total_quizzes'], stats['avg_score'], stats['highest_score'], stats['lowest_score'])
+            == (2, 50, 90, 10))
+
+
+def test_purge_takes_the_quiz_out_of_the_chapter_summary(tenant):
+    user = add_user()
+    kept_quiz, deleted_quiz = add_quiz(questions=1), add_quiz(questions=2)
+    _score(user, kept_quiz, 40, 500)
+    _score(user, deleted_quiz, 50, 400)
+    score = Score.query.filter_by(quiz_id=deleted_quiz.id).one()
+    for question, correct in zip(deleted_quiz.questions, (True, False)):
+        db.session.add(AttemptAnswer(score_id=score.id, question_id=question.id, chosen_option=1,
+                                     is_correct=correct))
+    db.session.commit()
+    archive_scores(365)
+    summary = db.session.get(UserChapterSummary, (user.id, deleted_quiz.chapter_id))
+    assert (summary.attempts, summary.answered, summary.correct) == (1, 2, 1)
+
+    delete_quiz_cascade(deleted_quiz)
+    assert db.session.get(UserChapterSummary, (user.id, deleted_quiz.chapter_id)) is None
+    assert db.session.get(UserChapterSummary, (user.id, kept_quiz.chapter_id)).attempts == 1
+
+
+def test_batches_archived_before_the_index_can_be_purged(tenant):
+    user = add_user()
+    kept_quiz, deleted_quiz = add_quiz(questions=1), add_quiz(questions=1)
+    _score(user, kept_quiz, 40, 500)
+    _score(user, deleted_quiz, 80, 400)
+    archive_scores(365)
+    ScoreArchiveQuiz.query.delete()
+    db.session.commit()
+
+    assert index_archive_batches() == 1
+    share = ScoreArchiveQuiz.query.filter_by(quiz_id=deleted_quiz.id).one()
+    assert (share.attempts, share.total_scored, share.in_chapter_summary) == (1, 80, False)
+    chapter_attempts = db.session.get(UserChapterSummary, (user.id, deleted_quiz.chapter_id)).attempts
+    assert purge_quiz_archive(deleted_quiz.id) == 1
+    assert user_statistics(user.id, [])['total_quizzes'] == 1
+    # Left alone: the chapter summary may not have counted these attempts
+    assert db.session.get(UserChapterSummary, (user.id, deleted_quiz.chapter_id)).attempts == chapter_attempts
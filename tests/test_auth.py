@@ -0,0 +1,148 @@
+import threading
+import itertools
+import pytest
+from werkzeug.security import generate_password_hash, check_password_hash
+import auth
+from app import db
+from auth import TokenBucketLimiter, LoginThrottled, check_login_allowed, login_succeeded, verify_password
+from conftest import add_user
+
+_addresses = (f'10.0.0.{n}' for n in itertools.count(1))
+
+
+def login(client, email, password, addr=None, **headers):
+    return client.post('/login', data={'email': email, 'password': password},
+                       environ_overrides={'REMOTE_ADDR': addr or next(_addresses)}, headers=headers)
+
+
+def test_token_bucket_refills(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(auth.time, 'monotonic', lambda: now[0])
+    limiter = TokenBucketLimiter(capacity=2, refill_per_second=1)
+    assert limiter.consume('k') and limiter.consume('k')
+    assert not limiter.consume('k')
+    now[0] += 1
+    assert limiter.consume('k')
+    assert not limiter.consume('k')
+    limiter.reset('k')
+    assert limiter.consume('k')
+
+
+def test_token_bucket_is_bounded():
+    limiter = TokenBucketLimiter(capacity=1, refill_per_second=0, max_keys=2)
+    for key in 'abc':
+        limiter.consume(key)
+    assert limiter.consume('a')  # evicted, so it starts full again
+
+
+def test_account_throttled_until_success(app):
+    for _ in range(app.config['LOGIN_ACCOUNT_BURST']):
+        check_login_allowed('10.1.0.1', 'throttled@example.com')
+    with pytest.raises(LoginThrottled):
+        check_login_allowed('10.1.0.2', 'throttled@example.com')
+    login_succeeded('Throttled@example.com')
+    check_login_allowed('10.1.0.3', 'throttled@example.com')
+
+
+def test_successful_login_refills_account_bucket(client, tenant):
+    add_user('refill@example.com', 'right-password')
+    for _ in range(4):
+        assert b'Invalid email or password' in login(client, 'refill@example.com', 'wrong').data
+    assert login(client, 'refill@example.com', 'right-password').status_code == 302
+    client.get('/logout')
+    for _ in range(4):
+        assert b'Too many login attempts' not in login(client, 'refill@example.com', 'wrong').data
+
+
+def test_forwarded_clients_have_their_own_ip_bucket(make_app):
+    with make_app(TRUSTED_PROXY_HOPS=1) as app:
+        client = app.test_client()
+        burst = app.config['LOGIN_IP_BURST']
+        for n in range(burst):
+            login(client, f'a{n}@example.com', 'x', addr='10.2.0.1', **{'X-Forwarded-For': '198.51.100.1'})
+        response = login(client, 'b@example.com', 'x', addr='10.2.0.1', **{'X-Forwarded-For': '198.51.100.1'})
+        assert b'from your address' in response.data
+        response = login(client, 'c@example.com', 'x', addr='10.2.0.1', **{'X-Forwarded-For': '198.51.100.2'})
+        assert b'from your address' not in response.data
+
+
+@pytest.fixture
+def slow_hash(monkeypatch):
+    release = threading.Event()
+    original = auth._timed_check
+
+    def slow(pwhash, password):
+        release.wait(5)
+        return original(pwhash, password)
+    monkeypatch.setattr(auth, '_timed_check', slow)
+    yield release
+    release.set()
+
+
+def test_hash_timeout_is_throttled_and_keeps_its_slot(app, tenant, slow_hash):
+    user = add_user('slow@example.com', 'pw')
+    app.config['AUTH_HASH_TIMEOUT'] = 0.05
+    free = auth._queue_slots._value
+    with pytest.raises(LoginThrottled):
+        verify_password(user, 'pw')
+    assert auth._queue_slots._value == free - 1  # still hashing
+    slow_hash.set()
+    auth._executor.submit(lambda: None).result()
+    for _ in range(50):
+        if auth._queue_slots._value == free:
+            break
+        threading.Event().wait(0.01)
+    assert auth._queue_slots._value == free
+
+
+def test_hash_timeout_flashes_instead_of_500(app, client, tenant, slow_hash):
+    add_user('slow-route@example.com', 'pw')
+    app.config['AUTH_HASH_TIMEOUT'] = 0.05
+    response = login(client, 'slow-route@example.com', 'pw')
+    assert response.status_code == 200
+    assert b'The server is busy' in response.data
+
+
+def test_full_queue_refuses(app, tenant, slow_hash):
+    user = add_user('queue@example.com', 'pw')
+    app.config['AUTH_HASH_TIMEOUT'] = 0.01
+    for _ in range(auth._queue_slots._value):
+        with pytest.raises(LoginThrottled):
+            verify_password(user, 'pw')
+    assert auth._queue_slots._value == 0
+    with pytest.raises(LoginThrottled, match='busy'):
+        verify_password(user, 'pw')
+
+
+def test_outdated_hash_is_upgraded_in_the_pool(app, tenant, monkeypatch):
+    user = add_user('legacy@example.com', 'pw')
+    user.password = generate_password_hash('pw', method='pbkdf2:sha256:500')
+    db.session.commit()
+    threads = []
+    original = auth.generate_password_hash
+    monkeypatch.setattr(auth, 'generate_password_hash',
+                        lambda password, *args, **kwargs: threads.append((password, threading.current_thread().name))
+                        or original(password, *args, **kwargs))
+
+    assert verify_password(user, 'pw')
+    # '' is needs_rehash learning the configured method's prefix
+    assert [name.split('_')[0] for password, name in threads if password == 'pw'] == ['password-hash']
+    assert user.password.startswith('pbkdf2:sha256:1000$')
+    assert check_password_hash(user.password, 'pw')
+
+
+def test_login_succeeds_when_the_upgrade_cannot_be_queued(app, tenant, monkeypatch):
+    user = add_user('legacy-busy@example.com', 'pw')
+    legacy = generate_password_hash('pw', method='pbkdf2:sha256:500')
+    user.password = legacy
+    db.session.commit()
+    run_hash = auth._run_hash
+
+    def busy_after_check(fn, *args):
+        if fn is auth.generate_password_hash:
+            raise LoginThrottled('busy')
+        return run_hash(fn, *args)
+    monkeypatch.setattr(auth, '_run_hash', busy_after_check)
+
+    assert verify_password(user, 'pw')
+    assert user.password == legacy
@@ -0,0 +1,120 @@
+import os
+import json
+import sqlite3
+import pytest
+import backup
+from app import db
+from models import Subject
+from backup import (MAIN_DATABASE, take_snapshot, list_snapshots, verify_snapshot, restore_snapshot,
+                    load_snapshot)
+
+
+def _path():
+    return db.engine.url.database
+
+
+def _snapshot(app, **kwargs):
+    return take_snapshot(MAIN_DATABASE, db.engine.url, **kwargs)
+
+
+def _subjects():
+    conn = sqlite3.connect(_path())
+    try:
+        return [row[0] for row in conn.execute('SELECT name FROM subject ORDER BY id')]
+    finally:
+        conn.close()
+
+
+def _add_subject(tenant, name):
+    db.session.add(Subject(name=name, description='d'))
+    db.session.commit()
+
+
+def test_snapshot_and_restore_round_trip(app, tenant):
+    _add_subject(tenant, 'Kept')
+    manifest = _snapshot(app)
+    _add_subject(tenant, 'Added later')
+    db.session.remove()
+
+    restore_snapshot(MAIN_DATABASE, manifest)
+    assert _subjects() == ['Kept']
+    labels = [m['label'] for m in list_snapshots(MAIN_DATABASE)]
+    assert labels == [None, 'pre-restore']
+
+
+def test_snapshots_are_incremental(app, tenant):
+    first = _snapshot(app)
+    second = _snapshot(app)
+    assert first['new_blocks'] > 0 and second['new_blocks'] == 0
+    assert first['blocks'] == second['blocks']
+
+
+def test_corrupt_block_fails_verification(app, tenant):
+    manifest = _snapshot(app)
+    key = manifest['blocks'][0]
+    path = os.path.join(app.config['BACKUP_DIR'], MAIN_DATABASE, 'blocks', key[:2], key)
+    with open(path, 'wb') as f:
+        f.write(b'not zlib')
+    with pytest.raises(RuntimeError, match='corrupt'):
+        verify_snapshot(MAIN_DATABASE, manifest)
+    before = os.path.getmtime(_path())
+    with pytest.raises(RuntimeError):
+        restore_snapshot(MAIN_DATABASE, manifest)
+    assert os.path.getmtime(_path()) == before
+
+
+def test_image_checksum_is_checked(app, tenant):
+    manifest = _snapshot(app)
+    manifest['sha256'] = '0' * 64
+    with pytest.raises(RuntimeError, match='checksum'):
+        verify_snapshot(MAIN_DATABASE, manifest)
+
+
+def test_rotation_keeps_newest_and_pre_restore(app, tenant):
+    first = _snapshot(app, keep=0)
+    restore_snapshot(MAIN_DATABASE, first)
+    for n in range(4):
+        _add_subject(tenant, f'S{n}')
+        _snapshot(app, keep=2)
+    snapshots = list_snapshots(MAIN_DATABASE)
+    assert [m['label'] for m in snapshots].count('pre-restore') == 1
+    assert len([m for m in snapshots if m['label'] is None]) == 2
+    for manifest in snapshots:
+        verify_snapshot(MAIN_DATABASE, manifest)
+    # Runs of rotated-out snapshots are gone
+    store = os.path.join(app.config['BACKUP_DIR'], MAIN_DATABASE, 'blocks')
+    stored = {key for prefix in os.listdir(store) for key in os.listdir(os.path.join(store, prefix))}
+    assert stored == {key for m in snapshots for key in m['blocks']}
+
+
+def test_copy_restarted_by_writes_finishes_in_one_step(app, tenant, monkeypatch, tmp_path):
+    monkeypatch.setattr(backup, 'BACKUP_MAX_RESTARTS', 0)
+    calls = []
+
+    class Source:
+        def __init__(self, conn):
+            self.conn = conn
+
+        def backup(self, target, pages=-1, progress=None, sleep=0):
+            calls.append(pages)
+            if progress is not None:
+                progress(0, 5, 10)
+                progress(0, 8, 10)  # copied fewer pages than before: restarted
+            self.conn.backup(target)
+
+        def close(self):
+            self.conn.close()
+
+    connect = sqlite3.connect
+    monkeypatch.setattr(backup.sqlite3, 'connect',
+                        lambda path, **kw: Source(connect(path, **kw)) if path == _path() else connect(path, **kw))
+    backup._online_copy(_path(), str(tmp_path / 'copy.db'))
+    assert calls == [backup.BACKUP_STEP_PAGES, -1]
+
+
+def test_latest_snapshot_is_default(app, tenant):
+    _snapshot(app, label='a')
+    latest = _snapshot(app, label='b')
+    assert load_snapshot(MAIN_DATABASE)['id'] == latest['id']
+    with open(os.path.join(app.config['BACKUP_DIR'], MAIN_DATABASE, 'manifests', f"{latest['id']}.json")) as f:
+        assert json.load(f)['label'] == 'b'
@@ -0,0 +1,86 @@
+import numpy as np
+from sqlalchemy import event
+from app import db
+from models import Question, QuestionSignature, QuestionLSHBucket
+from dedup import ImportDeduplicator, compute_signature, find_near_duplicates, index_question_signatures
+import cluster_questions
+from conftest import add_quiz
+
+STATEMENT = 'Which of the following numbers is the smallest prime greater than ten?'
+OPTIONS = ['11', '13', '17', '19']
+
+
+def test_near_duplicates_are_found_through_the_index(tenant):
+    quiz = add_quiz(questions=0)
+    question = Question(quiz_id=quiz.id, question_statement=STATEMENT, option_1='11', option_2='13',
+                        option_3='17', option_4='19', correct_option=1)
+    db.session.add(question)
+    db.session.flush()
+    index_question_signatures([question])
+    db.session.commit()
+
+    matches = find_near_duplicates(compute_signature(STATEMENT.replace('numbers', 'number'), OPTIONS))
+    assert [question_id for question_id, _ in matches] == [question.id]
+    assert find_near_duplicates(compute_signature('Name the capital city of France.', ['Paris', 'Rome', 'Oslo',
+                                                                                        'Bern'])) == []
+
+
+def test_import_batch_rows_are_checked_against_each_other(tenant):
+    dedup = ImportDeduplicator()
+    signature, match = dedup.check(STATEMENT, OPTIONS)
+    assert match is None
+    dedup.add(2, signature)
+    _, match = dedup.check(STATEMENT + ' ', OPTIONS)
+    assert match['row'] == 2 and match['similarity'] == 1.0
+
+
+def test_prefetched_batch_is_checked_in_one_query(tenant):
+    quiz = add_quiz(questions=0)
+    question = Question(quiz_id=quiz.id, question_statement=STATEMENT, option_1='11', option_2='13',
+                        option_3='17', option_4='19', correct_option=1)
+    db.session.add(question)
+    db.session.flush()
+    index_question_signatures([question])
+    db.session.commit()
+    rows = [(f'Unrelated question number {n} about colours and shapes?', ['a', 'b', 'c', 'd']) for n in range(30)]
+    rows.append((STATEMENT.replace('numbers', 'number'), OPTIONS))
+
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        dedup = ImportDeduplicator()
+        dedup.prefetch(rows)
+        matches = [dedup.check(statement, options)[1] for statement, options in rows]
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+    assert len(statements) == 1
+    assert matches[:-1] == [None] * 30
+    assert matches[-1]['question_id'] == question.id
+
+
+def test_clusters_join_members_that_only_match_each_other(tenant, monkeypatch):
+    first, second, third = sorted(add_quiz(questions=3).questions, key=lambda q: q.id)
+    for question in (first, second, third):
+        db.session.add(QuestionSignature(question_id=question.id,
+                                         minhash=np.full(64, question.id, dtype=np.uint32).tobytes()))
+        db.session.add(QuestionLSHBucket(question_id=question.id, band=0, bucket=42))
+    db.session.commit()
+    # The bucket's first member resembles neither of the others
+    similar = {frozenset((second.id, third.id))}
+    monkeypatch.setattr(cluster_questions, 'similarity',
+                        lambda a, b: 1.0 if frozenset((int(a[0]), int(b[0]))) in similar else 0.0)
+
+    assert cluster_questions.cluster_questions() == [[second.id, third.id]]
+
+
+def test_clusters_of_real_duplicates(tenant):
+    quiz = add_quiz(questions=0)
+    questions = [Question(quiz_id=quiz.id, question_statement=statement, option_1='11', option_2='13',
+                          option_3='17', option_4='19', correct_option=1)
+                 for statement in (STATEMENT, STATEMENT.replace('numbers', 'number'), 'Name a colour.')]
+    db.session.add_all(questions)
+    db.session.flush()
+    index_question_signatures(questions)
+    db.session.commit()
+    assert cluster_questions.cluster_questions() == [[questions[0].id, questions[1].id]]
@@ -0,0 +1,109 @@
+import sqlite3
+from sqlalchemy import create_engine, event, inspect, Text
+from app import db
+from models import Quiz, Question, Score, AttemptAnswer
+import deletes
+from deletes import delete_quiz_cascade, delete_user_cascade, delete_in_chunks
+from conftest import add_user, add_quiz
+
+
+def _foreign_keys(engine):
+    with engine.connect() as conn:
+        return conn.exec_driver_sql('PRAGMA foreign_keys').scalar()
+
+
+def test_foreign_keys_only_on_app_engines(app, tmp_path):
+    assert _foreign_keys(db.engine) == 1
+    other = create_engine(f"sqlite:///{tmp_path / 'other.db'}")
+    assert _foreign_keys(other) == 0
+
+
+def _attempt(quiz, user):
+    score = Score(quiz_id=quiz.id, user_id=user.id, total_scored=50)
+    db.session.add(score)
+    db.session.flush()
+    for question in Question.query.filter_by(quiz_id=quiz.id):
+        db.session.add(AttemptAnswer(score_id=score.id, question_id=question.id, chosen_option=1,
+                                     is_correct=question.correct_option == 1))
+    db.session.commit()
+    return score
+
+
+def test_delete_quiz_cascade(tenant):
+    quiz, kept = add_quiz(questions=5), add_quiz(questions=2)
+    user = add_user()
+    _attempt(quiz, user)
+    _attempt(kept, user)
+    assert delete_quiz_cascade(quiz) == {'questions': 5, 'scores': 1, 'archived': 0}
+    assert Quiz.query.count() == 1
+    assert Question.query.count() == 2
+    assert AttemptAnswer.query.count() == 2
+
+
+def test_delete_in_chunks_commits_every_chunk(tenant):
+    quiz = add_quiz(questions=7)
+    seen = []
+    assert delete_in_chunks(Question, Question.quiz_id == quiz.id, chunk_size=3, progress=seen.append) == 7
+    assert seen == [3, 6, 7]
+
+
+def test_attempt_answers_go_with_each_chunk_of_scores(tenant, monkeypatch):
+    quizzes = [add_quiz(questions=2) for _ in range(3)]
+    user, other = add_user(), add_user('other@example.com')
+    for quiz in quizzes:
+        _attempt(quiz, user)
+    _attempt(quizzes[0], other)
+    chunked = deletes.delete_in_chunks
+    monkeypatch.setattr(deletes, 'delete_in_chunks',
+                        lambda *args, **kwargs: chunked(*args, **{**kwargs, 'chunk_size': 2}))
+
+    statements = []
+    listener = lambda *args: statements.append(args[2].split()[:3])
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        assert delete_user_cascade(user) == {'scores': 3}
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+    deleted = [table for verb, _, table in statements if verb == 'DELETE' and table in ('attempt_answer', 'score')]
+    assert deleted == ['attempt_answer', 'score', 'attempt_answer', 'score']
+    assert AttemptAnswer.query.count() == 2
+
+
+def _make_legacy_question_table(path):
+    # The question table as it was before its text columns became TEXT
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        PRAGMA foreign_keys=OFF;
+        CREATE TABLE question_old (
+            id INTEGER PRIMARY KEY, quiz_id INTEGER NOT NULL, question_statement VARCHAR(500) NOT NULL,
+            question_image VARCHAR(255), option_1 VARCHAR(200) NOT NULL, option_2 VARCHAR(200) NOT NULL,
+            option_3 VARCHAR(200) NOT NULL, option_4 VARCHAR(200) NOT NULL, correct_option INTEGER NOT NULL,
+            tenant_id INTEGER, FOREIGN KEY(quiz_id) REFERENCES quiz(id));
+        INSERT INTO question_old SELECT id, quiz_id, question_statement, question_image, option_1, option_2,
+            option_3, option_4, correct_option, tenant_id FROM question;
+        DROP TABLE question;
+        ALTER TABLE question_old RENAME TO question;
+    """)
+    conn.close()
+
+
+def test_migration_rebuild_keeps_answers_and_scores(app, tenant, monkeypatch):
+    import migrate_db
+
+    quiz, user = add_quiz(questions=3), add_user()
+    _attempt(quiz, user)
+    db.session.remove()
+    db.engine.dispose()
+    _make_legacy_question_table(db.engine.url.database)
+    assert migrate_db.question_needs_migration(db.engine)
+
+    monkeypatch.setattr(migrate_db, 'app', app)
+    assert migrate_db.migrate_database()
+    assert migrate_db.add_missing_indexes()
+    assert not migrate_db.question_needs_migration(db.engine)
+    columns = {c['name']: c['type'] for c in inspect(db.engine).get_columns('question')}
+    assert isinstance(columns['option_1'], Text)
+    assert Question.query.count() == 3
+    assert AttemptAnswer.query.count() == 3
+    assert Score.query.count() == 1
+    assert migrate_db.migrate_database()  # nothing left to do
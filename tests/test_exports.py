@@ -0,0 +1,67 @@
+import csv
+import io
+import datetime
+from app import db
+from models import Score
+from exports import SCORE_COLUMNS, iter_score_rows, iter_question_rows, stream_csv, stream_xlsx
+import exports
+from tenancy import tenant_scope
+from conftest import ADMIN_PASSWORD, add_tenant, add_user, add_quiz, default_tenant
+
+
+def _score(user, quiz, total, day):
+    db.session.add(Score(quiz_id=quiz.id, user_id=user.id, total_scored=total,
+                         time_stamp_of_attempt=datetime.datetime(2024, 3, day, 23, 30)))
+    db.session.commit()
+
+
+def test_score_rows_filter_by_inclusive_date_range(tenant):
+    user, quiz = add_user(), add_quiz(questions=1)
+    for day, total in ((1, 10), (2, 20), (3, 30)):
+        _score(user, quiz, total, day)
+    rows = list(iter_score_rows(start=datetime.datetime(2024, 3, 2), end=datetime.datetime(2024, 3, 3)))
+    assert [row[-1] for row in rows] == [20, 30]
+    assert rows[0][1:5] == ['student@example.com', 'Student', 'Maths', 'Algebra']
+    assert list(iter_score_rows(quiz_id=quiz.id + 1)) == []
+
+
+def test_csv_is_streamed_in_chunks(monkeypatch):
+    monkeypatch.setattr(exports, 'CHUNK_ROWS', 2)
+    chunks = list(stream_csv(['a', 'b'], ([i, i * i] for i in range(5))))
+    assert len(chunks) == 3
+    assert list(csv.reader(io.StringIO(''.join(chunks))))[-1] == ['4', '16']
+
+
+def test_xlsx_round_trip(tenant):
+    from openpyxl import load_workbook
+
+    quiz = add_quiz(questions=3)
+    data = b''.join(stream_xlsx(['statement'] + ['x'] * 6, iter_question_rows(quiz.id), 'questions'))
+    sheet = load_workbook(io.BytesIO(data)).active
+    assert [row[0] for row in sheet.iter_rows(min_row=2, values_only=True)] == [f'Question {i}?' for i in range(3)]
+
+
+def test_admin_score_export(client, tenant):
+    user, quiz = add_user(), add_quiz(questions=1)
+    _score(user, quiz, 70, 5)
+    client.post('/admin/login', data={'email': 'admin', 'password': ADMIN_PASSWORD})
+    response = client.get('/admin/export/scores?format=csv')
+    assert response.status_code == 200
+    assert response.headers['Content-Disposition'] == 'attachment; filename=scores.csv'
+    rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+    assert rows[0] == SCORE_COLUMNS and rows[1][-1] == '70'
+    assert client.get('/admin/export/scores?start=2024-13-01').status_code == 302
+
+
+def test_streamed_export_stays_in_the_requesting_tenant(app, client):
+    acme = add_tenant(app, 'acme', '--host', 'acme.test')
+    with tenant_scope(default_tenant()):
+        _score(add_user('main@example.com'), add_quiz(questions=1), 10, 1)
+    with tenant_scope(acme):
+        _score(add_user('acme@example.com'), add_quiz(questions=1), 90, 1)
+
+    client.post('/admin/login', data={'email': 'admin', 'password': ADMIN_PASSWORD},
+                base_url='http://acme.test')
+    response = client.get('/admin/export/scores?format=csv', base_url='http://acme.test')
+    rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+    assert [row[1] for row in rows[1:]] == ['acme@example.com']
@@ -0,0 +1,36 @@
+from app import db
+from identity_cache import IdentityCache, identity_cache, load_cached_identity
+from conftest import add_user
+
+
+def test_lru_eviction_and_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr('identity_cache.time.monotonic', lambda: now[0])
+    cache = IdentityCache(maxsize=2, ttl=30)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert cache.get('b') is None and cache.get('c') == 3
+    now[0] += 31
+    assert cache.get('a') is None
+    assert cache.stats()['hits'] == 2 and cache.stats()['misses'] == 2
+
+
+def test_cached_identity_skips_the_database_and_is_evicted_on_update(tenant):
+    user = add_user()
+    key = user.get_id()
+    db.session.expunge_all()
+    assert load_cached_identity(key).full_name == 'Student'
+    hits = identity_cache.hits
+    db.session.expunge_all()
+    cached = load_cached_identity(key)
+    assert identity_cache.hits == hits + 1
+    assert cached.full_name == 'Student'
+    assert 'password' not in identity_cache.get(f'{tenant.id}/{key}')
+
+    cached.full_name = 'Renamed'
+    db.session.commit()
+    assert identity_cache.get(f'{tenant.id}/{key}') is None
+    db.session.expunge_all()
+    assert load_cached_identity(key).full_name == 'Renamed'
@@ -0,0 +1,45 @@
+import sys
+import json
+import queue
+import logging
+from logging_setup import LazyQueueHandler, JsonFormatter, parse_levels
+
+
+def _queued(*args, exc_info=None):
+    handler = LazyQueueHandler(queue.Queue())
+    record = logging.LogRecord('quiz', logging.INFO, __file__, 1, 'quiz %s: %s', args, exc_info)
+    handler.handle(record)
+    return record, handler.queue.get_nowait()
+
+
+def test_records_are_queued_unformatted():
+    record, queued = _queued(7, 'deleted')
+    assert queued is not record
+    assert (queued.msg, queued.args) == ('quiz %s: %s', (7, 'deleted'))
+    assert queued.getMessage() == 'quiz 7: deleted'
+
+
+def test_exception_info_is_kept_for_the_listener():
+    try:
+        raise ValueError('boom')
+    except ValueError:
+        record, queued = _queued(1, 'failed', exc_info=sys.exc_info())
+    assert queued.exc_info[0] is ValueError
+    assert queued.exc_text is None
+    entry = json.loads(JsonFormatter().format(queued))
+    assert entry['message'] == 'quiz 1: failed'
+    assert 'ValueError: boom' in entry['exc_info']
+
+
+def test_mutable_arguments_are_merged_before_queueing():
+    rows = [1, 2]
+    record, queued = _queued(3, rows)
+    rows.append(3)
+    assert queued.args is None
+    assert queued.getMessage() == 'quiz 3: [1, 2]'
+
+
+def test_parse_levels():
+    assert parse_levels(' sqlalchemy.engine=warning, search=DEBUG,') == {'sqlalchemy.engine': 'WARNING',
+                                                                        'search': 'DEBUG'}
+    assert parse_levels(None) == {}
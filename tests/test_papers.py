@@ -0,0 +1,142 @@
+from app import db
+from models import Score, Question
+from papers import build_paper, dump_paper, load_paper, attempt_paper, original_option, invalidate_question_pool
+from conftest import add_user, add_quiz
+
+
+def test_same_seed_same_paper(tenant):
+    quiz = add_quiz(questions=20)
+    quiz.questions_per_attempt, quiz.shuffle_questions = 8, True
+    db.session.commit()
+    paper = build_paper(quiz, 1234)
+    assert paper == build_paper(quiz, 1234)
+    assert len(paper.question_ids) == len(set(paper.question_ids)) == 8
+    assert all(sorted(order) == [1, 2, 3, 4] for order in paper.option_orders.values())
+    assert build_paper(quiz, 4321).question_ids != paper.question_ids
+
+
+def test_unshuffled_and_legacy_papers(tenant):
+    quiz = add_quiz(questions=6)
+    quiz.questions_per_attempt = 3
+    db.session.commit()
+    paper = build_paper(quiz, 7)
+    assert paper.question_ids == sorted(paper.question_ids)
+    assert set(paper.option_orders.values()) == {(1, 2, 3, 4)}
+    legacy = build_paper(quiz, None)
+    assert len(legacy.question_ids) == 6
+
+
+def test_layout_round_trip(tenant):
+    quiz = add_quiz(questions=5)
+    quiz.shuffle_questions = True
+    db.session.commit()
+    paper = build_paper(quiz, 99)
+    assert load_paper(dump_paper(paper)) == paper
+
+
+def test_original_option_maps_back_and_rejects_bad_positions(tenant):
+    quiz = add_quiz(questions=3)
+    quiz.shuffle_questions = True
+    db.session.commit()
+    paper = build_paper(quiz, 5)
+    for qid, order in paper.option_orders.items():
+        assert [original_option(paper, qid, position) for position in (1, 2, 3, 4)] == list(order)
+        assert [original_option(paper, qid, str(position)) for position in (1, 2, 3, 4)] == list(order)
+        for bad in (0, 5, '-1', 'x', '2.0'):
+            assert original_option(paper, qid, bad) is None
+
+
+def _login_student(client):
+    add_user('taker@example.com', 'pw')
+    client.post('/login', data={'email': 'taker@example.com', 'password': 'pw'})
+
+
+def _start(client, quiz):
+    client.get(f'/quiz/{quiz.id}')
+    with client.session_transaction() as session:
+        return load_paper(session[f'paper_{quiz.id}'])
+
+
+def test_submit_grades_positions_on_the_students_paper(client, tenant):
+    quiz = add_quiz(questions=8)
+    quiz.shuffle_questions = True
+    db.session.commit()
+    _login_student(client)
+    paper = _start(client, quiz)
+    correct = {q.id: q.correct_option for q in Question.query.filter_by(quiz_id=quiz.id)}
+    form = {f'question_{qid}': paper.option_orders[qid].index(correct[qid]) + 1 for qid in paper.question_ids}
+    assert client.post(f'/quiz/{quiz.id}/submit', data=form).status_code == 200
+    score = Score.query.one()
+    assert score.total_scored == 100
+    assert load_paper(score.paper_layout) == paper
+
+
+def test_reload_keeps_the_paper(client, tenant):
+    quiz = add_quiz(questions=6)
+    quiz.shuffle_questions, quiz.questions_per_attempt = True, 3
+    db.session.commit()
+    _login_student(client)
+    assert _start(client, quiz) == _start(client, quiz)
+
+
+def test_grading_uses_the_paper_drawn_at_start(client, tenant):
+    quiz = add_quiz(questions=4)
+    quiz.shuffle_questions, quiz.questions_per_attempt = True, 3
+    db.session.commit()
+    _login_student(client)
+    paper = _start(client, quiz)
+
+    # The bank changes mid-attempt and the pool cache is refreshed, as on another worker
+    for i in range(10):
+        db.session.add(Question(quiz_id=quiz.id, question_statement=f'New {i}?', option_1='a', option_2='b',
+                                option_3='c', option_4='d', correct_option=1))
+    db.session.commit()
+    invalidate_question_pool(quiz.id)
+    assert build_paper(quiz, paper.seed) != paper
+
+    correct = {q.id: q.correct_option for q in Question.query.filter_by(quiz_id=quiz.id)}
+    form = {f'question_{qid}': paper.option_orders[qid].index(correct[qid]) + 1 for qid in paper.question_ids}
+    assert client.post(f'/quiz/{quiz.id}/submit', data=form).status_code == 200
+    score = Score.query.one()
+    assert score.total_scored == 100
+    assert load_paper(score.paper_layout) == paper and score.paper_seed == paper.seed
+
+
+def test_submit_without_a_paper_is_rejected(client, tenant):
+    quiz = add_quiz(questions=4)
+    _login_student(client)
+    _start(client, quiz)
+    client.post(f'/quiz/{quiz.id}/submit', data={})
+    response = client.post(f'/quiz/{quiz.id}/submit', data={})
+    assert response.status_code == 302
+    assert Score.query.count() == 1
+
+
+def test_tampered_positions_count_as_unanswered(client, tenant):
+    quiz = add_quiz(questions=2)
+    _login_student(client)
+    paper = _start(client, quiz)
+    form = {f'question_{qid}': value for qid, value in zip(paper.question_ids, ('9', 'abc'))}
+    assert client.post(f'/quiz/{quiz.id}/submit', data=form).status_code == 200
+    assert Score.query.one().total_scored == 0
+
+
+def test_review_keeps_the_paper_after_the_bank_changes(client, tenant):
+    quiz = add_quiz(questions=4)
+    quiz.shuffle_questions, quiz.questions_per_attempt = True, 3
+    db.session.commit()
+    _login_student(client)
+    paper = _start(client, quiz)
+    client.post(f'/quiz/{quiz.id}/submit', data={})
+    score = Score.query.one()
+
+    for i in range(10):
+        db.session.add(Question(quiz_id=quiz.id, question_statement=f'New {i}?', option_1='a', option_2='b',
+                                option_3='c', option_4='d', correct_option=1))
+    db.session.commit()
+    invalidate_question_pool(quiz.id)
+    assert build_paper(quiz, paper.seed) != paper
+    assert attempt_paper(score, quiz) == paper
+    response = client.get(f'/quiz/{quiz.id}/review/{score.id}')
+    assert response.status_code == 200
+    assert b'New 0?' not in response.data
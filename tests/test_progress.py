@@ -0,0 +1,75 @@
+import datetime
+from app import db
+from models import Score
+from progress import lttb, score_series, series_cache
+from archive import archive_scores
+from deletes import delete_in_chunks
+from conftest import ADMIN_PASSWORD, add_user, add_quiz
+
+
+def test_lttb_keeps_endpoints_and_extremes():
+    points = [(x, 50 + (40 if x == 500 else 0) - (45 if x == 700 else 0)) for x in range(1000)]
+    sampled = lttb(points, 50)
+    assert len(sampled) == 50
+    assert sampled[0] == points[0] and sampled[-1] == points[-1]
+    assert (500, 90) in sampled and (700, 5) in sampled
+    assert [p[0] for p in sampled] == sorted(p[0] for p in sampled)
+
+
+def test_lttb_short_series_and_tiny_threshold():
+    points = [(x, x) for x in range(10)]
+    assert lttb(points, 20) == points
+    assert len(lttb(points, 1)) == 3
+
+
+def _scores(user, quiz, count, days_ago=0):
+    when = datetime.datetime.utcnow() - datetime.timedelta(days=days_ago)
+    for i in range(count):
+        db.session.add(Score(quiz_id=quiz.id, user_id=user.id, total_scored=i,
+                             time_stamp_of_attempt=when + datetime.timedelta(minutes=i)))
+    db.session.commit()
+
+
+def test_new_attempt_evicts_the_users_series(tenant):
+    user, other, quiz = add_user(), add_user('other@example.com'), add_quiz(questions=1)
+    _scores(user, quiz, 3)
+    _scores(other, quiz, 2)
+    assert score_series(user.id)['total'] == 3
+    assert score_series(other.id)['total'] == 2
+    hits = series_cache.hits
+    assert score_series(user.id)['total'] == 3
+    assert series_cache.hits == hits + 1
+
+    _scores(user, quiz, 1)
+    misses = series_cache.misses
+    assert score_series(user.id)['total'] == 4
+    assert series_cache.misses == misses + 1
+    # Only the user who attempted the quiz is evicted
+    assert score_series(other.id)['total'] == 2
+    assert series_cache.misses == misses + 1
+
+
+def test_bulk_delete_evicts_cached_series(tenant):
+    user, quiz = add_user(), add_quiz(questions=1)
+    _scores(user, quiz, 5)
+    assert score_series(user.id)['total'] == 5
+    delete_in_chunks(Score, Score.quiz_id == quiz.id, chunk_size=2)
+    assert score_series(user.id)['total'] == 0
+
+
+def test_archiving_evicts_cached_series(tenant):
+    user, quiz = add_user(), add_quiz(questions=1)
+    _scores(user, quiz, 4, days_ago=400)
+    assert score_series(user.id)['total'] == 4
+    assert archive_scores(365) == 4
+    assert score_series(user.id)['total'] == 0
+    assert score_series(user.id, include_archived=True)['total'] == 4
+
+
+def test_admin_chart_url_is_not_html_escaped(app, client, tenant):
+    user = add_user()
+    _scores(user, add_quiz(questions=1), 1)
+    client.post('/admin/login', data={'email': 'admin', 'password': ADMIN_PASSWORD})
+    page = client.get(f'/admin/users/{user.id}?include_archived=1').get_data(as_text=True)
+    assert f'"/progress/series?user_id={user.id}\\u0026include_archived=1"' in page
+    assert '&amp;include_archived' not in page
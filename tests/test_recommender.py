@@ -0,0 +1,72 @@
+import datetime
+from sqlalchemy import event
+from app import db
+from models import Score, AttemptAnswer, UserChapterSummary, PracticeSuggestion
+from archive import archive_scores, delete_user_archive
+from recommender import mastery_matrix, recommend_practice, practice_suggestions
+from conftest import add_user, add_quiz
+
+
+def _attempt(user, quiz, correct, days_ago=0):
+    """
+    An attempt answering the first `correct` questions right and the rest wrong
+    """
+    questions = sorted(quiz.questions, key=lambda q: q.id)
+    score = Score(quiz_id=quiz.id, user_id=user.id, total_scored=round(100 * correct / len(questions)),
+                  time_stamp_of_attempt=datetime.datetime.utcnow() - datetime.timedelta(days=days_ago))
+    db.session.add(score)
+    db.session.flush()
+    for i, question in enumerate(questions):
+        chosen = question.correct_option if i < correct else question.correct_option % 4 + 1
+        db.session.add(AttemptAnswer(score_id=score.id, question_id=question.id, chosen_option=chosen,
+                                     is_correct=i < correct))
+    db.session.commit()
+    return score
+
+
+def test_archiving_keeps_the_chapter_evidence(tenant):
+    user, quiz = add_user(), add_quiz(questions=4)
+    _attempt(user, quiz, 1, days_ago=400)
+    _attempt(user, quiz, 3, days_ago=1)
+    chapter_ids = [quiz.chapter_id]
+    before = mastery_matrix([user.id], chapter_ids, 0.5)
+
+    assert archive_scores(365) == 1
+    assert AttemptAnswer.query.count() == 4
+    summary = db.session.get(UserChapterSummary, (user.id, quiz.chapter_id))
+    assert (summary.attempts, summary.total_scored, summary.answered, summary.correct) == (1, 25, 4, 1)
+
+    after = mastery_matrix([user.id], chapter_ids, 0.5)
+    assert after[0].tolist() == before[0].tolist()
+    assert after[1].tolist() == before[1].tolist()
+
+
+def test_deleting_the_archive_drops_the_chapter_summary(tenant):
+    user, quiz = add_user(), add_quiz(questions=4)
+    _attempt(user, quiz, 2, days_ago=400)
+    archive_scores(365)
+    delete_user_archive(user.id)
+    db.session.commit()
+    assert UserChapterSummary.query.count() == 0
+
+
+def test_suggestions_survive_archiving_and_load_in_one_query(tenant):
+    user, quiz = add_user(), add_quiz(questions=4)
+    _attempt(user, quiz, 1, days_ago=400)
+    archive_scores(365)
+    assert recommend_practice() == 1
+    suggestion = PracticeSuggestion.query.filter_by(user_id=user.id).one()
+    assert suggestion.mastery < 0.5
+    user_id, quiz_id = user.id, quiz.id
+    db.session.expire_all()
+
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        suggestions = practice_suggestions(user_id)
+        names = [(s.chapter.subject.name, s.chapter.name, s.quiz.id) for s in suggestions]
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+    assert names == [('Maths', 'Algebra', quiz_id)]
+    assert len(statements) == 1
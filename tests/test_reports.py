@@ -0,0 +1,94 @@
+import io
+import json
+import pickle
+import zipfile
+import pytest
+import reports
+from app import db
+from models import Score, AttemptAnswer, Question
+from reports import ReportMetrics, build_snapshot, iter_reports, stream_report_zip
+from conftest import ADMIN_PASSWORD, add_user, add_quiz
+
+
+@pytest.fixture
+def cohort(tenant):
+    quiz = add_quiz(questions=4)
+    user = add_user()
+    question_ids = [q.id for q in Question.query.filter_by(quiz_id=quiz.id).order_by(Question.id)]
+    for total in (20, 50, 50, 90):
+        score = Score(quiz_id=quiz.id, user_id=user.id, total_scored=total)
+        db.session.add(score)
+        db.session.flush()
+        db.session.add(AttemptAnswer(score_id=score.id, question_id=question_ids[0], chosen_option=1,
+                                     is_correct=True))
+    db.session.commit()
+    return quiz
+
+
+def test_snapshot_statistics(cohort):
+    snapshot, attempts = build_snapshot(cohort)
+    stats = snapshot['stats']
+    assert (stats['attempts'], stats['mean'], stats['median'], stats['highest'], stats['lowest']) == \
+        (4, 52.5, 50, 90, 20)
+    assert stats['pass_rate'] == 75
+    assert sum(stats['histogram']) == 4
+    assert [a['rank'] for a in attempts] == [4, 2, 2, 1]
+    assert stats['questions'][min(snapshot['questions'])]['percent_correct'] == 100
+
+
+def test_small_cohort_renders_in_process(cohort, monkeypatch):
+    monkeypatch.setattr(reports, '_worker_pool', lambda workers, snapshot: pytest.fail('pool used'))
+    snapshot, attempts = build_snapshot(cohort)
+    names = [name for name, _ in iter_reports(snapshot, attempts, workers=4)]
+    assert names[0] == 'cohort.html' and len(names) == 5
+
+
+def test_pool_is_reused_between_runs(cohort, monkeypatch):
+    monkeypatch.setattr(reports, 'REPORT_INPROCESS_MAX', 0)
+    monkeypatch.setattr(reports, 'REPORT_CHUNK', 1)
+    snapshot, attempts = build_snapshot(cohort)
+    first = dict(iter_reports(snapshot, attempts, workers=2))
+    pool = reports._pool
+    second = dict(iter_reports(snapshot, attempts, workers=2))
+    assert reports._pool is pool
+    assert first == second and len(first) == 5
+    in_process = dict(iter_reports(snapshot, attempts, workers=1))
+    assert in_process == first
+
+
+def test_workers_get_the_snapshot_once(cohort, monkeypatch):
+    monkeypatch.setattr(reports, 'REPORT_INPROCESS_MAX', 0)
+    monkeypatch.setattr(reports, 'REPORT_CHUNK', 1)
+    snapshot, attempts = build_snapshot(cohort)
+    dict(iter_reports(snapshot, attempts, workers=2))
+    pool = reports._pool
+
+    tasks = []
+    submit = reports.ProcessPoolExecutor.submit
+    monkeypatch.setattr(reports.ProcessPoolExecutor, 'submit',
+                        lambda self, fn, *args: tasks.append(pickle.dumps((fn, args))) or submit(self, fn, *args))
+    renamed, attempts = build_snapshot(cohort)
+    renamed['quiz']['chapter'] = 'Renamed chapter'
+    reports_by_name = dict(iter_reports(renamed, attempts, workers=2))
+    assert reports._pool is not pool
+    # Each task carries its attempt, not the answer key and cohort statistics
+    assert len(tasks) == 4 and all(len(task) < len(pickle.dumps(renamed)) for task in tasks)
+    assert not any(b'Renamed chapter' in task for task in tasks)
+    assert all(b'Renamed chapter' in data for name, data in reports_by_name.items() if name.startswith('attempts/'))
+
+
+def test_zip_stream(cohort):
+    snapshot, attempts = build_snapshot(cohort)
+    metrics = ReportMetrics()
+    archive = zipfile.ZipFile(io.BytesIO(b''.join(
+        stream_report_zip(iter_reports(snapshot, attempts, metrics=metrics), metrics))))
+    assert archive.testzip() is None
+    assert json.loads(archive.read('metrics.json'))['reports'] == 5
+    assert len([n for n in archive.namelist() if n.startswith('attempts/')]) == 4
+
+
+def test_report_download(client, cohort):
+    client.post('/admin/login', data={'email': 'admin', 'password': ADMIN_PASSWORD})
+    response = client.get(f'/admin/quizzes/{cohort.id}/reports')
+    assert response.mimetype == 'application/zip'
+    assert 'cohort.html' in zipfile.ZipFile(io.BytesIO(response.data)).namelist()
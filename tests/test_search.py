@@ -0,0 +1,38 @@
+from app import db
+from models import Question
+from search import index_questions, unindex_questions, search_questions, rebuild_search_index
+from conftest import add_quiz
+
+
+def _statements(results):
+    return [result['question_statement'] for result in results]
+
+
+def test_search_ranks_statement_hits_and_matches_prefixes(tenant):
+    quiz = add_quiz(questions=0)
+    questions = [Question(quiz_id=quiz.id, question_statement=statement, option_1=option, option_2='b',
+                          option_3='c', option_4='d', correct_option=1)
+                 for statement, option in (('What is a polynomial?', 'a'),
+                                           ('Pick the odd one out', 'polynomial'),
+                                           ('Define a matrix', 'a'))]
+    db.session.add_all(questions)
+    db.session.flush()
+    index_questions(questions)
+    db.session.commit()
+
+    assert _statements(search_questions('polynomial')) == ['What is a polynomial?', 'Pick the odd one out']
+    assert _statements(search_questions('matr')) == ['Define a matrix']
+    assert search_questions('polynomial', quiz_id=quiz.id + 1) == []
+
+    unindex_questions([questions[0].id])
+    db.session.commit()
+    assert _statements(search_questions('polynomial')) == ['Pick the odd one out']
+
+
+def test_query_syntax_is_never_interpreted(tenant):
+    add_quiz(questions=2)
+    rebuild_search_index()
+    db.session.commit()
+    assert _statements(search_questions('Question 1? OR NEAR(')) == []
+    assert _statements(search_questions('question 1')) == ['Question 1?']
+    assert search_questions('  "*  ') == []
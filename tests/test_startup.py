@@ -0,0 +1,53 @@
+from app import create_app, db
+from models import Admin
+from werkzeug.security import check_password_hash
+from tenancy import tenant_scope
+from conftest import default_tenant
+
+
+def _config(tmp_path, name):
+    return {
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / name}",
+        'BACKUP_DIR': str(tmp_path / 'backups'),
+        'UPLOAD_FOLDER': str(tmp_path / 'uploads'),
+        'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1000',
+    }
+
+
+def test_init_db_on_a_second_app(tmp_path):
+    first = create_app(_config(tmp_path, 'first.db'))
+    app = create_app(_config(tmp_path, 'second.db'))
+    for built in (first, app):
+        assert set(built.config['STARTUP_TIMINGS']) == {'import_ms', 'create_app_ms'}
+        assert all(ms >= 0 for ms in built.config['STARTUP_TIMINGS'].values())
+
+    for name in ('init-db', 'archive-scores', 'recommend-practice'):
+        options = [opt for param in app.cli.commands[name].params for opt in param.opts]
+        assert len(options) == len(set(options)), name
+
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=['init-db', '--admin-password', 'first-secret'])
+    assert result.exit_code == 0, result.output
+    assert result.output == 'Database initialized.\n'
+    # A second run keeps the existing account
+    assert runner.invoke(args=['init-db']).output == 'Database initialized.\n'
+
+    with app.app_context():
+        try:
+            with tenant_scope(default_tenant()):
+                assert check_password_hash(Admin.query.filter_by(username='admin').one().password, 'first-secret')
+        finally:
+            db.session.remove()
+            db.engine.dispose()
+
+
+def test_init_db_generates_a_password_once(tmp_path):
+    app = create_app(_config(tmp_path, 'quizmaster.db'))
+    result = app.test_cli_runner().invoke(args=['init-db'])
+    assert result.exit_code == 0, result.output
+    initialized, account = result.output.splitlines()
+    assert initialized == 'Database initialized.'
+    assert account.startswith('Admin account: admin / ') and len(account.rsplit(' ', 1)[1]) >= 12
+    with app.app_context():
+        db.engine.dispose()
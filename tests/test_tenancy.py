@@ -0,0 +1,141 @@
+import pytest
+from flask import g
+from sqlalchemy import delete, select
+from werkzeug.security import check_password_hash
+from app import db
+from auth import LoginThrottled, check_login_allowed
+from models import Tenant, Admin, User, Subject, Quiz, Question
+from search import rebuild_search_index, search_questions
+from tenancy import make_engine, tenant_registry, tenant_scope
+from conftest import add_tenant, add_user, add_quiz, default_tenant
+
+
+def _admin_of(slug):
+    with tenant_scope(tenant_registry.ref(Tenant.query.filter_by(slug=slug).one())):
+        return Admin.query.filter_by(username='admin').one()
+
+
+def test_new_tenant_gets_a_random_admin_password(app):
+    result = app.test_cli_runner().invoke(args=['tenant', 'add', 'acme', '--host', 'quiz.acme.edu'])
+    assert result.exit_code == 0, result.output
+    password = result.output.split('Admin account: admin / ')[1].strip()
+    assert len(password) >= 16 and password != 'admin@123'
+    assert check_password_hash(_admin_of('acme').password, password)
+
+
+def test_new_tenant_takes_the_given_admin_password(app):
+    result = app.test_cli_runner().invoke(args=['tenant', 'add', 'beta', '--admin-password', 'beta-secret'])
+    assert result.exit_code == 0, result.output
+    assert 'Admin account' not in result.output
+    assert check_password_hash(_admin_of('beta').password, 'beta-secret')
+
+
+def test_init_db_keeps_an_existing_admin(app):
+    result = app.test_cli_runner().invoke(args=['init-db'])
+    assert result.exit_code == 0, result.output
+    assert 'Admin account' not in result.output
+
+
+def _emails(engine, tenant_id):
+    with engine.connect() as conn:
+        return conn.execute(select(User.email).where(User.tenant_id == tenant_id).order_by(User.id)).scalars().all()
+
+
+def test_reads_and_bulk_writes_stay_in_the_tenant(app):
+    acme = add_tenant(app, 'acme')
+    with tenant_scope(default_tenant()):
+        add_user('main@example.com')
+        add_quiz(questions=2)
+    with tenant_scope(acme):
+        add_user('acme@example.com')
+        assert [user.email for user in User.query] == ['acme@example.com']
+        assert db.session.execute(select(User.email)).scalars().all() == ['acme@example.com']
+        assert Question.query.count() == 0 and Quiz.query.count() == 0
+        assert Admin.query.count() == 1
+        User.query.update({'full_name': 'Renamed'})
+        db.session.execute(delete(Admin))
+        db.session.commit()
+    with tenant_scope(default_tenant()):
+        assert User.query.one().full_name == 'Student'
+        assert Question.query.count() == 2
+        assert Admin.query.count() == 1
+
+
+def test_new_rows_are_stamped_with_the_tenant(app):
+    acme = add_tenant(app, 'acme')
+    with tenant_scope(acme):
+        user, quiz = add_user(), add_quiz(questions=1)
+        assert user.tenant_id == quiz.tenant_id == Question.query.one().tenant_id == acme.id
+        assert Subject.query.one().tenant_id == acme.id
+
+
+def test_own_database_tenants_are_routed_to_their_engine(app, tmp_path):
+    beta = add_tenant(app, 'beta', '--database-uri', f"sqlite:///{tmp_path / 'beta.db'}")
+    assert beta.engine is not None
+    with tenant_scope(beta):
+        add_user('beta@example.com')
+        add_quiz(questions=1)
+        rebuild_search_index()
+        db.session.commit()
+        assert [user.email for user in User.query] == ['beta@example.com']
+        # Tenants themselves stay in the shared database
+        assert Tenant.query.count() == 2
+    assert _emails(beta.engine, beta.id) == ['beta@example.com']
+    assert _emails(db.engine, beta.id) == []
+    with tenant_scope(beta):
+        assert search_questions('question') != []
+
+
+def test_login_is_only_valid_on_its_tenant(app, client, tmp_path):
+    # An own database reuses ids, so the session's user:1 exists on both tenants
+    beta = add_tenant(app, 'beta', '--host', 'beta.test', '--database-uri', f"sqlite:///{tmp_path / 'beta.db'}")
+    with tenant_scope(default_tenant()):
+        main_id = add_user('main@example.com', 'pw').id
+    with tenant_scope(beta):
+        assert add_user('beta@example.com', 'pw').id == main_id
+    client.post('/login', data={'email': 'main@example.com', 'password': 'pw'})
+    assert client.get('/dashboard').status_code == 200
+
+    # Requests share the test's app context, and with it the user Flask-Login cached on g
+    g.pop('_login_user', None)
+    client.set_cookie('session', client.get_cookie('session').value, domain='beta.test')
+    response = client.get('/dashboard', base_url='http://beta.test')
+    assert response.status_code == 302 and '/login' in response.headers['Location']
+
+
+def test_login_throttling_is_per_tenant(app):
+    acme = add_tenant(app, 'acme')
+    with tenant_scope(acme):
+        for _ in range(app.config['LOGIN_ACCOUNT_BURST']):
+            check_login_allowed('10.3.0.1', 'both-tenants@example.com')
+        with pytest.raises(LoginThrottled):
+            check_login_allowed('10.3.0.1', 'both-tenants@example.com')
+    with tenant_scope(default_tenant()):
+        check_login_allowed('10.3.0.1', 'both-tenants@example.com')
+
+
+def test_tenant_move_round_trip(make_app, tmp_path):
+    with make_app(TENANT_CACHE_TTL=0) as app:
+        acme = add_tenant(app, 'acme', '--host', 'acme.test')
+        with tenant_scope(acme):
+            add_user('acme@example.com', 'pw')
+            add_quiz(questions=3)
+
+        runner = app.test_cli_runner()
+        for name in ('first.db', 'second.db'):
+            result = runner.invoke(args=['tenant', 'move', 'acme', '--database-uri',
+                                         f"sqlite:///{tmp_path / name}"])
+            assert result.exit_code == 0, result.output
+
+        moved = tenant_registry.ref(Tenant.query.filter_by(slug='acme').one())
+        assert moved.active and str(moved.engine.url).endswith('second.db')
+        assert _emails(db.engine, acme.id) == []
+        assert _emails(make_engine(f"sqlite:///{tmp_path / 'first.db'}"), acme.id) == []
+        assert _emails(moved.engine, acme.id) == ['acme@example.com']
+        with tenant_scope(moved):
+            assert Question.query.count() == 3
+            assert [row['question_statement'] for row in search_questions('question 2')] == ['Question 2?']
+
+        client = app.test_client()
+        client.post('/login', data={'email': 'acme@example.com', 'password': 'pw'}, base_url='http://acme.test')
+        assert client.get('/dashboard', base_url='http://acme.test').status_code == 200